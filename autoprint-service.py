@@ -10,7 +10,11 @@ GitHub: https://github.com/PartonIT/AutoPrint-Service
 License: MIT
 """
 
+import argparse
+import atexit
+import bisect
 import imaplib
+import asyncio
 import email
 import time
 import traceback
@@ -21,9 +25,30 @@ import subprocess
 import uuid
 import threading
 import re
+import pathlib
+import json
+import base64
+import gzip
+import hashlib
+import itertools
+import struct
+import html
+import http.client
+import mimetypes
+import urllib.parse
+import urllib.request
+import queue
+import quopri
+import signal
 import shutil
+import socket
+import ssl
+import sqlite3
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 from email.header import decode_header
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 
 # Try to import colorama for colors
 try:
@@ -34,6 +59,13 @@ except ImportError:
     COLORAMA_AVAILABLE = False
     print("Note: Install colorama for colored output: pip install colorama")
 
+# websocket-client is only needed for PRINT_BACKEND = "devtools"
+try:
+    import websocket
+    WEBSOCKET_AVAILABLE = True
+except ImportError:
+    WEBSOCKET_AVAILABLE = False
+
 # ==========================
 # CONFIGURATION
 # ==========================
@@ -48,36 +80,467 @@ MAILBOX = "Inbox"
 POLL_INTERVAL_SECONDS = 30
 SUBJECT_PREFIX = "[PRINT]"
 
+# Watch several accounts/mailboxes from one process. Each entry overrides the settings
+# above for that mailbox; leave empty to watch just the single account configured above.
+ACCOUNTS = [
+    # {"name": "store1", "username": "store1@business.com", "password": "...", "subject_prefix": "[STORE1]"},
+    # {"name": "store2", "host": "imap.gmail.com", "username": "store2@business.com", "password": "...",
+    #  "mailbox": "Inbox", "subject_prefix": "[STORE2]"},
+]
+
 AUTO_PRINT_ENABLED = True
 CHROME_PATH = ""
+# Handled UIDs and each mailbox's UIDVALIDITY/highest handled UID (so each poll only
+# searches new mail), keyed by account, mailbox, UIDVALIDITY and UID
+STATE_DB_FILE = "autoprint_state.db"
+# Writes are committed together, at most this many seconds or this many UIDs apart.
+# Flags are never sent to the server before the UIDs they belong to are committed.
+STATE_COMMIT_INTERVAL_SECONDS = 2
+STATE_COMMIT_BATCH_SIZE = 100
+# Handled UIDs older than this, and at or below the mailbox's watermark, are compacted away
+STATE_RETENTION_DAYS = 90
+# Write-ahead journal of each job's stages (fetched, rendered, submitted, printed, flagged,
+# deleted). After a crash, unfinished jobs resume from their last stage using the copies
+# kept in JOURNAL_SPOOL_DIR, without fetching or rendering them again.
+JOURNAL_ENABLED = True
+JOURNAL_FILE = "autoprint_journal.jsonl"
+JOURNAL_SPOOL_DIR = "autoprint_spool"
+# Failed jobs are retried, waiting RETRY_BACKOFF_INITIAL_SECONDS and doubling up to
+# RETRY_BACKOFF_MAX_SECONDS. A failed print is retried from the PDF/page already rendered.
+# After RETRY_MAX_ATTEMPTS failures the job is given up: its email is marked read and the
+# rendered file is moved to DEAD_LETTER_DIR for a manual reprint.
+RETRY_MAX_ATTEMPTS = 5
+RETRY_BACKOFF_INITIAL_SECONDS = 30
+RETRY_BACKOFF_MAX_SECONDS = 15 * 60
+DEAD_LETTER_DIR = "autoprint_dead_letter"
+# One JSON line per finished email (UID, Message-ID, subject, stage timings, printer, outcome)
+# in a file per day under JOB_LOG_DIR, queried with `autoprint-service.py jobs ...`.
+# Day files older than JOB_LOG_RETENTION_DAYS are deleted (0 = keep forever).
+JOB_LOG_ENABLED = True
+JOB_LOG_DIR = "autoprint_jobs"
+JOB_LOG_RETENTION_DAYS = 365
+# The first match in a subject is indexed as the order number, for `jobs find "#1234"`
+JOB_LOG_ORDER_PATTERN = r"#\s*(\d+)"
+# Files used by older versions; imported into STATE_DB_FILE once, then renamed to *.migrated
 PRINTED_UIDS_FILE = "printed_uids.txt"
+UID_STATE_FILE = "uid_state.json"
+# Maximum seconds to wait for a print job to finish. Jobs normally complete as soon as
+# Chrome reports them done; this is only the ceiling for a stuck job.
 CHROME_PRINT_WAIT_SECONDS = 8
+# Kiosk Chrome that is still running at that limit is stopped. It has usually handed the
+# page to the printer by then (on macOS Chrome stays open after its last window closes),
+# so the job is logged as "unconfirmed": not reprinted, and its email is kept rather than
+# deleted. Set to True to retry it as a failed print instead, at the risk of a duplicate slip.
+CHROME_RETRY_ON_TIMEOUT = False
 TEMP_FILE_CLEANUP_HOURS = 6
 
+# How jobs reach the printer:
+#   "chrome"   - start Chrome with --kiosk-printing for every job (default)
+#   "devtools" - keep one headless Chrome running, render each job to PDF over the
+#                DevTools protocol and send the PDF to the printer
+#                (needs: pip install websocket-client; spooled with SPOOLER on Linux/macOS)
+PRINT_BACKEND = "chrome"
+PRINTER_NAME = ""  # empty = system default printer
+# How the devtools backend hands PDFs to the printer on Linux/macOS:
+#   "lp"  - CUPS / System V lp (default)
+#   "lpr" - BSD lpr
+#   "ipp" - send straight to CUPS over IPP at IPP_PRINTER_URI (no command needed)
+SPOOLER = "lp"
+SPOOLER_COMMAND = ""  # path to lp/lpr when it isn't on PATH (or a stub script for testing)
+IPP_PRINTER_URI = "ipp://localhost:631/printers/{printer}"
+# During bursts, send up to this many jobs waiting for the same printer in one spool call
+SPOOL_BATCH_SIZE = 10
+# Restart the headless Chrome after this many jobs, or when it uses more memory than this
+CHROME_RECYCLE_AFTER_JOBS = 500
+CHROME_MAX_MEMORY_MB = 1024
+# Keep rendered PDFs keyed by a hash of the email's HTML, so duplicate notifications and
+# reprints skip Chrome entirely (devtools backend only). Least recently used PDFs are
+# dropped past the size limit, and any PDF unused for the max age.
+PDF_CACHE_ENABLED = True
+PDF_CACHE_MAX_MB = 200
+PDF_CACHE_MAX_AGE_HOURS = 7 * 24
+# Download images and stylesheets that emails link to (store logo, product thumbnails)
+# into a local cache and point the page at the local copies, so rendering doesn't wait on
+# the network and still works when it is down. Copies are refreshed after the TTL (the old
+# copy is used if the refresh fails) and dropped once unused for that long or over the size limit.
+ASSET_CACHE_ENABLED = True
+ASSET_CACHE_TTL_HOURS = 24
+ASSET_CACHE_MAX_MB = 200
+ASSET_MAX_DOWNLOAD_MB = 5
+ASSET_FETCH_TIMEOUT_SECONDS = 10
+# Lay plain-text emails (no HTML part) out straight into a PDF instead of rendering them
+# in Chrome (devtools backend only)
+NATIVE_TEXT_RENDER_ENABLED = True
+TEXT_PAGE_SIZE = "A4"  # "A4" or "Letter"
+TEXT_FONT_SIZE = 10
+
+# Fetching, rendering and printing run as separate stages connected by bounded queues,
+# so a slow printer doesn't hold up IMAP and a slow fetch doesn't leave the printer idle.
+# Fetching pauses while RENDER_QUEUE_SIZE jobs are waiting to render; rendering pauses
+# while PRINT_QUEUE_SIZE jobs are waiting for the same printer.
+RENDER_WORKERS = 2
+RENDER_QUEUE_SIZE = 20
+PRINT_QUEUE_SIZE = 10
+# Merge mode for busy periods: up to MERGE_BATCH_SIZE emails arriving within
+# MERGE_WINDOW_SECONDS of each other are combined into one document (one email per page),
+# rendered and printed once. 0 = print every email separately
+MERGE_BATCH_SIZE = 0
+MERGE_WINDOW_SECONDS = 15
+
+# When jobs queue up, lower numbers print first. Each rule matches a header ("subject",
+# "from", "x-priority", ...) against a regular expression (case-insensitive); the most
+# urgent matching rule sets the job's priority, otherwise it gets DEFAULT_PRIORITY.
+PRIORITY_RULES = [
+    {"field": "subject", "pattern": r"\[EXPRESS\]", "priority": 1},
+    {"field": "x-priority", "pattern": r"^\s*[12]\b", "priority": 2},  # sent as High/Highest
+]
+DEFAULT_PRIORITY = 5
+# A waiting job moves up one priority level every this many seconds, so nothing waits forever
+PRIORITY_AGING_SECONDS = 60
+
+# Fetch headers for all new messages in one round-trip, filter on subject, then download
+# full bodies only for the matches, several messages per FETCH
+BATCHED_FETCH_ENABLED = True
+FETCH_HEADER_BATCH_SIZE = 500
+FETCH_BODY_BATCH_SIZE = 10
+# Read BODYSTRUCTURE first and download only the HTML/text part that gets printed,
+# so attachments never cross the wire (requires BATCHED_FETCH_ENABLED)
+PARTIAL_FETCH_ENABLED = True
+
 # Delete email from inbox after successful print (OFF by default for safety)
 # When enabled, emails will be PERMANENTLY DELETED from inbox after confirmed successful print
 # Temp files are still managed separately - this only affects the email inbox
 # If print fails, email is NOT deleted and remains in inbox for retry
 DELETE_EMAIL_AFTER_PRINT = False
 
+# Use IMAP IDLE (push) to react to new mail immediately when the server supports it
+# Falls back to polling every POLL_INTERVAL_SECONDS when IDLE is not advertised
+IMAP_IDLE_ENABLED = True
+# Re-issue IDLE before the server drops it (RFC 2177 servers time out after ~29 minutes)
+IMAP_IDLE_RENEW_SECONDS = 25 * 60
+
+# Keep one IMAP session open; send NOOP when it has been quiet this long to detect dead sockets.
+# NOOP can't be sent while idling, so TCP keepalive probes start after the same quiet time
+# instead: a connection silently dropped by a NAT or firewall fails within a minute of that
+IMAP_NOOP_INTERVAL_SECONDS = 120
+# Socket read timeout so a silently dropped connection can't hang the daemon
+IMAP_SOCKET_TIMEOUT_SECONDS = 120
+# Reconnect backoff after a broken connection (doubles on each failure up to the max)
+RECONNECT_BACKOFF_INITIAL_SECONDS = 1
+RECONNECT_BACKOFF_MAX_SECONDS = 300
+
+# Serve per-stage latency histograms, job counters, queue depths and reconnect counts at
+# http://METRICS_HOST:METRICS_PORT/metrics in the Prometheus text format
+METRICS_ENABLED = True
+METRICS_HOST = "127.0.0.1"  # "0.0.0.0" to let a Prometheus on another machine scrape it
+METRICS_PORT = 9464
+
+# The dashboard is redrawn at most this many times per second, rewriting only changed lines
+UI_MAX_FPS = 4
+# With --headless there is no dashboard; a JSON status line goes to stdout this often instead
+HEADLESS_STATUS_INTERVAL_SECONDS = 60
+
 DEBUG = False
 
 # Log file location
 LOG_FILE = "autoprint.log"
+# Log lines are written by a background thread, in batches at most this many seconds apart
+LOG_FLUSH_INTERVAL_SECONDS = 1
+# Lines waiting to be written; if the writer falls this far behind, new lines are dropped (and counted)
+LOG_QUEUE_SIZE = 10000
+# Start a new log file past this size or when the date changes; older files are gzip-compressed
+# (autoprint.log.1.gz is the most recent) and LOG_BACKUP_COUNT of them are kept
+LOG_MAX_MB = 10
+LOG_ROTATE_DAILY = True
+LOG_BACKUP_COUNT = 14
 
 # ==========================
 # Logging Helper
 # ==========================
 
+class LogWriter:
+    """Appends log lines to a file from a background thread.
+
+    write() only queues the line, so callers (often holding the UI lock) never wait on
+    disk. The thread sleeps until a line arrives, then writes everything that queued up
+    within LOG_FLUSH_INTERVAL_SECONDS of it in one go, and rotates the file by size and date.
+    """
+
+    STOP = object()  # queued by close()
+
+    def __init__(self, path):
+        self.path = path
+        self.queue = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+        self.dropped = 0
+        self.dropped_lock = threading.Lock()
+        self.file = None
+        self.file_date = None
+        self.closed = False
+        self.thread = threading.Thread(target=self._run, name="log-writer", daemon=True)
+        self.thread.start()
+
+    def write(self, line):
+        try:
+            self.queue.put_nowait(line)
+        except queue.Full:
+            with self.dropped_lock:
+                self.dropped += 1
+
+    def _run(self):
+        lines = []
+        flush_at = None
+        stopping = False
+        while not stopping:
+            # Idle, this blocks with no timeout; a timeout is only set while a batch is waiting
+            try:
+                timeout = None if flush_at is None else max(0, flush_at - time.monotonic())
+                item = self.queue.get(timeout=timeout)
+            except queue.Empty:
+                item = None
+            if item is self.STOP:
+                stopping = True
+            elif item is not None:
+                lines.append(item)
+                if flush_at is None:
+                    flush_at = time.monotonic() + LOG_FLUSH_INTERVAL_SECONDS
+            if stopping or (flush_at is not None and time.monotonic() >= flush_at):
+                try:
+                    while True:
+                        item = self.queue.get_nowait()
+                        if item is self.STOP:
+                            stopping = True
+                        else:
+                            lines.append(item)
+                except queue.Empty:
+                    pass
+                with self.dropped_lock:
+                    dropped, self.dropped = self.dropped, 0
+                if dropped:
+                    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+                    lines.append(f"[{timestamp}] [WARNING] {dropped} log line(s) dropped, the log writer fell behind\n")
+                if lines:
+                    self._write_lines(lines)
+                lines = []
+                flush_at = None
+        if self.file is not None:
+            self.file.close()
+
+    def _write_lines(self, lines):
+        try:
+            if self.file is None:
+                self._open()
+            elif LOG_ROTATE_DAILY and datetime.now().date() != self.file_date:
+                self._rotate()
+            self.file.write("".join(lines))
+            self.file.flush()
+            if LOG_MAX_MB and os.fstat(self.file.fileno()).st_size >= LOG_MAX_MB * 1024 * 1024:
+                self._rotate()
+        except:
+            pass  # Fail silently if logging fails
+
+    def _open(self):
+        self.file = open(self.path, "a", encoding="utf-8")
+        st = os.fstat(self.file.fileno())
+        # A log left over from an earlier day is rotated before anything new goes in
+        self.file_date = datetime.fromtimestamp(st.st_mtime).date() if st.st_size else datetime.now().date()
+        if LOG_ROTATE_DAILY and self.file_date != datetime.now().date():
+            self._rotate()
+
+    def _rotate(self):
+        self.file.close()
+        self.file = None
+        if LOG_BACKUP_COUNT > 0:
+            for n in range(LOG_BACKUP_COUNT - 1, 0, -1):
+                older = f"{self.path}.{n}.gz"
+                if os.path.exists(older):
+                    os.replace(older, f"{self.path}.{n + 1}.gz")
+            rotated = f"{self.path}.1"
+            os.replace(self.path, rotated)
+            with open(rotated, "rb") as src, gzip.open(rotated + ".gz", "wb") as dst:
+                shutil.copyfileobj(src, dst)
+            os.remove(rotated)
+        else:
+            os.remove(self.path)
+        self._open()
+
+    def close(self):
+        """Write out everything queued so far and stop the thread."""
+        if not self.closed:
+            self.closed = True
+            try:
+                self.queue.put(self.STOP, timeout=10)
+            except queue.Full:
+                return
+            self.thread.join(timeout=10)
+
+_log_writer = None
+_log_writer_lock = threading.Lock()
+
 def log_to_file(message, level="INFO"):
-    """Write log entry to file with timestamp."""
-    try:
-        timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        log_entry = f"[{timestamp}] [{level}] {message}\n"
-        with open(LOG_FILE, "a", encoding="utf-8") as f:
-            f.write(log_entry)
-    except:
-        pass  # Fail silently if logging fails
+    """Queue a log entry with timestamp; the background LogWriter writes it to LOG_FILE."""
+    global _log_writer
+    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    if _log_writer is None:
+        with _log_writer_lock:
+            if _log_writer is None:
+                _log_writer = LogWriter(LOG_FILE)
+                atexit.register(_log_writer.close)
+    _log_writer.write(f"[{timestamp}] [{level}] {message}\n")
+
+def close_log():
+    """Flush queued log lines to disk (at shutdown)."""
+    if _log_writer is not None:
+        _log_writer.close()
+
+# ==========================
+# Metrics
+# ==========================
+
+class StageTimer:
+    """`with metrics.time("stage"):` adds the block's duration to that stage's histogram."""
+
+    __slots__ = ("metrics", "stage", "started")
+
+    def __init__(self, metrics, stage):
+        self.metrics = metrics
+        self.stage = stage
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.metrics.observe(self.stage, time.perf_counter() - self.started)
+        return False
+
+
+def format_metric_labels(labels):
+    """{name="value",...} for (name, value) pairs, escaped as the Prometheus text format requires."""
+    if not labels:
+        return ""
+    pairs = []
+    for name, value in labels:
+        value = str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        pairs.append(f'{name}="{value}"')
+    return "{" + ",".join(pairs) + "}"
+
+
+class Metrics:
+    """Per-stage latency histograms and counters, rendered in the Prometheus text format.
+
+    Recording is a bisect and two additions under a lock, so it can sit on the hot path.
+    Values that already exist elsewhere (queue depths, reconnects) are not copied here
+    but read by collectors when /metrics is scraped.
+    """
+
+    STAGE_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+    COUNTERS = {
+        "autoprint_jobs_total": "Emails that left the pipeline, by outcome.",
+        "autoprint_job_retries_total": "Failed render or print attempts scheduled for a retry.",
+    }
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.stages = {}  # stage -> [bucket counts (last is +Inf), sum of seconds]
+        self.counters = {}  # (name, labels) -> value
+        self.collectors = []
+
+    def time(self, stage):
+        return StageTimer(self, stage)
+
+    def observe(self, stage, seconds):
+        index = bisect.bisect_left(self.STAGE_BUCKETS, seconds)
+        with self.lock:
+            histogram = self.stages.get(stage)
+            if histogram is None:
+                histogram = self.stages[stage] = [[0] * (len(self.STAGE_BUCKETS) + 1), 0.0]
+            histogram[0][index] += 1
+            histogram[1] += seconds
+
+    def inc(self, name, amount=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    def add_collector(self, collector):
+        """collector() returns [(name, type, help, [(labels dict, value)])], evaluated at scrape time."""
+        self.collectors.append(collector)
+
+    def remove_collector(self, collector):
+        if collector in self.collectors:
+            self.collectors.remove(collector)
+
+    def render(self):
+        with self.lock:
+            stages = {stage: (list(counts), total) for stage, (counts, total) in self.stages.items()}
+            counters = dict(self.counters)
+
+        lines = [
+            "# HELP autoprint_stage_seconds Time spent in each pipeline stage.",
+            "# TYPE autoprint_stage_seconds histogram",
+        ]
+        for stage in sorted(stages):
+            counts, total = stages[stage]
+            cumulative = 0
+            for bound, count in zip(self.STAGE_BUCKETS + ("+Inf",), counts):
+                cumulative += count
+                lines.append(f"autoprint_stage_seconds_bucket{format_metric_labels((('stage', stage), ('le', bound)))} {cumulative}")
+            labels = format_metric_labels((("stage", stage),))
+            lines.append(f"autoprint_stage_seconds_sum{labels} {total}")
+            lines.append(f"autoprint_stage_seconds_count{labels} {cumulative}")
+
+        for name, help_text in self.COUNTERS.items():
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} counter")
+            for (counter, labels), value in sorted(counters.items()):
+                if counter == name:
+                    lines.append(f"{name}{format_metric_labels(labels)} {value}")
+
+        for collector in list(self.collectors):
+            try:
+                families = collector()
+            except Exception as e:
+                log_to_file(f"Metrics collector failed: {str(e)}", "WARNING")
+                continue
+            for name, kind, help_text, samples in families:
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} {kind}")
+                for labels, value in samples:
+                    lines.append(f"{name}{format_metric_labels(sorted(labels.items()))} {value}")
+        return "\n".join(lines) + "\n"
+
+
+metrics = Metrics()
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?", 1)[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = metrics.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # Scrapes would otherwise be printed over the dashboard
+
+
+class MetricsServer:
+    """Serves GET /metrics from a background thread."""
+
+    def __init__(self, host, port):
+        self.httpd = ThreadingHTTPServer((host, port), MetricsHandler)
+        self.httpd.daemon_threads = True
+        self.thread = threading.Thread(target=self.httpd.serve_forever, name="metrics", daemon=True)
+        self.thread.start()
+
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
 
 # ==========================
 # Color Helpers
@@ -110,7 +573,9 @@ def dim_white(text):
 # Console UI
 # ==========================
 
-class ConsoleUI:
+class StatusModel:
+    """Counters and recent activity shown by the dashboard, shared by ConsoleUI and HeadlessUI."""
+
     def __init__(self):
         self.status = "Initializing..."
         self.last_check = "Never"
@@ -118,6 +583,16 @@ class ConsoleUI:
         self.messages_found = 0
         self.jobs_processed = 0
         self.jobs_pending = 0
+        self.pending_render = 0
+        self.pending_print = 0
+        self.pending_retry = 0
+        self.queued_by_priority = {}
+        self.reconnects = 0
+        self.accounts = []
+        self.print_waits = deque(maxlen=500)
+        self.print_timeouts = 0
+        self.pdf_cache_hits = 0
+        self.pdf_cache_misses = 0
         self.auto_print_status = "Enabled ✓" if AUTO_PRINT_ENABLED else "Manual Mode 👤"
         self.last_cleanup = "Never"
         self.next_cleanup = "Calculating..."
@@ -127,28 +602,20 @@ class ConsoleUI:
         self.countdown_remaining = 0
         self.countdown_total = POLL_INTERVAL_SECONDS
         self.animation_frame = 0
-        self.terminal_width = self.get_terminal_width()
-        
-    def get_terminal_width(self):
-        """Get the current terminal width."""
-        try:
-            return shutil.get_terminal_size().columns
-        except:
-            return 120  # Default fallback
-        
-    def clear_screen(self):
-        os.system('cls' if os.name == 'nt' else 'clear')
-    
+
     def update_status(self, status):
         with self.lock:
             self.status = status
             log_to_file(f"Status: {status}")
     
-    def update_check_time(self):
+    def update_check_time(self, push=False):
         with self.lock:
             self.last_check = datetime.now().strftime("%H:%M:%S")
-            next_time = datetime.now() + timedelta(seconds=POLL_INTERVAL_SECONDS)
-            self.next_check = next_time.strftime("%H:%M:%S")
+            if push:
+                self.next_check = "On new mail (IDLE)"
+            else:
+                next_time = datetime.now() + timedelta(seconds=POLL_INTERVAL_SECONDS)
+                self.next_check = next_time.strftime("%H:%M:%S")
     
     def update_cleanup_time(self, last_cleanup_time):
         with self.lock:
@@ -164,9 +631,56 @@ class ConsoleUI:
         with self.lock:
             self.jobs_processed += 1
     
-    def set_pending(self, count):
+    def set_pending(self, rendering, printing, retrying=0):
+        """Jobs waiting in (or being worked on by) the render and print stages, or waiting to be retried."""
+        with self.lock:
+            self.pending_render = rendering
+            self.pending_print = printing
+            self.pending_retry = retrying
+            self.jobs_pending = rendering + printing + retrying
+    
+    def set_queued_by_priority(self, counts):
+        with self.lock:
+            self.queued_by_priority = dict(counts)
+    
+    def set_accounts(self, accounts):
         with self.lock:
-            self.jobs_pending = count
+            self.accounts = list(accounts)
+    
+    def increment_reconnects(self):
+        with self.lock:
+            self.reconnects += 1
+    
+    def record_print_wait(self, seconds, timed_out=False):
+        with self.lock:
+            self.print_waits.append(seconds)
+            if timed_out:
+                self.print_timeouts += 1
+    
+    def record_pdf_cache(self, hit):
+        with self.lock:
+            if hit:
+                self.pdf_cache_hits += 1
+            else:
+                self.pdf_cache_misses += 1
+    
+    def print_wait_percentiles(self):
+        """(p50, p95, max) print wait over recent jobs, or None before the first job."""
+        if not self.print_waits:
+            return None
+        waits = sorted(self.print_waits)
+        return waits[len(waits) // 2], waits[min(len(waits) - 1, int(len(waits) * 0.95))], waits[-1]
+
+    def print_wait_summary(self):
+        """Median/p95/max print wait over recent jobs, e.g. '1.2s / 3.4s / 8.0s'."""
+        percentiles = self.print_wait_percentiles()
+        if percentiles is None:
+            return "No jobs yet"
+        p50, p95, longest = percentiles
+        summary = f"p50 {p50:.1f}s / p95 {p95:.1f}s / max {longest:.1f}s ({len(self.print_waits)} jobs"
+        if self.print_timeouts:
+            summary += f", {self.print_timeouts} hit the {CHROME_PRINT_WAIT_SECONDS}s limit"
+        return summary + ")"
     
     def set_countdown(self, remaining, total):
         with self.lock:
@@ -192,6 +706,88 @@ class ConsoleUI:
             
             # Log to file
             log_to_file(error_msg, "ERROR")
+
+    def snapshot(self):
+        """The current state as a JSON-serializable dict."""
+        with self.lock:
+            percentiles = self.print_wait_percentiles()
+            return {
+                "time": datetime.now().isoformat(timespec="seconds"),
+                "status": self.status,
+                "last_check": self.last_check,
+                "next_check": self.next_check,
+                "messages_found": self.messages_found,
+                "jobs_processed": self.jobs_processed,
+                "jobs_pending": {
+                    "rendering": self.pending_render,
+                    "printing": self.pending_print,
+                    "retrying": self.pending_retry,
+                },
+                "queued_by_priority": {str(level): count for level, count in self.queued_by_priority.items()},
+                "reconnects": self.reconnects,
+                "print_wait_seconds": None if percentiles is None else {
+                    "p50": round(percentiles[0], 3),
+                    "p95": round(percentiles[1], 3),
+                    "max": round(percentiles[2], 3),
+                    "jobs": len(self.print_waits),
+                    "timeouts": self.print_timeouts,
+                },
+                "pdf_cache": {"hits": self.pdf_cache_hits, "misses": self.pdf_cache_misses},
+                "last_cleanup": self.last_cleanup,
+                "recent_jobs": list(self.recent_jobs),
+                "errors": list(self.errors),
+            }
+
+
+class ConsoleUI(StatusModel):
+    def __init__(self):
+        super().__init__()
+        self.terminal_width = self.get_terminal_width()
+        # Frame state for render(); drawing is serialized by output_lock, not self.lock
+        self.output_lock = threading.Lock()
+        self.last_frame = []
+        self.frame_width = None
+        self.last_frame_at = 0.0
+        self.frame_seq = 0
+        self.written_seq = 0
+        self.static_key = None
+        self.static_cache = []
+        # Pending redraw for a change that arrived while frames were throttled
+        self.redraw_timer = None
+        if os.name == "nt" and not COLORAMA_AVAILABLE:
+            # An empty command switches the Windows console into ANSI (VT) mode
+            os.system("")
+        # Whatever way the process ends, don't leave the terminal without wrap or a cursor
+        atexit.register(self.restore_terminal)
+        
+    def get_terminal_width(self):
+        """Get the current terminal width."""
+        try:
+            return shutil.get_terminal_size().columns
+        except:
+            return 120  # Default fallback
+        
+    def clear_screen(self):
+        """Clear the terminal in-process, with line wrap and the cursor back on."""
+        with self.output_lock:
+            sys.stdout.write("\x1b[?7h\x1b[?25h\x1b[2J\x1b[H")
+            sys.stdout.flush()
+            self.last_frame = []
+            self.frame_width = None
+
+    def restore_terminal(self):
+        """Turn line wrap and the cursor back on below the last frame, if a frame was drawn."""
+        with self.lock:
+            if self.redraw_timer is not None:
+                self.redraw_timer.cancel()
+                self.redraw_timer = None
+        with self.output_lock:
+            if self.frame_width is None:
+                return
+            sys.stdout.write(f"\x1b[{len(self.last_frame) + 1};1H\x1b[?7h\x1b[?25h\n")
+            sys.stdout.flush()
+            self.last_frame = []
+            self.frame_width = None
     
     def create_progress_bar(self, elapsed, total, width=None):
         """Create a sleek gradient progress bar."""
@@ -207,12 +803,7 @@ class ConsoleUI:
             return f"[{bar}] {percentage}%"
         
         # Create smooth gradient bar
-        bar = ""
-        for i in range(width):
-            if i < filled:
-                bar += cyan("█")
-            else:
-                bar += Fore.CYAN + Style.DIM + "▒" + Style.RESET_ALL
+        bar = cyan("█" * filled) + Fore.CYAN + Style.DIM + "▒" * (width - filled) + Style.RESET_ALL
         
         return f"{cyan('[')} {bar} {cyan(']')} {cyan(str(percentage) + '%')}"
     
@@ -234,103 +825,200 @@ class ConsoleUI:
         padding = (self.terminal_width - visible_len) // 2
         return " " * padding + text
     
-    def render(self):
+    def render(self, force=False):
+        """Redraw the dashboard, rewriting only the lines that changed since the last frame."""
+        now = time.monotonic()
+        if not force and now - self.last_frame_at < 1.0 / UI_MAX_FPS:
+            self._schedule_redraw(self.last_frame_at + 1.0 / UI_MAX_FPS - now)
+            return
         with self.lock:
-            self.clear_screen()
-            
-            # Update terminal width
-            self.terminal_width = self.get_terminal_width()
-            
-            print()
-            print()
-            
-            # Title - centered
-            print(self.center_text(cyan("    ╔═══════════════════════════════════════════════════════════════════════════╗")))
-            print(self.center_text(cyan("    ║                                                                           ║")))
-            print(self.center_text(cyan("    ║                      AUTOPRINT SERVICE v1.0                               ║")))
-            print(self.center_text(cyan("    ║                                                                           ║")))
-            print(self.center_text(cyan("    ║              🖨️  Open-Source Email Print Automation  🖨️                   ║")))
-            print(self.center_text(cyan("    ║                                                                           ║")))
-            print(self.center_text(cyan("    ╚═══════════════════════════════════════════════════════════════════════════╝")))
-            print()
-            
-            # Full-width separator
-            print(self.separator())
-            print()
-            
-            # System Info - with left margin
-            margin = "    "
-            print(margin + cyan("📧 Mailbox: ") + white(IMAP_USERNAME))
-            print(margin + cyan("📁 Folder: ") + white(MAILBOX))
-            print(margin + cyan("🔍 Filter: ") + white(SUBJECT_PREFIX))
-            print(margin + cyan("🖨️  Mode: ") + white(self.auto_print_status))
-            delete_status = "Enabled ⚠️" if DELETE_EMAIL_AFTER_PRINT else "Disabled ✓"
-            print(margin + cyan("🗑️  Delete After Print: ") + white(delete_status))
-            print()
-            
-            # Thin separator
-            print(self.thin_separator())
-            print()
-            
-            # Status
-            emoji = self.get_status_emoji()
-            print(margin + cyan(f"{emoji} Status: ") + white(self.status))
-            print(margin + cyan("🕐 Last Check: ") + white(self.last_check))
-            print(margin + cyan("🕑 Next Check: ") + white(self.next_check))
-            
-            # Progress bar
-            if self.countdown_remaining > 0:
-                elapsed = self.countdown_total - self.countdown_remaining
-                progress = self.create_progress_bar(elapsed, self.countdown_total)
-                print(margin + cyan(f"⏱️  Next Check In: {self.countdown_remaining}s"))
-                print(margin + progress)
-            print()
-            
-            # Thin separator
-            print(self.thin_separator())
-            print()
-            
-            # Statistics
-            print(margin + cyan("📊 Messages Found: ") + white(str(self.messages_found)))
-            print(margin + cyan("✅ Jobs Processed: ") + white(str(self.jobs_processed)))
-            print(margin + cyan("⏳ Jobs Pending: ") + white(str(self.jobs_pending)))
-            print()
-            
-            # Thin separator
-            print(self.thin_separator())
-            print()
-            
-            # Cleanup
-            print(margin + cyan("🧹 Last Cleanup: ") + white(self.last_cleanup))
-            print(margin + cyan("🕐 Next Cleanup: ") + white(self.next_cleanup))
-            print()
-            
-            # Thin separator
-            print(self.thin_separator())
-            print()
-            
-            # Recent Jobs (only last 3)
-            print(margin + cyan("📋 Recent Jobs:"))
-            if self.recent_jobs:
-                for job in self.recent_jobs:
-                    print(margin + f"   {dim_white('•')} {white(job)}")
-            else:
-                print(margin + f"   {dim_white('No jobs processed yet.')}")
-            print()
-            
-            # Errors
-            if self.errors:
-                print(self.thin_separator())
-                print()
-                print(margin + cyan("⚠️  Recent Errors:"))
-                for error in self.errors:
-                    print(margin + f"   {cyan('•')} {cyan(error)}")
-                print()
-            
-            # Footer separator
-            print(self.separator())
-            print(self.center_text(cyan("Press Ctrl+C to exit  •  github.com/PartonIT/AutoPrint-Service")))
-            print()
+            self.last_frame_at = now
+            self.frame_seq += 1
+            seq = self.frame_seq
+            frame = self.build_frame()
+        # Terminal output happens outside self.lock so workers updating counters never wait on it
+        with self.output_lock:
+            if seq < self.written_seq:
+                return  # a newer frame was already drawn
+            self.written_seq = seq
+            out = self.frame_diff(frame)
+            if out:
+                sys.stdout.write(out)
+                sys.stdout.flush()
+
+    def _schedule_redraw(self, delay):
+        """Draw once more when the throttle window ends, so the last change doesn't wait for the next tick."""
+        with self.lock:
+            if self.redraw_timer is not None:
+                return
+            self.redraw_timer = threading.Timer(delay, self._trailing_redraw)
+            self.redraw_timer.daemon = True
+            self.redraw_timer.start()
+
+    def _trailing_redraw(self):
+        with self.lock:
+            self.redraw_timer = None
+        self.render()
+
+    def frame_diff(self, frame):
+        """ANSI output that turns the last frame drawn into this one."""
+        out = []
+        old = self.last_frame
+        if self.frame_width != self.terminal_width:
+            # First frame or terminal resized: repaint everything. Line wrap is turned off so
+            # an overlong line can't push the rows below it out of place.
+            out.append("\x1b[?7l\x1b[?25l\x1b[2J")
+            old = []
+            self.frame_width = self.terminal_width
+        for row, line in enumerate(frame):
+            if row >= len(old) or old[row] != line:
+                out.append(f"\x1b[{row + 1};1H{line}\x1b[K")
+        if len(frame) < len(old):
+            out.append(f"\x1b[{len(frame) + 1};1H\x1b[J")
+        self.last_frame = frame
+        return "".join(out)
+
+    def static_lines(self):
+        """Banner and configuration block; rebuilt only when the width or accounts change."""
+        key = (self.terminal_width, len(self.accounts))
+        if self.static_key == key:
+            return self.static_cache
+        lines = ["", ""]
+        
+        # Title - centered
+        lines.append(self.center_text(cyan("    ╔═══════════════════════════════════════════════════════════════════════════╗")))
+        lines.append(self.center_text(cyan("    ║                                                                           ║")))
+        lines.append(self.center_text(cyan("    ║                      AUTOPRINT SERVICE v1.0                               ║")))
+        lines.append(self.center_text(cyan("    ║                                                                           ║")))
+        lines.append(self.center_text(cyan("    ║              🖨️  Open-Source Email Print Automation  🖨️                   ║")))
+        lines.append(self.center_text(cyan("    ║                                                                           ║")))
+        lines.append(self.center_text(cyan("    ╚═══════════════════════════════════════════════════════════════════════════╝")))
+        lines.append("")
+        
+        # Full-width separator
+        lines.append(self.separator())
+        lines.append("")
+        
+        # System Info - with left margin
+        margin = "    "
+        if len(self.accounts) > 1:
+            lines.append(margin + cyan("📧 Mailboxes: ") + white(f"{len(self.accounts)} accounts"))
+            for account in self.accounts[:5]:
+                lines.append(margin + f"   {dim_white('•')} " + white(f"{account.name}: {account.username} / {account.mailbox} / {account.subject_prefix}"))
+            if len(self.accounts) > 5:
+                lines.append(margin + f"   {dim_white(f'… and {len(self.accounts) - 5} more')}")
+        else:
+            account = self.accounts[0] if self.accounts else None
+            lines.append(margin + cyan("📧 Mailbox: ") + white(account.username if account else IMAP_USERNAME))
+            lines.append(margin + cyan("📁 Folder: ") + white(account.mailbox if account else MAILBOX))
+            lines.append(margin + cyan("🔍 Filter: ") + white(account.subject_prefix if account else SUBJECT_PREFIX))
+        lines.append(margin + cyan("🖨️  Mode: ") + white(self.auto_print_status))
+        delete_status = "Enabled ⚠️" if DELETE_EMAIL_AFTER_PRINT else "Disabled ✓"
+        lines.append(margin + cyan("🗑️  Delete After Print: ") + white(delete_status))
+        lines.append("")
+        
+        # Thin separator
+        lines.append(self.thin_separator())
+        lines.append("")
+        self.static_key = key
+        self.static_cache = lines
+        return lines
+
+    def build_frame(self):
+        """The dashboard as a list of lines. Called with self.lock held."""
+        # Update terminal width
+        self.terminal_width = self.get_terminal_width()
+        lines = list(self.static_lines())
+        margin = "    "
+        
+        # Status
+        emoji = self.get_status_emoji()
+        lines.append(margin + cyan(f"{emoji} Status: ") + white(self.status))
+        lines.append(margin + cyan("🕐 Last Check: ") + white(self.last_check))
+        lines.append(margin + cyan("🕑 Next Check: ") + white(self.next_check))
+        
+        # Progress bar
+        if self.countdown_remaining > 0:
+            elapsed = self.countdown_total - self.countdown_remaining
+            progress = self.create_progress_bar(elapsed, self.countdown_total)
+            lines.append(margin + cyan(f"⏱️  Next Check In: {self.countdown_remaining}s"))
+            lines.append(margin + progress)
+        lines.append("")
+        
+        # Thin separator
+        lines.append(self.thin_separator())
+        lines.append("")
+        
+        # Statistics
+        lines.append(margin + cyan("📊 Messages Found: ") + white(str(self.messages_found)))
+        lines.append(margin + cyan("✅ Jobs Processed: ") + white(str(self.jobs_processed)))
+        pending = str(self.jobs_pending)
+        if self.jobs_pending:
+            pending += f" (rendering {self.pending_render} / printing {self.pending_print}"
+            if self.pending_retry:
+                pending += f" / retrying {self.pending_retry}"
+            pending += ")"
+        lines.append(margin + cyan("⏳ Jobs Pending: ") + white(pending))
+        if self.queued_by_priority:
+            levels = "  ".join(f"P{level}: {count}" for level, count in sorted(self.queued_by_priority.items()))
+            lines.append(margin + cyan("📥 Queued by Priority: ") + white(levels))
+        lines.append(margin + cyan("🔌 Reconnects: ") + white(str(self.reconnects)))
+        lines.append(margin + cyan("⏱️  Print Time: ") + white(self.print_wait_summary()))
+        if self.pdf_cache_hits or self.pdf_cache_misses:
+            lines.append(margin + cyan("💾 PDF Cache: ") + white(f"{self.pdf_cache_hits} hits / {self.pdf_cache_misses} misses"))
+        lines.append("")
+        
+        # Thin separator
+        lines.append(self.thin_separator())
+        lines.append("")
+        
+        # Cleanup
+        lines.append(margin + cyan("🧹 Last Cleanup: ") + white(self.last_cleanup))
+        lines.append(margin + cyan("🕐 Next Cleanup: ") + white(self.next_cleanup))
+        lines.append("")
+        
+        # Thin separator
+        lines.append(self.thin_separator())
+        lines.append("")
+        
+        # Recent Jobs (only last 3)
+        lines.append(margin + cyan("📋 Recent Jobs:"))
+        if self.recent_jobs:
+            for job in self.recent_jobs:
+                lines.append(margin + f"   {dim_white('•')} {white(job)}")
+        else:
+            lines.append(margin + f"   {dim_white('No jobs processed yet.')}")
+        lines.append("")
+        
+        # Errors
+        if self.errors:
+            lines.append(self.thin_separator())
+            lines.append("")
+            lines.append(margin + cyan("⚠️  Recent Errors:"))
+            for error in self.errors:
+                lines.append(margin + f"   {cyan('•')} {cyan(error)}")
+            lines.append("")
+        
+        # Footer separator
+        lines.append(self.separator())
+        lines.append(self.center_text(cyan("Press Ctrl+C to exit  •  github.com/PartonIT/AutoPrint-Service")))
+        return lines
+
+
+class HeadlessUI(StatusModel):
+    """--headless: no dashboard. report() prints the state as one JSON line for systemd/container logs."""
+
+    def render(self, force=False):
+        pass
+
+    def clear_screen(self):
+        pass
+
+    def restore_terminal(self):
+        pass
+
+    def report(self):
+        print(json.dumps(self.snapshot()), flush=True)
 
 
 # ==========================
@@ -338,9 +1026,15 @@ class ConsoleUI:
 # ==========================
 
 class ChromePrinter:
+    # render() output is an HTML page Chrome prints itself, so there is no PDF to cache
+    renders_pdf = False
+    # Every kiosk job is its own Chrome run
+    supports_batch = False
+
     def __init__(self, ui):
         self.ui = ui
         self.chrome_path = self._resolve_chrome_path()
+        self.submit_lock = threading.Lock()
 
     def _resolve_chrome_path(self):
         if CHROME_PATH and os.path.exists(CHROME_PATH):
@@ -359,9 +1053,10 @@ class ChromePrinter:
         
         raise FileNotFoundError("Could not find Chrome. Set CHROME_PATH in config.")
 
-    def inject_print_script(self, html_content, auto_close=True):
-        if auto_close:
-            script = """
+    def print_script(self, auto_print=True):
+        """Script that TempFileManager writes into the page, or None if the page is used as-is."""
+        if auto_print:
+            return """
 <script>
 window.onload = function() {
     setTimeout(function() {
@@ -370,8 +1065,7 @@ window.onload = function() {
     }, 500);
 };
 </script>"""
-        else:
-            script = """
+        return """
 <script>
 window.onload = function() {
     setTimeout(function() {
@@ -379,108 +1073,564 @@ window.onload = function() {
     }, 500);
 };
 </script>"""
-        
-        if re.search(r'</body>', html_content, re.IGNORECASE):
-            html_content = re.sub(r'</body>', script + '</body>', html_content, flags=re.IGNORECASE)
-        elif re.search(r'</html>', html_content, re.IGNORECASE):
-            html_content = re.sub(r'</html>', script + '</html>', html_content, flags=re.IGNORECASE)
-        else:
-            html_content += script
-        
-        return html_content
 
-    def print_html_file(self, html_path, auto_print=True):
-        with open(html_path, "r", encoding="utf-8", errors="ignore") as f:
-            html_content = f.read()
-        
-        modified_html = self.inject_print_script(html_content, auto_close=auto_print)
-        
+    def close(self):
+        pass
+
+    def render(self, html_path, auto_print=True):
+        """Return the file submit() sends to the printer. The print script is already in the page."""
+        return html_path
+
+    def submit(self, html_path, auto_print=True, printer_name=None):
+        """Open a rendered file in Chrome. Kiosk printing always uses the system default printer.
+
+        Returns False if Chrome was stopped at the time limit, before it confirmed the job."""
         temp_dir = tempfile.gettempdir()
-        modified_name = f"print_{uuid.uuid4().hex}.html"
-        modified_path = os.path.join(temp_dir, modified_name)
-        
-        with open(modified_path, "w", encoding="utf-8", errors="ignore") as f:
-            f.write(modified_html)
-        
         user_data_dir = os.path.join(temp_dir, "chrome_print_profile")
         os.makedirs(user_data_dir, exist_ok=True)
 
         if auto_print:
-            cmd = [self.chrome_path, "--kiosk-printing", f"--user-data-dir={user_data_dir}", modified_path]
+            cmd = [self.chrome_path, "--kiosk-printing", f"--user-data-dir={user_data_dir}", html_path]
         else:
-            cmd = [self.chrome_path, f"--user-data-dir={user_data_dir}", modified_path]
+            cmd = [self.chrome_path, f"--user-data-dir={user_data_dir}", html_path]
 
         if auto_print:
-            try:
+            # A second Chrome on the same profile would hand its page to the first one
+            with self.submit_lock:
+                started = time.monotonic()
                 proc = subprocess.Popen(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-                time.sleep(CHROME_PRINT_WAIT_SECONDS)
-                try:
-                    proc.terminate()
-                except:
-                    pass
-            finally:
+                # The injected script closes the window once print() returns, and Chrome
+                # (running on its own profile) exits when the job has been handed off
                 try:
-                    os.remove(modified_path)
-                except:
-                    pass
+                    proc.wait(timeout=CHROME_PRINT_WAIT_SECONDS)
+                    timed_out = False
+                except subprocess.TimeoutExpired:
+                    timed_out = True
+                    try:
+                        proc.terminate()
+                        proc.wait(timeout=5)
+                    except:
+                        proc.kill()
+                waited = time.monotonic() - started
+            self.ui.record_print_wait(waited, timed_out)
+            if timed_out and CHROME_RETRY_ON_TIMEOUT:
+                raise RuntimeError(f"Chrome did not finish within {CHROME_PRINT_WAIT_SECONDS}s")
+            if timed_out:
+                log_to_file(f"Chrome did not finish within {CHROME_PRINT_WAIT_SECONDS}s, stopped it; "
+                            f"the print is unconfirmed", "WARNING")
+                return False
+            if proc.returncode != 0:
+                raise RuntimeError(f"Chrome exited with code {proc.returncode}")
+            log_to_file(f"Print job finished in {waited:.2f}s")
         else:
-            try:
-                subprocess.Popen(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-            except Exception as e:
-                try:
-                    os.remove(modified_path)
-                except:
-                    pass
-                raise
+            subprocess.Popen(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        return True
 
 
-# ==========================
-# Temp File Manager
-# ==========================
+class DevToolsChromePrinter(ChromePrinter):
+    """Keeps one headless Chrome running and prints each job through the DevTools protocol.
+
+    Each job gets its own tab: load the HTML, Page.printToPDF, close the tab, and hand the
+    PDF to the system spooler. Chrome is restarted if it dies, after
+    CHROME_RECYCLE_AFTER_JOBS jobs, or when it grows past CHROME_MAX_MEMORY_MB.
+    """
+
+    renders_pdf = True
+    supports_batch = True
 
-class TempFileManager:
     def __init__(self, ui):
-        self.ui = ui
-        self.temp_dir = os.path.join(tempfile.gettempdir(), "autoprint_jobs")
-        os.makedirs(self.temp_dir, exist_ok=True)
-        self.tracked_files = {}
-        self.last_cleanup = datetime.now()
-        ui.update_cleanup_time(self.last_cleanup)
-        
-    def create_temp_file(self, subject, html_content):
-        safe_label = "".join(c for c in subject if c.isalnum() or c in ("-", "_", " "))[:40]
-        filename = (safe_label or "AutoPrint") + f"_{uuid.uuid4().hex[:8]}.html"
-        temp_path = os.path.join(self.temp_dir, filename)
-        
-        with open(temp_path, "w", encoding="utf-8", errors="ignore") as f:
-            f.write(html_content)
-        
-        self.tracked_files[temp_path] = datetime.now()
-        return temp_path
-    
-    def should_cleanup(self):
-        elapsed = datetime.now() - self.last_cleanup
-        return elapsed.total_seconds() >= (TEMP_FILE_CLEANUP_HOURS * 3600)
-    
-    def cleanup_old_files(self):
-        now = datetime.now()
-        cutoff = now - timedelta(hours=TEMP_FILE_CLEANUP_HOURS)
-        
-        files_to_remove = []
-        for filepath, creation_time in list(self.tracked_files.items()):
-            if creation_time < cutoff:
-                files_to_remove.append(filepath)
-        
-        temp_dir = tempfile.gettempdir()
+        super().__init__(ui)
+        self.proc = None
+        self.ws = None
+        self.message_id = 0
+        self.events = []
+        self.jobs_since_start = 0
+        self.start_count = 0
+        self.lock = threading.Lock()
+        self.render_seconds = {}
+        self.spooler = create_spooler()
+        self.profile_dir = os.path.join(tempfile.gettempdir(), "chrome_devtools_profile")
+
+    def _start(self):
+        os.makedirs(self.profile_dir, exist_ok=True)
+        port_file = os.path.join(self.profile_dir, "DevToolsActivePort")
         try:
-            for filename in os.listdir(temp_dir):
-                if filename.startswith("print_") and filename.endswith(".html"):
-                    filepath = os.path.join(temp_dir, filename)
-                    try:
-                        file_time = datetime.fromtimestamp(os.path.getmtime(filepath))
-                        if file_time < cutoff:
-                            files_to_remove.append(filepath)
-                    except:
+            os.remove(port_file)
+        except OSError:
+            pass
+
+        cmd = [
+            self.chrome_path, "--headless=new", "--disable-gpu", "--no-first-run",
+            "--no-default-browser-check", "--remote-debugging-port=0",
+            f"--user-data-dir={self.profile_dir}", "about:blank",
+        ]
+        self.proc = subprocess.Popen(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+        # Chrome writes the port it picked and the browser endpoint path once it is listening
+        deadline = time.monotonic() + 30
+        while True:
+            if self.proc.poll() is not None:
+                raise RuntimeError("Headless Chrome exited during startup")
+            try:
+                with open(port_file, "r", encoding="utf-8") as f:
+                    lines = f.read().split()
+                if len(lines) >= 2:
+                    break
+            except OSError:
+                pass
+            if time.monotonic() > deadline:
+                raise RuntimeError("Headless Chrome did not open a DevTools port")
+            time.sleep(0.1)
+
+        self.ws = websocket.create_connection(
+            f"ws://127.0.0.1:{lines[0]}{lines[1]}", timeout=30, suppress_origin=True
+        )
+        self.events = []
+        self.jobs_since_start = 0
+        log_to_file(f"Headless Chrome started (pid {self.proc.pid}, DevTools port {lines[0]})")
+
+    def _stop(self):
+        if self.ws is not None:
+            try:
+                self._send("Browser.close", timeout=5)
+            except:
+                pass
+            try:
+                self.ws.close()
+            except:
+                pass
+            self.ws = None
+        if self.proc is not None:
+            try:
+                self.proc.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                self.proc.kill()
+            except:
+                pass
+            self.proc = None
+
+    def close(self):
+        self._stop()
+
+    def _memory_mb(self):
+        """Resident memory of Chrome and its child processes (Linux only; None elsewhere)."""
+        if not os.path.isdir("/proc"):
+            return None
+        pids = {self.proc.pid}
+        total_kb = 0
+        try:
+            for entry in os.listdir("/proc"):
+                if not entry.isdigit():
+                    continue
+                try:
+                    with open(f"/proc/{entry}/stat", "r") as f:
+                        ppid = int(f.read().rsplit(")", 1)[1].split()[1])
+                    if int(entry) not in pids and ppid not in pids:
+                        continue
+                    pids.add(int(entry))
+                    with open(f"/proc/{entry}/status", "r") as f:
+                        for line in f:
+                            if line.startswith("VmRSS:"):
+                                total_kb += int(line.split()[1])
+                except (OSError, ValueError, IndexError):
+                    continue
+        except OSError:
+            return None
+        return total_kb // 1024
+
+    def _ensure_running(self):
+        if self.proc is not None and self.proc.poll() is not None:
+            log_to_file("Headless Chrome died, restarting", "ERROR")
+            self._stop()
+        elif self.proc is not None and self.jobs_since_start >= CHROME_RECYCLE_AFTER_JOBS:
+            log_to_file(f"Recycling headless Chrome after {self.jobs_since_start} jobs")
+            self._stop()
+        elif self.proc is not None and self.jobs_since_start % 25 == 0:
+            memory_mb = self._memory_mb()
+            if memory_mb is not None and memory_mb > CHROME_MAX_MEMORY_MB:
+                log_to_file(f"Recycling headless Chrome using {memory_mb} MB")
+                self._stop()
+        if self.proc is None:
+            self._start()
+            self.start_count += 1
+
+    def _send(self, method, params=None, session_id=None, timeout=30):
+        self.message_id += 1
+        message_id = self.message_id
+        message = {"id": message_id, "method": method, "params": params or {}}
+        if session_id:
+            message["sessionId"] = session_id
+        self.ws.send(json.dumps(message))
+        reply = self._wait_for(lambda m: m.get("id") == message_id, timeout)
+        if "error" in reply:
+            raise RuntimeError(f"DevTools {method} failed: {reply['error'].get('message')}")
+        return reply.get("result", {})
+
+    def _wait_for(self, predicate, timeout):
+        """Return the first DevTools message matching predicate, keeping unrelated events for later."""
+        for i, message in enumerate(self.events):
+            if predicate(message):
+                return self.events.pop(i)
+        deadline = time.monotonic() + timeout
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise TimeoutError("Timed out waiting for headless Chrome")
+            self.ws.settimeout(remaining)
+            message = json.loads(self.ws.recv())
+            if predicate(message):
+                return message
+            if "method" in message:
+                self.events.append(message)
+                del self.events[:-100]
+
+    def render_pdf(self, html_path):
+        """Load html_path in a fresh tab and return it printed to PDF bytes."""
+        target_id = self._send("Target.createTarget", {"url": "about:blank"})["targetId"]
+        session_id = None
+        try:
+            session_id = self._send("Target.attachToTarget", {"targetId": target_id, "flatten": True})["sessionId"]
+            self._send("Page.enable", session_id=session_id)
+            self._send("Page.navigate", {"url": pathlib.Path(html_path).resolve().as_uri()}, session_id=session_id)
+            self._wait_for(
+                lambda m: m.get("method") == "Page.loadEventFired" and m.get("sessionId") == session_id,
+                CHROME_PRINT_WAIT_SECONDS,
+            )
+            result = self._send("Page.printToPDF", {"printBackground": True, "preferCSSPageSize": True},
+                                session_id=session_id, timeout=60)
+            return base64.b64decode(result["data"])
+        finally:
+            self.events = [m for m in self.events if m.get("sessionId") != session_id]
+            try:
+                self._send("Target.closeTarget", {"targetId": target_id}, timeout=5)
+            except:
+                pass
+
+    def print_script(self, auto_print=True):
+        # printToPDF needs the page untouched; only the print dialog fallback uses the script
+        if auto_print:
+            return None
+        return super().print_script(auto_print=False)
+
+    def render(self, html_path, auto_print=True):
+        if not auto_print:
+            # A print dialog needs a visible browser window
+            return super().render(html_path, auto_print=False)
+
+        started = time.monotonic()
+        # One DevTools connection, so render workers take turns
+        with self.lock:
+            for attempt in (1, 2):
+                try:
+                    self._ensure_running()
+                    pdf_data = self.render_pdf(html_path)
+                    break
+                except (OSError, RuntimeError, TimeoutError, websocket.WebSocketException) as e:
+                    log_to_file(f"Headless Chrome render failed (attempt {attempt}): {str(e)}", "ERROR")
+                    self._stop()
+                    if attempt == 2:
+                        raise
+            self.jobs_since_start += 1
+
+        pdf_path = os.path.join(tempfile.gettempdir(), f"print_{uuid.uuid4().hex}.pdf")
+        with open(pdf_path, "wb") as f:
+            f.write(pdf_data)
+        self.render_seconds[pdf_path] = time.monotonic() - started
+        return pdf_path
+
+    def submit(self, pdf_path, auto_print=True, printer_name=None):
+        if not auto_print:
+            return super().submit(pdf_path, auto_print=False)
+        self.submit_batch([pdf_path], printer_name)
+        return True
+
+    def submit_batch(self, pdf_paths, printer_name=None):
+        """Hand rendered PDFs to the print spooler, as one spool job where the spooler allows."""
+        started = time.monotonic()
+        try:
+            if os.name == "nt":
+                for pdf_path in pdf_paths:
+                    os.startfile(pdf_path, "print")
+            else:
+                job_name = "AutoPrint" if len(pdf_paths) == 1 else f"AutoPrint ({len(pdf_paths)} documents)"
+                self.spooler.submit(pdf_paths, printer_name or PRINTER_NAME, job_name)
+            # printToPDF returning and the spooler accepting the job are the completion signals
+            spooled = time.monotonic() - started
+            for pdf_path in pdf_paths:
+                self.ui.record_print_wait(self.render_seconds.pop(pdf_path, 0.0) + spooled)
+            log_to_file(f"{len(pdf_paths)} print job(s) spooled in {spooled:.2f}s")
+        finally:
+            for pdf_path in pdf_paths:
+                self.render_seconds.pop(pdf_path, None)
+        # Failed PDFs are kept for a retry
+        if os.name != "nt":  # Windows prints asynchronously; temp cleanup removes it later
+            for pdf_path in pdf_paths:
+                try:
+                    os.remove(pdf_path)
+                except:
+                    pass
+
+
+# ==========================
+# Print Spooler
+# ==========================
+
+class CommandSpooler:
+    """Submits PDFs with lp or lpr. All files passed in one call become a single spool job."""
+
+    def __init__(self, kind, command=""):
+        self.kind = kind
+        self.command = command or kind
+
+    def submit(self, pdf_paths, printer_name="", job_name="AutoPrint"):
+        cmd = [self.command]
+        if self.kind == "lpr":
+            if printer_name:
+                cmd += ["-P", printer_name]
+            cmd += ["-J", job_name]
+        else:
+            if printer_name:
+                cmd += ["-d", printer_name]
+            cmd += ["-t", job_name]
+        cmd += list(pdf_paths)
+        result = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, timeout=60)
+        if result.returncode != 0:
+            raise RuntimeError(f"{self.kind} failed: {result.stderr.decode('utf-8', errors='replace').strip()}")
+
+
+# IPP value tags (RFC 8010)
+IPP_TAG_OPERATION = 0x01
+IPP_TAG_END = 0x03
+IPP_TAG_INTEGER = 0x21
+IPP_TAG_BOOLEAN = 0x22
+IPP_TAG_ENUM = 0x23
+IPP_TAG_URI = 0x45
+IPP_TAG_NAME = 0x42
+IPP_TAG_CHARSET = 0x47
+IPP_TAG_LANGUAGE = 0x48
+IPP_TAG_MIMETYPE = 0x49
+
+IPP_PRINT_JOB = 0x0002
+IPP_CREATE_JOB = 0x0005
+IPP_SEND_DOCUMENT = 0x0006
+
+class IppSpooler:
+    """Sends PDFs straight to CUPS (or any IPP printer) over HTTP.
+
+    One file goes out as Print-Job; a batch is one Create-Job followed by a
+    Send-Document per file, so it still prints as a single job.
+    """
+
+    def __init__(self, uri_template):
+        self.uri_template = uri_template
+        self.request_id = 0
+
+    def _printer_uri(self, printer_name):
+        if "{printer}" in self.uri_template and not printer_name:
+            raise RuntimeError("SPOOLER 'ipp' needs PRINTER_NAME (or an IPP_PRINTER_URI naming the printer)")
+        return self.uri_template.format(printer=printer_name)
+
+    def _encode(self, operation, attributes):
+        self.request_id += 1
+        out = [struct.pack(">BBHI", 2, 0, operation, self.request_id), bytes([IPP_TAG_OPERATION])]
+        for tag, name, value in attributes:
+            if tag in (IPP_TAG_INTEGER, IPP_TAG_ENUM):
+                value = struct.pack(">i", value)
+            elif tag == IPP_TAG_BOOLEAN:
+                value = b"\x01" if value else b"\x00"
+            else:
+                value = value.encode("utf-8")
+            name = name.encode("ascii")
+            out.append(struct.pack(">BH", tag, len(name)) + name + struct.pack(">H", len(value)) + value)
+        out.append(bytes([IPP_TAG_END]))
+        return b"".join(out)
+
+    def _decode(self, data):
+        """Return (status_code, {name: value}) from an IPP response."""
+        status = struct.unpack(">H", data[2:4])[0]
+        attributes = {}
+        pos = 8
+        name = None
+        while pos < len(data):
+            tag = data[pos]
+            pos += 1
+            if tag == IPP_TAG_END:
+                break
+            if tag < 0x10:  # group delimiter
+                continue
+            name_len = struct.unpack(">H", data[pos:pos + 2])[0]
+            pos += 2
+            if name_len:
+                name = data[pos:pos + name_len].decode("ascii", errors="replace")
+            pos += name_len
+            value_len = struct.unpack(">H", data[pos:pos + 2])[0]
+            pos += 2
+            value = data[pos:pos + value_len]
+            pos += value_len
+            if name in attributes:
+                continue  # keep the first value of multi-valued attributes
+            if tag in (IPP_TAG_INTEGER, IPP_TAG_ENUM) and value_len == 4:
+                attributes[name] = struct.unpack(">i", value)[0]
+            else:
+                attributes[name] = value.decode("utf-8", errors="replace")
+        return status, attributes
+
+    def _request(self, uri, operation, attributes, document=b""):
+        parts = urllib.parse.urlsplit(uri)
+        if parts.scheme in ("ipps", "https"):
+            conn = http.client.HTTPSConnection(parts.hostname, parts.port or 631, timeout=60)
+        else:
+            conn = http.client.HTTPConnection(parts.hostname, parts.port or 631, timeout=60)
+        try:
+            conn.request("POST", parts.path or "/", self._encode(operation, attributes) + document,
+                         {"Content-Type": "application/ipp"})
+            response = conn.getresponse()
+            body = response.read()
+        finally:
+            conn.close()
+        if response.status != 200:
+            raise RuntimeError(f"IPP request failed: HTTP {response.status}")
+        status, result = self._decode(body)
+        if status >= 0x0100:
+            raise RuntimeError(f"IPP request failed: 0x{status:04x} {result.get('status-message', '')}".strip())
+        return result
+
+    def submit(self, pdf_paths, printer_name="", job_name="AutoPrint"):
+        uri = self._printer_uri(printer_name)
+        base = [
+            (IPP_TAG_CHARSET, "attributes-charset", "utf-8"),
+            (IPP_TAG_LANGUAGE, "attributes-natural-language", "en"),
+            (IPP_TAG_URI, "printer-uri", uri),
+            (IPP_TAG_NAME, "requesting-user-name", "autoprint"),
+        ]
+        if len(pdf_paths) == 1:
+            with open(pdf_paths[0], "rb") as f:
+                document = f.read()
+            self._request(uri, IPP_PRINT_JOB, base + [
+                (IPP_TAG_NAME, "job-name", job_name),
+                (IPP_TAG_MIMETYPE, "document-format", "application/pdf"),
+            ], document)
+            return
+
+        job_id = self._request(uri, IPP_CREATE_JOB, base + [(IPP_TAG_NAME, "job-name", job_name)]).get("job-id")
+        if not isinstance(job_id, int):
+            raise RuntimeError("IPP Create-Job returned no job-id")
+        for i, pdf_path in enumerate(pdf_paths):
+            with open(pdf_path, "rb") as f:
+                document = f.read()
+            self._request(uri, IPP_SEND_DOCUMENT, base + [
+                (IPP_TAG_INTEGER, "job-id", job_id),
+                (IPP_TAG_BOOLEAN, "last-document", i == len(pdf_paths) - 1),
+                (IPP_TAG_MIMETYPE, "document-format", "application/pdf"),
+            ], document)
+
+
+def create_spooler():
+    """Build the spooler selected by SPOOLER."""
+    if SPOOLER == "ipp":
+        return IppSpooler(IPP_PRINTER_URI)
+    if SPOOLER not in ("lp", "lpr"):
+        log_to_file(f"Unknown SPOOLER '{SPOOLER}', using 'lp'", "ERROR")
+        return CommandSpooler("lp", SPOOLER_COMMAND)
+    return CommandSpooler(SPOOLER, SPOOLER_COMMAND)
+
+
+def create_printer(ui):
+    """Build the print backend selected by PRINT_BACKEND."""
+    if PRINT_BACKEND == "devtools":
+        if WEBSOCKET_AVAILABLE:
+            return DevToolsChromePrinter(ui)
+        print("Note: PRINT_BACKEND 'devtools' needs websocket-client: pip install websocket-client")
+        log_to_file("websocket-client not installed, falling back to PRINT_BACKEND 'chrome'", "ERROR")
+    return ChromePrinter(ui)
+
+
+# ==========================
+# Temp File Manager
+# ==========================
+
+def script_insertion_point(html):
+    """Offset of the last </body> (else the last </html>, else the end) in encoded HTML.
+
+    Scans backwards from the tail, where the closing tags are, so it usually
+    looks at only the last few bytes of the page.
+    """
+    html_end = -1
+    end = len(html)
+    while True:
+        i = html.rfind(b"</", 0, end)
+        if i < 0:
+            break
+        tag = html[i:i + 6].lower()
+        if tag == b"</body":
+            return i
+        if tag == b"</html" and html_end < 0:
+            html_end = i
+        end = i
+    return html_end if html_end >= 0 else len(html)
+
+class TempFileManager:
+    def __init__(self, ui):
+        self.ui = ui
+        self.temp_dir = os.path.join(tempfile.gettempdir(), "autoprint_jobs")
+        os.makedirs(self.temp_dir, exist_ok=True)
+        self.tracked_files = {}
+        self.last_cleanup = datetime.now()
+        self.last_run = time.monotonic()
+        ui.update_cleanup_time(self.last_cleanup)
+        
+    def create_temp_file(self, subject, html_content, script=None):
+        """Write the job's page once, with `script` placed before the closing </body> tag."""
+        safe_label = "".join(c for c in subject if c.isalnum() or c in ("-", "_", " "))[:40]
+        filename = (safe_label or "AutoPrint") + f"_{uuid.uuid4().hex[:8]}.html"
+        temp_path = os.path.join(self.temp_dir, filename)
+        
+        data = html_content.encode("utf-8", errors="ignore")
+        with open(temp_path, "wb") as f:
+            if script:
+                # Slices of a memoryview share the buffer, so the page is never copied again
+                split = script_insertion_point(data)
+                view = memoryview(data)
+                f.write(view[:split])
+                f.write(script.encode("utf-8"))
+                f.write(view[split:])
+            else:
+                f.write(data)
+        
+        self.tracked_files[temp_path] = datetime.now()
+        return temp_path
+    
+    def cleanup_deadline(self):
+        """time.monotonic() by which the oldest tracked file expires, or TEMP_FILE_CLEANUP_HOURS
+        after the last run for stray print_* files, whichever is sooner."""
+        max_age = TEMP_FILE_CLEANUP_HOURS * 3600
+        deadline = self.last_run + max_age
+        created = list(self.tracked_files.values())
+        if created:
+            age = (datetime.now() - min(created)).total_seconds()
+            deadline = min(deadline, time.monotonic() + max_age - age)
+        return deadline
+    
+    def cleanup_old_files(self):
+        self.last_run = time.monotonic()
+        now = datetime.now()
+        cutoff = now - timedelta(hours=TEMP_FILE_CLEANUP_HOURS)
+        
+        files_to_remove = []
+        for filepath, creation_time in list(self.tracked_files.items()):
+            if creation_time < cutoff:
+                files_to_remove.append(filepath)
+        
+        temp_dir = tempfile.gettempdir()
+        try:
+            for filename in os.listdir(temp_dir):
+                if filename.startswith("print_") and filename.endswith((".html", ".pdf")):
+                    filepath = os.path.join(temp_dir, filename)
+                    try:
+                        file_time = datetime.fromtimestamp(os.path.getmtime(filepath))
+                        if file_time < cutoff:
+                            files_to_remove.append(filepath)
+                    except:
                         pass
         except:
             pass
@@ -510,7 +1660,7 @@ class TempFileManager:
         temp_dir = tempfile.gettempdir()
         try:
             for filename in os.listdir(temp_dir):
-                if filename.startswith("print_") and filename.endswith(".html"):
+                if filename.startswith("print_") and filename.endswith((".html", ".pdf")):
                     filepath = os.path.join(temp_dir, filename)
                     try:
                         os.remove(filepath)
@@ -522,6 +1672,371 @@ class TempFileManager:
         self.tracked_files.clear()
 
 
+# ==========================
+# Rendered PDF Cache
+# ==========================
+
+class PdfCache:
+    """Rendered PDFs stored on disk under the SHA-256 of the HTML they were made from.
+
+    Shopify Flow often sends the same packing slip twice, and reprints repeat an
+    earlier email, so a hit hands the stored PDF straight to the printer.
+    """
+
+    def __init__(self, ui):
+        self.ui = ui
+        self.cache_dir = os.path.join(tempfile.gettempdir(), "autoprint_pdf_cache")
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self.lock = threading.Lock()
+        self.entries = {}  # key -> [size, last_used]
+        self.total_bytes = 0
+        for filename in os.listdir(self.cache_dir):
+            if filename.endswith(".pdf"):
+                try:
+                    st = os.stat(os.path.join(self.cache_dir, filename))
+                except OSError:
+                    continue
+                self.entries[filename[:-4]] = [st.st_size, st.st_mtime]
+                self.total_bytes += st.st_size
+        self.evict()
+
+    @staticmethod
+    def key_for(html_content):
+        return hashlib.sha256(html_content.encode("utf-8", errors="replace")).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key + ".pdf")
+
+    def get(self, key, dest_path):
+        """Copy the cached PDF for key to dest_path. Returns False on a miss."""
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                try:
+                    shutil.copyfile(self._path(key), dest_path)
+                    now = time.time()
+                    os.utime(self._path(key), (now, now))  # mtime doubles as last-used across restarts
+                    entry[1] = now
+                except OSError:
+                    self._drop(key)
+                    entry = None
+        self.ui.record_pdf_cache(entry is not None)
+        return entry is not None
+
+    def put(self, key, pdf_path):
+        """Store a copy of a freshly rendered PDF."""
+        with self.lock:
+            path = self._path(key)
+            try:
+                shutil.copyfile(pdf_path, path + ".tmp")
+                os.replace(path + ".tmp", path)
+                size = os.path.getsize(path)
+            except OSError as e:
+                log_to_file(f"Could not add PDF to cache: {str(e)}", "WARNING")
+                return
+            if key in self.entries:
+                self.total_bytes -= self.entries[key][0]
+            self.entries[key] = [size, time.time()]
+            self.total_bytes += size
+            self._evict_locked()
+
+    def evict(self):
+        with self.lock:
+            self._evict_locked()
+
+    def evict_deadline(self):
+        """time.monotonic() at which the least recently used PDF expires, or None if the cache is empty."""
+        with self.lock:
+            if not self.entries:
+                return None
+            oldest = min(last_used for size, last_used in self.entries.values())
+        return time.monotonic() + oldest + PDF_CACHE_MAX_AGE_HOURS * 3600 - time.time()
+
+    def _evict_locked(self):
+        cutoff = time.time() - PDF_CACHE_MAX_AGE_HOURS * 3600
+        for key, (size, last_used) in list(self.entries.items()):
+            if last_used < cutoff:
+                self._drop(key)
+
+        max_bytes = PDF_CACHE_MAX_MB * 1024 * 1024
+        if self.total_bytes > max_bytes:
+            for key in sorted(self.entries, key=lambda k: self.entries[k][1]):
+                if self.total_bytes <= max_bytes:
+                    break
+                self._drop(key)
+
+    def _drop(self, key):
+        self.total_bytes -= self.entries.pop(key)[0]
+        try:
+            os.remove(self._path(key))
+        except OSError:
+            pass
+
+
+# ==========================
+# Remote Asset Cache
+# ==========================
+
+# Remote URLs in <img src>, <link href>, background= attributes and CSS url()
+ASSET_URL_RE = re.compile(
+    r"""(?P<prefix>(?:<img\b[^>]*?\bsrc|<link\b[^>]*?\bhref|\bbackground)\s*=\s*["']?|url\(\s*["']?)"""
+    r"""(?P<url>https?://[^"'()\s<>]+)""",
+    re.IGNORECASE,
+)
+# References inside a stylesheet, which may be relative to it
+CSS_URL_RE = re.compile(
+    r"""(?P<prefix>url\(\s*["']?|@import\s+["'])(?P<url>[^"'()\s]+)""",
+    re.IGNORECASE,
+)
+# How deep stylesheets importing stylesheets are followed
+ASSET_CSS_MAX_DEPTH = 3
+
+class AssetCache:
+    """Local copies of remote images and stylesheets, stored under the SHA-256 of their URL."""
+
+    def __init__(self):
+        self.cache_dir = os.path.join(tempfile.gettempdir(), "autoprint_asset_cache")
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self.lock = threading.Lock()
+        self.entries = {}  # url hash -> [filename, size, last_used]
+        self.total_bytes = 0
+        self.failed = {}  # url -> time of the last failed download
+        self.executor = ThreadPoolExecutor(max_workers=4)
+        for filename in os.listdir(self.cache_dir):
+            if filename.endswith(".tmp"):
+                continue
+            try:
+                st = os.stat(os.path.join(self.cache_dir, filename))
+            except OSError:
+                continue
+            self.entries[filename[:64]] = [filename, st.st_size, st.st_mtime]
+            self.total_bytes += st.st_size
+        self.evict()
+
+    def localize(self, html_content):
+        """Point every remote asset in the page at its local copy (downloading what is missing)."""
+        urls = set(m.group("url") for m in ASSET_URL_RE.finditer(html_content))
+        if not urls:
+            return html_content
+        # Attribute values may be entity-encoded (&amp;); the page keeps them as written
+        local = dict(zip(urls, self.executor.map(lambda url: self.fetch(html.unescape(url)), urls)))
+
+        def replace(match):
+            path = local.get(match.group("url"))
+            if path is None:
+                return match.group(0)
+            return match.group("prefix") + pathlib.Path(path).as_uri()
+
+        return ASSET_URL_RE.sub(replace, html_content)
+
+    def fetch(self, url, depth=0):
+        """Local path for url, downloading it if it isn't cached or is past its TTL. None if unavailable."""
+        key = hashlib.sha256(url.encode("utf-8")).hexdigest()
+        now = time.time()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                entry[2] = now
+            path = os.path.join(self.cache_dir, entry[0]) if entry else None
+            # After a failed download, don't hold every job up retrying for a while
+            retry_after = self.failed.get(url, 0) + 300
+
+        if path is not None:
+            try:
+                fresh = now - os.path.getmtime(path) < ASSET_CACHE_TTL_HOURS * 3600
+            except OSError:
+                fresh, path = False, None
+            if path is not None and (fresh or now < retry_after):
+                return path
+        elif now < retry_after:
+            return None
+
+        try:
+            request = urllib.request.Request(url, headers={"User-Agent": "AutoPrint-Service"})
+            with urllib.request.urlopen(request, timeout=ASSET_FETCH_TIMEOUT_SECONDS) as response:
+                limit = ASSET_MAX_DOWNLOAD_MB * 1024 * 1024
+                data = response.read(limit + 1)
+                if len(data) > limit:
+                    raise ValueError(f"larger than {ASSET_MAX_DOWNLOAD_MB} MB")
+                content_type = response.headers.get_content_type()
+        except Exception as e:
+            with self.lock:
+                self.failed[url] = now
+            if path is not None:
+                log_to_file(f"Could not refresh {url}, using cached copy: {str(e)}", "WARNING")
+                return path
+            log_to_file(f"Could not download {url}: {str(e)}", "WARNING")
+            return None
+
+        # Chrome decides how to load file:// assets (stylesheets especially) by extension
+        ext = None
+        if content_type not in ("application/octet-stream", "text/plain"):
+            ext = mimetypes.guess_extension(content_type)
+        if not ext:
+            ext = os.path.splitext(urllib.parse.urlsplit(url).path)[1][:8]
+        if content_type == "text/css" or ext == ".css":
+            data = self._localize_css(data, url, depth)
+        filename = key + ext
+        path = os.path.join(self.cache_dir, filename)
+        try:
+            with open(path + ".tmp", "wb") as f:
+                f.write(data)
+            os.replace(path + ".tmp", path)
+        except OSError as e:
+            # The page keeps pointing at the remote URL
+            log_to_file(f"Could not cache {url}: {str(e)}", "WARNING")
+            try:
+                os.remove(path + ".tmp")
+            except OSError:
+                pass
+            with self.lock:
+                self.failed[url] = now
+            return None
+
+        with self.lock:
+            self.failed.pop(url, None)
+            old = self.entries.get(key)
+            if old is not None:
+                self.total_bytes -= old[1]
+                if old[0] != filename:
+                    try:
+                        os.remove(os.path.join(self.cache_dir, old[0]))
+                    except OSError:
+                        pass
+            self.entries[key] = [filename, len(data), now]
+            self.total_bytes += len(data)
+            self._evict_locked()
+        return path
+
+    def _localize_css(self, data, base_url, depth):
+        """Point the url()s and @imports of a fetched stylesheet at local copies, resolved against base_url."""
+        # surrogateescape keeps bytes that aren't UTF-8 exactly as they were
+        css = data.decode("utf-8", errors="surrogateescape")
+        local = {}
+
+        def replace(match):
+            ref = match.group("url")
+            absolute = urllib.parse.urljoin(base_url, ref)
+            if urllib.parse.urlsplit(absolute).scheme not in ("http", "https"):
+                return match.group(0)  # data:, #fragment, ...
+            if absolute not in local:
+                # Sequentially: this already runs on one of the executor's threads
+                local[absolute] = self.fetch(absolute, depth + 1) if depth < ASSET_CSS_MAX_DEPTH else None
+            path = local[absolute]
+            if path is None:
+                # Relative references wouldn't resolve once the stylesheet is loaded from disk
+                return match.group("prefix") + absolute
+            return match.group("prefix") + pathlib.Path(path).as_uri()
+
+        return CSS_URL_RE.sub(replace, css).encode("utf-8", errors="surrogateescape")
+
+    def evict(self):
+        with self.lock:
+            self._evict_locked()
+
+    def evict_deadline(self):
+        """time.monotonic() at which the least recently used asset expires, or None if the cache is empty."""
+        with self.lock:
+            if not self.entries:
+                return None
+            oldest = min(last_used for filename, size, last_used in self.entries.values())
+        return time.monotonic() + oldest + ASSET_CACHE_TTL_HOURS * 3600 - time.time()
+
+    def _evict_locked(self):
+        cutoff = time.time() - ASSET_CACHE_TTL_HOURS * 3600
+        for key, (filename, size, last_used) in list(self.entries.items()):
+            if last_used < cutoff:
+                self._drop(key)
+
+        max_bytes = ASSET_CACHE_MAX_MB * 1024 * 1024
+        if self.total_bytes > max_bytes:
+            for key in sorted(self.entries, key=lambda k: self.entries[k][2]):
+                if self.total_bytes <= max_bytes:
+                    break
+                self._drop(key)
+
+    def _drop(self, key):
+        filename, size, _ = self.entries.pop(key)
+        self.total_bytes -= size
+        try:
+            os.remove(os.path.join(self.cache_dir, filename))
+        except OSError:
+            pass
+
+
+# ==========================
+# Plain Text Renderer
+# ==========================
+
+# Page sizes in PDF points (1/72 inch)
+TEXT_PAGE_SIZES = {"A4": (595, 842), "LETTER": (612, 792)}
+TEXT_MARGIN = 36
+
+def wrap_text_lines(text, width):
+    for line in text.expandtabs(8).splitlines() or [""]:
+        line = line.rstrip()
+        while len(line) > width:
+            yield line[:width]
+            line = line[width:]
+        yield line
+
+def _pdf_string(line):
+    return line.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+def fits_text_font(text):
+    """Whether the built-in Courier (WinAnsi, i.e. cp1252) can show every character of text."""
+    try:
+        text.encode("cp1252")
+    except UnicodeEncodeError:
+        return False
+    return True
+
+def render_text_pdf(text):
+    """Lay plain text out in Courier over as many pages as needed and return the PDF bytes.
+
+    Only cp1252 text can be shown; check fits_text_font first."""
+    page_width, page_height = TEXT_PAGE_SIZES.get(TEXT_PAGE_SIZE.upper(), TEXT_PAGE_SIZES["A4"])
+    leading = TEXT_FONT_SIZE * 1.2
+    # Every Courier glyph is 0.6 em wide
+    chars_per_line = int((page_width - 2 * TEXT_MARGIN) / (TEXT_FONT_SIZE * 0.6))
+    lines_per_page = max(1, int((page_height - 2 * TEXT_MARGIN) / leading))
+    lines = list(wrap_text_lines(text, chars_per_line))
+    pages = [lines[i:i + lines_per_page] for i in range(0, len(lines), lines_per_page)]
+
+    # Objects 1-3 are the catalog, page tree and font; each page adds a content stream and a page
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        None,
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Courier /Encoding /WinAnsiEncoding >>",
+    ]
+    page_numbers = []
+    for page in pages:
+        ops = [f"BT /F1 {TEXT_FONT_SIZE} Tf {leading:.1f} TL {TEXT_MARGIN} {page_height - TEXT_MARGIN - TEXT_FONT_SIZE} Td"]
+        ops += [f"({_pdf_string(line)}) Tj T*" for line in page]
+        ops.append("ET")
+        stream = "\n".join(ops).encode("cp1252")
+        objects.append(b"<< /Length %d >>\nstream\n" % len(stream) + stream + b"\nendstream")
+        objects.append((
+            f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 {page_width} {page_height}] "
+            f"/Resources << /Font << /F1 3 0 R >> >> /Contents {len(objects)} 0 R >>"
+        ).encode("ascii"))
+        page_numbers.append(len(objects))
+    kids = " ".join(f"{n} 0 R" for n in page_numbers)
+    objects[1] = f"<< /Type /Pages /Kids [{kids}] /Count {len(page_numbers)} >>".encode("ascii")
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, 1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n" % number + body + b"\nendobj\n"
+    xref_offset = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    for offset in offsets:
+        out += b"%010d 00000 n \n" % offset
+    out += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref_offset)
+    return bytes(out)
+
+
 # ==========================
 # Email Helpers
 # ==========================
@@ -536,17 +2051,42 @@ def decode_str(s, enc):
         return s.decode("utf-8", errors="replace") if isinstance(s, (bytes, bytearray)) else str(s)
 
 def get_subject(msg):
-    raw_subject = msg.get("Subject", "")
-    parts = decode_header(raw_subject)
+    return get_header(msg, "Subject")
+
+def get_header(msg, name):
+    raw_value = msg.get(name, "")
+    parts = decode_header(str(raw_value))
     decoded = []
     for part, enc in parts:
         decoded.append(decode_str(part, enc))
     return "".join(decoded).strip()
 
+def message_priority(msg):
+    """Priority of a message under PRIORITY_RULES (lower prints first). Only headers are needed."""
+    priority = DEFAULT_PRIORITY
+    for rule in PRIORITY_RULES:
+        value = get_header(msg, rule.get("field", "subject"))
+        if value and re.search(rule["pattern"], value, re.IGNORECASE):
+            priority = min(priority, rule["priority"])
+    return priority
+
+def priority_header_fields():
+    """Header names to fetch so message_priority() can see every field the rules use."""
+    fields = ["SUBJECT", "MESSAGE-ID", "FROM"]
+    for rule in PRIORITY_RULES:
+        field = rule.get("field", "subject").upper()
+        if field not in fields:
+            fields.append(field)
+    return fields
+
 def subject_matches_prefix(subject, prefix):
     return subject.strip().upper().startswith(prefix.strip().upper())
 
 def get_best_body(msg):
+    return format_best_body(*find_best_parts(msg))
+
+def find_best_parts(msg):
+    """(html_part, text_part): the first inline text/html and text/plain bodies, or None."""
     html_part = None
     text_part = None
 
@@ -581,6 +2121,9 @@ def get_best_body(msg):
             elif ctype == "text/plain":
                 text_part = body
 
+    return html_part, text_part
+
+def format_best_body(html_part, text_part):
     if html_part:
         return html_part
     if text_part:
@@ -588,228 +2131,2394 @@ def get_best_body(msg):
         return f"<html><body><pre>{safe}</pre></body></html>"
     return "<html><body>(No body content)</body></html>"
 
+BODY_OPEN_RE = re.compile(r"<body\b[^>]*>", re.IGNORECASE)
+HEAD_STYLE_RE = re.compile(r"<style\b[^>]*>.*?</style\s*>|<link\b[^>]*>", re.IGNORECASE | re.DOTALL)
 
-# ==========================
-# IMAP Daemon
-# ==========================
+def merge_html_documents(documents):
+    """Combine several HTML emails into one document, each starting on a new page.
 
-class ImapPrintDaemon:
-    def __init__(self):
-        self.conn = None
-        self.ui = ConsoleUI()
-        self.chrome_printer = ChromePrinter(self.ui)
-        self.temp_manager = TempFileManager(self.ui)
-        self.printed_uids = set()
-        self._load_printed_uids()
-        
-        # Log startup
-        log_to_file("=" * 80)
-        log_to_file("AutoPrint Service Started")
-        log_to_file(f"Mailbox: {IMAP_USERNAME}")
-        log_to_file(f"Folder: {MAILBOX}")
-        log_to_file(f"Auto-Print: {AUTO_PRINT_ENABLED}")
-        log_to_file(f"Delete After Print: {DELETE_EMAIL_AFTER_PRINT}")
+    Bodies are placed one after another; <style> and <link> tags from every head
+    are carried over once each.
+    """
+    styles = []
+    pages = []
+    for document in documents:
+        match = BODY_OPEN_RE.search(document)
+        body_start = match.end() if match else 0
+        styles += HEAD_STYLE_RE.findall(document, 0, match.start() if match else 0)
+        body_end = document.lower().rfind("</body", body_start)
+        pages.append(document[body_start:body_end if body_end >= 0 else len(document)])
 
-    def _load_printed_uids(self):
-        if os.path.exists(PRINTED_UIDS_FILE):
-            with open(PRINTED_UIDS_FILE, "r", encoding="utf-8", errors="ignore") as f:
-                for line in f:
-                    uid = line.strip()
-                    if uid:
-                        self.printed_uids.add(uid)
+    page_break = (".autoprint-page{page-break-after:always;break-after:page}"
+                  ".autoprint-page:last-child{page-break-after:auto;break-after:auto}")
+    return (
+        f'<html><head><meta charset="utf-8"><style>{page_break}</style>'
+        + "".join(dict.fromkeys(styles))
+        + "</head><body>"
+        + "".join(f'<div class="autoprint-page">{page}</div>' for page in pages)
+        + "</body></html>"
+    )
 
-    def _save_printed_uid(self, uid):
-        self.printed_uids.add(uid)
-        with open(PRINTED_UIDS_FILE, "a", encoding="utf-8", errors="ignore") as f:
-            f.write(uid + "\n")
+def iter_body_parts(structure, section="", in_multipart=False, encapsulated=False):
+    """Walk a parsed BODYSTRUCTURE in the same order as Message.walk().
 
-    def connect(self):
-        self.ui.update_status("Connecting to mailbox... 🔌")
-        self.ui.render()
-        
-        if IMAP_USE_SSL:
-            self.conn = imaplib.IMAP4_SSL(IMAP_HOST, IMAP_PORT)
-        else:
-            self.conn = imaplib.IMAP4(IMAP_HOST, IMAP_PORT)
-        
-        self.conn.login(IMAP_USERNAME, IMAP_PASSWORD)
-        self.conn.select(MAILBOX)
-        self.ui.update_status("Connected ✓")
-        log_to_file("Connected to mailbox successfully")
+    Yields (section, content_type, charset, encoding, is_attachment) for every leaf part.
+    """
+    if structure and isinstance(structure[0], list):
+        children = []
+        for item in structure:
+            if not isinstance(item, list):
+                break
+            children.append(item)
+        for i, child in enumerate(children, 1):
+            child_section = f"{section}.{i}" if section else str(i)
+            yield from iter_body_parts(child, child_section, in_multipart=True)
+        return
 
-    def disconnect(self):
-        if self.conn is not None:
-            try:
-                self.conn.close()
-            except:
-                pass
-            try:
-                self.conn.logout()
-            except:
-                pass
-            self.conn = None
+    if len(structure) < 7:
+        raise ValueError(f"Malformed BODYSTRUCTURE part: {structure!r}")
+    if encapsulated:
+        part_section = f"{section}.1"
+    else:
+        part_section = section or "1"
+    ctype = f"{structure[0]}/{structure[1]}".lower()
+    params = structure[2] if isinstance(structure[2], list) else []
+    charset = None
+    for i in range(0, len(params) - 1, 2):
+        if str(params[i]).lower() == "charset":
+            charset = params[i + 1]
+    encoding = structure[5] or "7bit"
 
-    def delete_email(self, uid_bytes):
-        """Delete email from inbox after successful print. Only called when DELETE_EMAIL_AFTER_PRINT is True."""
-        try:
-            uid = uid_bytes.decode("ascii", errors="ignore")
-            # Mark email for deletion
-            self.conn.uid("store", uid_bytes, "+FLAGS", "\\Deleted")
-            # Permanently expunge (delete) marked emails
-            self.conn.expunge()
-            log_to_file(f"Email UID {uid} deleted from inbox", "SUCCESS")
-            return True
-        except Exception as e:
-            log_to_file(f"Failed to delete email UID: {str(e)}", "ERROR")
-            return False
+    # Disposition sits after the type-specific fields and the MD5 extension field
+    if ctype.startswith("text/"):
+        disposition_index = 9
+    elif ctype == "message/rfc822":
+        disposition_index = 11
+    else:
+        disposition_index = 8
+    disposition = structure[disposition_index] if len(structure) > disposition_index else None
+    is_attachment = bool(
+        in_multipart and isinstance(disposition, list) and disposition
+        and "attachment" in str(disposition[0]).lower()
+    )
+    yield part_section, ctype, charset, encoding, is_attachment
 
-    def search_candidate_uids(self):
-        self.ui.update_status("Searching for messages... 🔍")
-        self.ui.render()
-        
-        criteria = f'(SUBJECT "{SUBJECT_PREFIX}")'
-        status, data = self.conn.uid("search", None, criteria)
+    if ctype == "message/rfc822" and len(structure) > 8 and isinstance(structure[8], list):
+        yield from iter_body_parts(structure[8], part_section, in_multipart=True, encapsulated=True)
 
-        if status != "OK" or not data or not data[0]:
-            return []
-        
-        return data[0].split()
+def choose_printable_part(structure):
+    """Pick the part get_best_body() would print: first inline text/html, else first inline text/plain.
 
-    def process_message(self, uid_bytes):
-        uid = uid_bytes.decode("ascii", errors="ignore")
-        if uid in self.printed_uids:
+    Returns (section, content_type, charset, encoding), or None if there is no text part.
+    """
+    html_part = None
+    text_part = None
+    for section, ctype, charset, encoding, is_attachment in iter_body_parts(structure):
+        if is_attachment:
+            continue
+        if ctype == "text/html" and html_part is None:
+            html_part = (section, ctype, charset, encoding)
+        elif ctype == "text/plain" and text_part is None:
+            text_part = (section, ctype, charset, encoding)
+    return html_part or text_part
+
+def decode_transfer_encoding(payload, encoding):
+    encoding = (encoding or "7bit").lower()
+    if encoding == "base64":
+        return base64.b64decode(payload)
+    if encoding == "quoted-printable":
+        return quopri.decodestring(payload)
+    return payload
+
+
+# ==========================
+# IMAP Response Helpers
+# ==========================
+
+IMAP_TOKEN_RE = re.compile(
+    rb'\s*(?:(\()|(\))|"((?:[^"\\]|\\.)*)"|\{(\d+)\}$|([^\s()"{}\[]+(?:\[[^\]]*\][^\s()"{}\[]*)?))'
+)
+FETCH_START_RE = re.compile(rb"^\d+ \(")
+
+def _imap_tokens(segments):
+    """Split raw response text into tokens; literals (already read by imaplib) pass through as bytes."""
+    for segment in segments:
+        if isinstance(segment, bytearray):
+            yield ("literal", bytes(segment))
+            continue
+        pos = 0
+        while pos < len(segment):
+            m = IMAP_TOKEN_RE.match(segment, pos)
+            if not m or m.end() == pos:
+                break
+            pos = m.end()
+            if m.group(1):
+                yield ("(", None)
+            elif m.group(2):
+                yield (")", None)
+            elif m.group(3) is not None:
+                value = re.sub(rb"\\(.)", rb"\1", m.group(3))
+                yield ("string", value.decode("utf-8", errors="replace"))
+            elif m.group(4):
+                continue  # literal marker; the literal itself is the next segment
+            elif m.group(5):
+                atom = m.group(5).decode("utf-8", errors="replace")
+                yield ("atom", None if atom.upper() == "NIL" else atom)
+
+def _parse_imap_list(tokens):
+    items = []
+    for kind, value in tokens:
+        if kind == "(":
+            items.append(_parse_imap_list(tokens))
+        elif kind == ")":
+            return items
+        else:
+            items.append(value)
+    return items
+
+def parse_fetch_response(data):
+    """Parse imaplib FETCH data into {uid: {ITEM: value}} for any number of messages."""
+    responses = []
+    for part in data:
+        if part is None:
+            continue
+        text, literal = part if isinstance(part, tuple) else (part, None)
+        if FETCH_START_RE.match(text):
+            responses.append([])
+        if not responses:
+            continue
+        responses[-1].append(text)
+        if literal is not None:
+            responses[-1].append(bytearray(literal))
+
+    results = {}
+    for segments in responses:
+        parsed = _parse_imap_list(iter(_imap_tokens(segments)))
+        if len(parsed) < 2 or not isinstance(parsed[1], list):
+            continue
+        fields = parsed[1]
+        items = {}
+        for i in range(0, len(fields) - 1, 2):
+            if isinstance(fields[i], str):
+                items[fields[i].upper()] = fields[i + 1]
+        if items.get("UID"):
+            results[items["UID"]] = items
+    return results
+
+def find_fetch_item(items, prefix):
+    """Return the first FETCH item whose name starts with prefix (servers format section names differently)."""
+    for key, value in items.items():
+        if key.startswith(prefix):
+            return value
+    return None
+
+def format_uid_set(uids):
+    """Compress UIDs into an IMAP sequence set, e.g. [1, 2, 3, 7] -> "1:3,7"."""
+    ranges = []
+    for uid in sorted(set(int(u) for u in uids)):
+        if ranges and uid == ranges[-1][1] + 1:
+            ranges[-1][1] = uid
+        else:
+            ranges.append([uid, uid])
+    return ",".join(str(a) if a == b else f"{a}:{b}" for a, b in ranges)
+
+def chunked(items, size):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+# ==========================
+# State Store
+# ==========================
+
+class StateStore:
+    """SQLite database of handled UIDs and per-mailbox sync state.
+
+    Lookups go straight to the index, so startup does not load the history. Writes
+    are batched and committed by commit_if_due(), or by commit() before flags are sent.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        self.conn.execute("PRAGMA journal_mode = WAL")
+        self.conn.execute("PRAGMA synchronous = NORMAL")
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS printed (
+                account TEXT NOT NULL,
+                mailbox TEXT NOT NULL,
+                uidvalidity INTEGER NOT NULL,
+                uid INTEGER NOT NULL,
+                printed_at REAL NOT NULL,
+                PRIMARY KEY (account, mailbox, uidvalidity, uid)
+            ) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS mailbox_state (
+                account TEXT NOT NULL,
+                mailbox TEXT NOT NULL,
+                uidvalidity INTEGER,
+                last_uid INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (account, mailbox)
+            );
+        """)
+        self.conn.commit()
+        self.uncommitted = 0
+        self.first_uncommitted_at = None
+        self.last_compacted = 0.0
+        self.closed = False
+
+    def printed_uids(self, account, mailbox, uidvalidity, uids):
+        """Return the subset of uids (ints) already handled under this UIDVALIDITY."""
+        found = set()
+        with self.lock:
+            for batch in chunked(list(uids), 500):
+                placeholders = ",".join("?" * len(batch))
+                rows = self.conn.execute(
+                    f"SELECT uid FROM printed WHERE account = ? AND mailbox = ? AND uidvalidity = ? "
+                    f"AND uid IN ({placeholders})",
+                    [account, mailbox, uidvalidity] + batch,
+                )
+                found.update(row[0] for row in rows)
+        return found
+
+    def mark_printed(self, account, mailbox, uidvalidity, uid):
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR IGNORE INTO printed (account, mailbox, uidvalidity, uid, printed_at) VALUES (?, ?, ?, ?, ?)",
+                (account, mailbox, uidvalidity, uid, time.time()),
+            )
+            self._note_write()
+
+    def load_mailbox_state(self, account, mailbox):
+        """Return (uidvalidity, last_uid), or None if the mailbox has never been synced."""
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT uidvalidity, last_uid FROM mailbox_state WHERE account = ? AND mailbox = ?",
+                (account, mailbox),
+            ).fetchone()
+        return row
+
+    def save_mailbox_state(self, account, mailbox, uidvalidity, last_uid):
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO mailbox_state (account, mailbox, uidvalidity, last_uid) VALUES (?, ?, ?, ?)",
+                (account, mailbox, uidvalidity, last_uid),
+            )
+            self._note_write()
+
+    def _note_write(self):
+        self.uncommitted += 1
+        if self.first_uncommitted_at is None:
+            self.first_uncommitted_at = time.monotonic()
+        if self.uncommitted >= STATE_COMMIT_BATCH_SIZE:
+            self._commit_locked()
+
+    def _commit_locked(self):
+        if self.uncommitted and not self.closed:
+            with metrics.time("state_commit"):
+                self.conn.commit()
+            self.uncommitted = 0
+            self.first_uncommitted_at = None
+
+    def commit(self):
+        with self.lock:
+            self._commit_locked()
+
+    def commit_deadline(self):
+        """time.monotonic() at which uncommitted writes fall due, or None."""
+        with self.lock:
+            if self.first_uncommitted_at is None:
+                return None
+            return self.first_uncommitted_at + STATE_COMMIT_INTERVAL_SECONDS
+
+    def commit_if_due(self):
+        with self.lock:
+            if (self.first_uncommitted_at is not None
+                    and time.monotonic() - self.first_uncommitted_at >= STATE_COMMIT_INTERVAL_SECONDS):
+                self._commit_locked()
+
+    def compact(self):
+        """Drop handled UIDs past STATE_RETENTION_DAYS that no search can return again.
+
+        A UID is kept while it is above its mailbox's watermark under the current
+        UIDVALIDITY; anything else old enough is gone from future searches.
+        """
+        cutoff = time.time() - STATE_RETENTION_DAYS * 86400
+        with self.lock:
+            cur = self.conn.execute("""
+                DELETE FROM printed WHERE printed_at < ? AND NOT EXISTS (
+                    SELECT 1 FROM mailbox_state s
+                    WHERE s.account = printed.account AND s.mailbox = printed.mailbox
+                      AND s.uidvalidity = printed.uidvalidity AND printed.uid > s.last_uid
+                )
+            """, (cutoff,))
+            removed = cur.rowcount
+            self.conn.commit()
+            self.uncommitted = 0
+            self.first_uncommitted_at = None
+            if removed:
+                self.conn.execute("PRAGMA incremental_vacuum")
+            self.last_compacted = time.monotonic()
+        if removed:
+            log_to_file(f"State store: compacted {removed} old UID(s)")
+
+    def compact_deadline(self):
+        """time.monotonic() of the next daily compaction (now, if it has never run)."""
+        if not self.last_compacted:
+            return time.monotonic()
+        return self.last_compacted + 24 * 3600
+
+    def migrate_printed_file(self, path, account, mailbox, uidvalidity):
+        """Import a printed_uids.txt from an older version under the mailbox's current UIDVALIDITY."""
+        if not os.path.exists(path):
             return
+        uids = set()
+        with open(path, "r", encoding="utf-8", errors="ignore") as f:
+            for line in f:
+                line = line.strip()
+                if line.isdigit():
+                    uids.add(int(line))
+        now = time.time()
+        with self.lock:
+            self.conn.executemany(
+                "INSERT OR IGNORE INTO printed (account, mailbox, uidvalidity, uid, printed_at) VALUES (?, ?, ?, ?, ?)",
+                ((account, mailbox, uidvalidity, uid, now) for uid in uids),
+            )
+            self.conn.commit()
+            self.uncommitted = 0
+            self.first_uncommitted_at = None
+        os.replace(path, path + ".migrated")
+        log_to_file(f"Migrated {len(uids)} UID(s) from {path} into {self.path}")
 
-        self.ui.update_status(f"Processing message UID {uid}... ⚙️")
-        self.ui.render()
-        
-        status, data = self.conn.uid("fetch", uid_bytes, "(RFC822)")
-        if status != "OK" or not data or not data[0]:
-            self.ui.add_error(f"Failed to fetch UID {uid}")
+    def close(self):
+        with self.lock:
+            if not self.closed:
+                self.conn.commit()
+                self.conn.close()
+                self.closed = True
+
+def load_legacy_uid_state(state_key):
+    """Return (uidvalidity, last_uid) for state_key from an older uid_state.json, or None."""
+    if not os.path.exists(UID_STATE_FILE):
+        return None
+    try:
+        with open(UID_STATE_FILE, "r", encoding="utf-8") as f:
+            state = json.load(f).get(state_key)
+    except Exception as e:
+        log_to_file(f"Could not read {UID_STATE_FILE}: {str(e)}", "ERROR")
+        return None
+    if not state:
+        return None
+    return state.get("uidvalidity"), int(state.get("last_uid", 0))
+
+
+# ==========================
+# Job Journal
+# ==========================
+
+def journal_job_id(state_key, uidvalidity, uid):
+    return f"{state_key}/{uidvalidity}/{uid}"
+
+class JobJournal:
+    """Write-ahead log of every email's progress through the pipeline.
+
+    Each line is a JSON record {"id", "stage", ...}; later records for an id add to the
+    earlier ones. Lines are handed to the OS as they are written and fsynced in groups
+    by sync(). The email body and the rendered artifact are kept in the spool directory
+    until the job is finished, so a restart can carry on from the last stage reached.
+    """
+
+    FINAL_STAGES = ("flagged", "deleted")
+    # Finished jobs' spool files are kept this long, e.g. for a print dialog still loading them
+    FINISHED_FILE_GRACE_SECONDS = 60
+    # Rewrite the journal once this many records have been appended since the last rewrite
+    COMPACT_AFTER_RECORDS = 1000
+
+    def __init__(self, path, spool_dir):
+        self.path = path
+        self.spool_dir = os.path.abspath(spool_dir)
+        os.makedirs(self.spool_dir, exist_ok=True)
+        self.lock = threading.Lock()
+        self.sync_lock = threading.Lock()
+        self.open_jobs = {}  # id -> every field recorded so far
+        self.finished_files = []  # (finished at, path)
+        self.records_since_compact = 0
+        self._replay()
+        self.file = open(path, "a", encoding="utf-8")
+        self.written = 0
+        self.synced = 0
+
+    def _replay(self):
+        if not os.path.exists(self.path):
             return
+        with open(self.path, "rb") as f:
+            data = f.read()
+        end = data.rfind(b"\n") + 1
+        if end < len(data):
+            # Torn last line from a crash: cut it off so the next record starts on its own line
+            with open(self.path, "r+b") as f:
+                f.truncate(end)
+        for line in data[:end].decode("utf-8", errors="replace").splitlines():
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue
+            self._apply(entry, create=True)
+            self.records_since_compact += 1
+
+    def _apply(self, entry, create=False):
+        job_id = entry["id"]
+        if entry["stage"] == "fetched" and job_id in self.open_jobs:
+            # Fetched again: the earlier attempt's files are no longer needed
+            self._retire(self.open_jobs.pop(job_id))
+        record = self.open_jobs.get(job_id)
+        if record is None:
+            if not create and entry["stage"] != "fetched":
+                return False
+            record = self.open_jobs[job_id] = {}
+        record.update(entry)
+        if entry["stage"] in self.FINAL_STAGES:
+            self._retire(self.open_jobs.pop(job_id))
+        return True
 
-        raw = data[0][1]
-        msg = email.message_from_bytes(raw)
-        subject = get_subject(msg)
+    def _retire(self, record):
+        for key in ("body", "artifact"):
+            if record.get(key):
+                self.finished_files.append((time.monotonic(), record[key]))
 
-        if not subject_matches_prefix(subject, SUBJECT_PREFIX):
-            self._save_printed_uid(uid)
+    def record(self, job_ids, stage, **fields):
+        """Append one record per job id. Ids the journal doesn't know are skipped unless stage is "fetched"."""
+        now = round(time.time(), 3)
+        with self.lock:
+            lines = []
+            for job_id in job_ids:
+                entry = {"id": job_id, "stage": stage, "at": now}
+                entry.update(fields)
+                if self._apply(entry):
+                    lines.append(json.dumps(entry))
+            if lines and not self.file.closed:
+                self.file.write("\n".join(lines) + "\n")
+                self.file.flush()
+                self.written += 1
+                self.records_since_compact += len(lines)
+
+    def fetched(self, job):
+        """Spool the job's body and record it; a restart renders from this copy."""
+        body_path = os.path.join(self.spool_dir, hashlib.sha1(job.journal_id.encode("utf-8")).hexdigest() + ".json")
+        with open(body_path, "w", encoding="utf-8") as f:
+            json.dump({"html": job.html_part, "text": job.text_part}, f)
+        self.record([job.journal_id], "fetched", mailbox=job.watcher.account.state_key, uid=job.uid,
+                    uidvalidity=job.uidvalidity, subject=job.subject, message_id=job.message_id,
+                    priority=job.priority, body=body_path)
+
+    def rendered(self, job):
+        """Move the job's artifact into the spool directory and record it for every email in the job."""
+        path = job.artifact_path
+        if path and os.path.dirname(os.path.abspath(path)) != self.spool_dir:
+            dest = os.path.join(self.spool_dir, os.path.basename(path))
+            shutil.move(path, dest)
+            job.artifact_path = dest
+        self.record([member.journal_id for member in job.members], "rendered", artifact=job.artifact_path)
+
+    def sync(self):
+        """fsync everything written so far. Callers arriving during an fsync share the next one."""
+        with self.lock:
+            target = self.written
+        if self.synced >= target:
             return
+        with self.sync_lock:
+            with self.lock:
+                target = self.written
+                fd = self.file.fileno()
+            if self.synced >= target:
+                return
+            os.fsync(fd)
+            self.synced = target
 
-        html_body = get_best_body(msg)
-        temp_path = self.temp_manager.create_temp_file(subject, html_body)
+    def unfinished(self):
+        with self.lock:
+            return [dict(record) for record in self.open_jobs.values()]
 
-        print_successful = False
+    def forget(self, job_id):
+        """Drop a job that can't be resumed; the mailbox search will find its email again."""
+        with self.lock:
+            record = self.open_jobs.pop(job_id, None)
+            if record is not None:
+                self._retire(record)
+                self.records_since_compact += 1
 
-        if AUTO_PRINT_ENABLED:
-            try:
-                self.chrome_printer.print_html_file(temp_path, auto_print=True)
-                self.ui.add_job(subject, "Auto-printed ✓")
-                self.ui.increment_processed()
-                print_successful = True
-            except Exception as e:
-                error_msg = f"Print failed: {str(e)[:50]}"
-                self.ui.add_error(error_msg)
-                log_to_file(f"Print failed for '{subject}': {str(e)}", "ERROR")
-                print_successful = False
+    def compact_deadline(self):
+        """time.monotonic() when compact() next has work: a finished job's spool file past its
+        grace period, or enough records to rewrite the journal. None if there is nothing to do."""
+        with self.lock:
+            if self.records_since_compact >= self.COMPACT_AFTER_RECORDS:
+                return time.monotonic()
+            if not self.finished_files:
+                return None
+            return min(finished_at for finished_at, path in self.finished_files) + self.FINISHED_FILE_GRACE_SECONDS
+
+    def compact(self, force=False):
+        """Remove finished jobs' spool files and rewrite the journal with only unfinished jobs."""
+        with self.sync_lock, self.lock:
+            in_use = set()
+            for record in self.open_jobs.values():
+                in_use.update((record.get("body"), record.get("artifact")))
+            now = time.monotonic()
+            waiting = []
+            for finished_at, path in self.finished_files:
+                if path in in_use:
+                    continue
+                if now - finished_at < self.FINISHED_FILE_GRACE_SECONDS and not force:
+                    waiting.append((finished_at, path))
+                    continue
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+            self.finished_files = waiting
+
+            if not force and self.records_since_compact < self.COMPACT_AFTER_RECORDS:
+                return
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                for record in self.open_jobs.values():
+                    f.write(json.dumps(record) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+            self.file.close()
+            os.replace(tmp_path, self.path)
+            self.file = open(self.path, "a", encoding="utf-8")
+            self.records_since_compact = len(self.open_jobs)
+            self.synced = self.written
+
+    def close(self):
+        self.sync()
+        with self.lock:
+            self.file.close()
+
+
+# ==========================
+# Job Log
+# ==========================
+
+JOB_LOG_SEGMENT_RE = re.compile(r"^jobs-(\d{4}-\d{2}-\d{2})\.jsonl$")
+
+def job_outcome(success, unconfirmed=False):
+    if not success:
+        return "failed"
+    if unconfirmed:
+        return "unconfirmed"
+    return "printed" if AUTO_PRINT_ENABLED else "dialog_opened"
+
+class JobLog:
+    """Append-only record of every email that left the pipeline, one file per day.
+
+    Each line is a JSON object with the email's UID, Message-ID, subject, printer,
+    outcome, attempts and the seconds it spent in each stage. Lines are flushed to the
+    OS as they are written; the journal, not this log, is what a crash recovers from.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self.lock = threading.Lock()
+        self.file = None
+        self.segment_date = None
+        self.last_pruned = 0.0
+
+    def record(self, job, success):
+        """Write one line for every email in a finished job."""
+        finished = time.monotonic()
+        now = time.time()
+        outcome = job_outcome(success, job.unconfirmed)
+        lines = []
+        for member in job.members:
+            entry = {
+                "ts": round(now, 3),
+                "time": datetime.fromtimestamp(now).isoformat(timespec="seconds"),
+                "account": member.watcher.account.name,
+                "mailbox": member.watcher.account.state_key,
+                "uidvalidity": member.uidvalidity,
+                "uid": member.uid,
+                "message_id": member.message_id,
+                "subject": member.subject,
+                "printer": job.printer_name or "default",
+                "priority": member.priority,
+                "outcome": outcome,
+                "attempts": job.attempts + (1 if success else 0),
+                "timings": self._timings(job, member, finished),
+            }
+            if len(job.members) > 1:
+                entry["merged"] = len(job.members)
+            if not success and job.last_error:
+                entry["error"] = job.last_error[:500]
+            lines.append(json.dumps(entry, ensure_ascii=False) + "\n")
+        with self.lock:
+            self._open_segment(datetime.fromtimestamp(now).strftime("%Y-%m-%d"))
+            self.file.write("".join(lines))
+            self.file.flush()
+
+    @staticmethod
+    def _timings(job, member, finished):
+        """Seconds between the stage marks the workers left on the job (last attempt only)."""
+        marks = dict(job.marks, finished=finished)
+        timings = {}
+        for name, start, end in (("queued", member.queued_at, marks.get("render")),
+                                 ("render", marks.get("render"), marks.get("rendered")),
+                                 ("print_wait", marks.get("rendered"), marks.get("print")),
+                                 ("print", marks.get("print"), marks.get("printed")),
+                                 ("total", member.queued_at, finished)):
+            if start is not None and end is not None:
+                timings[name] = round(max(0.0, end - start), 3)
+        return timings
+
+    def _open_segment(self, date):
+        if date == self.segment_date:
+            return
+        if self.file is not None:
+            self.file.close()
+        self.file = open(os.path.join(self.directory, f"jobs-{date}.jsonl"), "a", encoding="utf-8")
+        self.segment_date = date
+
+    def prune(self):
+        """Delete day files older than JOB_LOG_RETENTION_DAYS."""
+        self.last_pruned = time.monotonic()
+        if JOB_LOG_RETENTION_DAYS <= 0:
+            return
+        cutoff = (datetime.now() - timedelta(days=JOB_LOG_RETENTION_DAYS)).strftime("%Y-%m-%d")
+        removed = 0
+        for name in os.listdir(self.directory):
+            match = JOB_LOG_SEGMENT_RE.match(name)
+            if match and match.group(1) < cutoff:
+                try:
+                    os.remove(os.path.join(self.directory, name))
+                    removed += 1
+                except OSError as e:
+                    log_to_file(f"Could not remove old job log {name}: {str(e)}", "WARNING")
+        if removed:
+            log_to_file(f"Job log: removed {removed} day file(s) older than {JOB_LOG_RETENTION_DAYS} days")
+
+    def prune_deadline(self):
+        """time.monotonic() of the next daily pruning (now, if it has never run)."""
+        if not self.last_pruned:
+            return time.monotonic()
+        return self.last_pruned + 24 * 3600
+
+    def close(self):
+        with self.lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+                self.segment_date = None
+
+
+class JobLogIndex:
+    """SQLite index over the job log's day files, used by the `jobs` command.
+
+    update() reads only what was appended since the last run, so lookups and totals over
+    months of logs come from indexed columns instead of a scan of every file. The day
+    files stay the source of truth: index.db can be deleted and is rebuilt on next use.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.conn = sqlite3.connect(os.path.join(directory, "index.db"))
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS segments (
+                name TEXT PRIMARY KEY,
+                size INTEGER NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS jobs (
+                segment TEXT NOT NULL,
+                ts REAL NOT NULL,
+                uid TEXT,
+                message_id TEXT,
+                order_ref TEXT,
+                subject TEXT,
+                printer TEXT,
+                outcome TEXT,
+                total REAL,
+                record TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS jobs_ts ON jobs (ts);
+            CREATE INDEX IF NOT EXISTS jobs_uid ON jobs (uid);
+            CREATE INDEX IF NOT EXISTS jobs_message_id ON jobs (message_id);
+            CREATE INDEX IF NOT EXISTS jobs_order_ref ON jobs (order_ref);
+            CREATE INDEX IF NOT EXISTS jobs_segment ON jobs (segment);
+        """)
+
+    def update(self):
+        """Index lines appended to the day files since the last update. Returns the number added."""
+        names = sorted(name for name in os.listdir(self.directory) if JOB_LOG_SEGMENT_RE.match(name))
+        indexed = dict(self.conn.execute("SELECT name, size FROM segments"))
+        order_re = re.compile(JOB_LOG_ORDER_PATTERN) if JOB_LOG_ORDER_PATTERN else None
+        added = 0
+        with self.conn:
+            for name in set(indexed) - set(names):
+                self._drop(name)  # pruned
+            for name in names:
+                offset = indexed.get(name, 0)
+                path = os.path.join(self.directory, name)
+                size = os.path.getsize(path)
+                if size == offset:
+                    continue
+                if size < offset:
+                    # Replaced or truncated since it was indexed: start over
+                    self._drop(name)
+                    offset = 0
+                with open(path, "rb") as f:
+                    f.seek(offset)
+                    data = f.read(size - offset)
+                # A line still being written is left for the next update
+                end = data.rfind(b"\n") + 1
+                rows = []
+                for line in data[:end].splitlines():
+                    try:
+                        entry = json.loads(line.decode("utf-8", errors="replace"))
+                    except ValueError:
+                        continue
+                    subject = entry.get("subject") or ""
+                    match = order_re.search(subject) if order_re else None
+                    order_ref = match.group(1 if match.re.groups else 0) if match else None
+                    rows.append((name, entry.get("ts", 0), entry.get("uid"), entry.get("message_id"), order_ref,
+                                 subject, entry.get("printer"), entry.get("outcome"),
+                                 (entry.get("timings") or {}).get("total"), json.dumps(entry, ensure_ascii=False)))
+                self.conn.executemany("INSERT INTO jobs VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+                self.conn.execute("INSERT OR REPLACE INTO segments (name, size) VALUES (?, ?)", (name, offset + end))
+                added += len(rows)
+        return added
+
+    def _drop(self, name):
+        self.conn.execute("DELETE FROM jobs WHERE segment = ?", (name,))
+        self.conn.execute("DELETE FROM segments WHERE name = ?", (name,))
+
+    @staticmethod
+    def _time_range(where, params, since, until):
+        if since is not None:
+            where += " AND ts >= ?"
+            params.append(since)
+        if until is not None:
+            where += " AND ts < ?"
+            params.append(until)
+        return where, params
+
+    def find(self, term, since=None, until=None, by_subject=False, limit=50):
+        """Records for an order number, UID or Message-ID (or a subject substring), newest first."""
+        if by_subject:
+            escaped = term.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+            where, params = "subject LIKE ? ESCAPE '\\'", [f"%{escaped}%"]
         else:
-            try:
-                self.chrome_printer.print_html_file(temp_path, auto_print=False)
-                self.ui.add_job(subject, "Print dialog opened 🖨️")
-                self.ui.increment_processed()
-                print_successful = True
-            except Exception as e:
-                error_msg = f"Failed to open dialog: {str(e)[:50]}"
-                self.ui.add_error(error_msg)
-                log_to_file(f"Failed to open dialog for '{subject}': {str(e)}", "ERROR")
-                print_successful = False
-
-        # Only delete email if print was successful AND delete is enabled
-        if print_successful and DELETE_EMAIL_AFTER_PRINT:
-            if self.delete_email(uid_bytes):
-                log_to_file(f"Email '{subject}' printed successfully and deleted from inbox", "SUCCESS")
-            else:
-                self.ui.add_error(f"Print succeeded but failed to delete email")
+            key = term.strip().lstrip("#").strip()
+            where = "(order_ref = ? OR uid = ? OR message_id = ? OR message_id = ?)"
+            params = [key, key, term.strip(), f"<{term.strip().strip('<>')}>"]
+        where, params = self._time_range(where, params, since, until)
+        rows = self.conn.execute(f"SELECT record FROM jobs WHERE {where} ORDER BY ts DESC LIMIT ?", params + [limit])
+        return [json.loads(record) for record, in rows]
+
+    def stats(self, since=None, until=None, by="hour", printer=None):
+        """[(period, jobs, failed, average total seconds)] in local time, oldest first."""
+        period = "%Y-%m-%d %H:00" if by == "hour" else "%Y-%m-%d"
+        where, params = self._time_range("1", [], since, until)
+        if printer:
+            where += " AND printer = ?"
+            params.append(printer)
+        return self.conn.execute(
+            f"SELECT strftime('{period}', ts, 'unixepoch', 'localtime') AS period, COUNT(*), "
+            f"SUM(outcome = 'failed'), AVG(total) FROM jobs WHERE {where} GROUP BY period ORDER BY period",
+            params,
+        ).fetchall()
+
+    def close(self):
+        self.conn.close()
+
+
+# ==========================
+# IMAP Daemon
+# ==========================
+
+# Untagged responses that mean new mail arrived while idling
+IDLE_NEW_MAIL_RE = re.compile(rb"^\* \d+ (EXISTS|RECENT)", re.IGNORECASE)
+
+def enable_tcp_keepalive(sock, idle_seconds):
+    """Have the OS probe a quiet connection, so one that was silently dropped fails instead of hanging."""
+    try:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+        if hasattr(socket, "TCP_KEEPIDLE"):  # Linux
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPIDLE, idle_seconds)
+        elif hasattr(socket, "TCP_KEEPALIVE"):  # macOS
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPALIVE, idle_seconds)
+        if hasattr(socket, "TCP_KEEPINTVL"):
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPINTVL, 15)
+        if hasattr(socket, "TCP_KEEPCNT"):
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPCNT, 4)
+        if hasattr(socket, "SIO_KEEPALIVE_VALS"):  # Windows
+            sock.ioctl(socket.SIO_KEEPALIVE_VALS, (1, idle_seconds * 1000, 15000))
+    except OSError as e:
+        log_to_file(f"Could not enable TCP keepalive: {str(e)}", "WARNING")
+
+class MailAccount:
+    """One account/mailbox/prefix entry to watch."""
+
+    def __init__(self, name, host, port, use_ssl, username, password, mailbox, subject_prefix, printed_uids_file,
+                 printer=PRINTER_NAME):
+        self.name = name
+        self.host = host
+        self.port = port
+        self.use_ssl = use_ssl
+        self.username = username
+        self.password = password
+        self.mailbox = mailbox
+        self.subject_prefix = subject_prefix
+        self.printed_uids_file = printed_uids_file
+        self.printer = printer
+
+    @property
+    def account_key(self):
+        return f"{self.username}@{self.host}"
+
+    @property
+    def state_key(self):
+        return f"{self.account_key}/{self.mailbox}"
+
+def load_accounts():
+    """Build the mailboxes to watch from ACCOUNTS, or the single account configured above."""
+    if not ACCOUNTS:
+        return [MailAccount(
+            IMAP_USERNAME, IMAP_HOST, IMAP_PORT, IMAP_USE_SSL, IMAP_USERNAME, IMAP_PASSWORD,
+            MAILBOX, SUBJECT_PREFIX, PRINTED_UIDS_FILE,
+        )]
+
+    accounts = []
+    for i, entry in enumerate(ACCOUNTS, 1):
+        name = entry.get("name") or f"account{i}"
+        accounts.append(MailAccount(
+            name=name,
+            host=entry.get("host", IMAP_HOST),
+            port=entry.get("port", IMAP_PORT),
+            use_ssl=entry.get("use_ssl", IMAP_USE_SSL),
+            username=entry.get("username", IMAP_USERNAME),
+            password=entry.get("password", IMAP_PASSWORD),
+            mailbox=entry.get("mailbox", MAILBOX),
+            subject_prefix=entry.get("subject_prefix", SUBJECT_PREFIX),
+            printed_uids_file=entry.get("printed_uids_file", f"printed_uids_{name}.txt"),
+            printer=entry.get("printer", PRINTER_NAME),
+        ))
+    return accounts
+
+
+class PrintJob:
+    """One matching message on its way through the render and print stages."""
+
+    def __init__(self, watcher, uid_bytes, subject, parts, priority=DEFAULT_PRIORITY, message_id=None):
+        self.watcher = watcher
+        self.uid_bytes = uid_bytes
+        self.uid = uid_bytes.decode("ascii", errors="ignore")
+        self.uidvalidity = watcher.uidvalidity
+        self.subject = subject
+        self.message_id = message_id
+        # (html_part, text_part) as found by find_best_parts()
+        self.html_part, self.text_part = parts
+        self.printer_name = watcher.account.printer
+        self.priority = priority
+        self.queued_at = time.monotonic()
+        self.html_path = None
+        self.artifact_path = None
+        self.attempts = 0
+        self.retry_at = None  # wall-clock time of the next retry, after a failure
+        self.last_error = None
+        self.marks = {}  # stage -> time.monotonic() when the job reached it, for the job log
+        self.unconfirmed = False  # handed to the printer, but it never confirmed the job
+
+    @property
+    def members(self):
+        return [self]
+
+    @property
+    def journal_id(self):
+        return journal_job_id(self.watcher.account.state_key, self.uidvalidity, self.uid)
+
+    def log(self, message, level="INFO"):
+        self.watcher.log(message, level)
+
+    def add_error(self, error_msg):
+        self.watcher.add_error(error_msg)
+
+
+class MergedJob:
+    """Several PrintJobs for the same printer rendered and printed as one document (merge mode)."""
+
+    def __init__(self, jobs):
+        self.members = jobs
+        self.subject = f"{len(jobs)} merged emails"
+        self.printer_name = jobs[0].printer_name
+        self.priority = min(job.priority for job in jobs)
+        self.queued_at = min(job.queued_at for job in jobs)
+        self.html_path = None
+        self.artifact_path = None
+        self.attempts = max(job.attempts for job in jobs)
+        self.retry_at = None
+        self.last_error = None
+        self.marks = {}
+        self.unconfirmed = False
+
+    def log(self, message, level="INFO"):
+        log_to_file(message, level)
+
+    def add_error(self, error_msg):
+        self.members[0].watcher.ui.add_error(error_msg)
+
+
+class AgingPriorityQueue(asyncio.Queue):
+    """asyncio.Queue that hands out the most urgent job first.
+
+    A job's priority improves by one level for every PRIORITY_AGING_SECONDS it has
+    waited, so low-priority jobs still get printed during a long backlog.
+    """
+
+    def _init(self, maxsize):
+        self._queue = []
+
+    def _put(self, job):
+        self._queue.append(job)
+
+    def _get(self):
+        now = time.monotonic()
+        best = min(range(len(self._queue)), key=lambda i: self._rank(self._queue[i], now))
+        return self._queue.pop(best)
+
+    def _rank(self, job, now):
+        priority = job.priority
+        if PRIORITY_AGING_SECONDS > 0:
+            priority -= (now - job.queued_at) / PRIORITY_AGING_SECONDS
+        return priority, job.queued_at
+
+    def count_by_priority(self, counts):
+        """Add the number of queued emails at each priority to counts."""
+        for job in self._queue:
+            for member in job.members:
+                counts[member.priority] = counts.get(member.priority, 0) + 1
+
+
+class MailboxWatcher:
+    """IMAP session and bookkeeping for one account/mailbox.
 
-        # Always mark as seen and save UID
-        self.mark_seen(uid_bytes)
+    All methods block on the network and are run off the event loop by ImapPrintDaemon.
+    """
+
+    def __init__(self, account, daemon):
+        self.account = account
+        self.daemon = daemon
+        self.ui = daemon.ui
+        self.conn = None
+        self.idle_tag = None
+        self.idle_buffer = b""  # the start of a line the server hasn't finished sending while idling
+        self.exists = None  # mailbox size as of the last EXISTS seen
+        self.last_activity = 0.0
+        self.connect_count = 0
+        self.reconnect_count = 0
+        self.backoff_seconds = RECONNECT_BACKOFF_INITIAL_SECONDS
+        # Flag changes from finished jobs, sent together by flush_flag_updates().
+        # Print workers add to these, so they are guarded by self.lock.
+        self.lock = threading.Lock()
+        self.pending_seen = set()
+        self.pending_delete = set()
+        # Set (on the event loop) when finished jobs have flags waiting, to cut IDLE short
+        self.flags_ready = None
+        # UIDs handed to the pipeline and not finished yet
+        self.in_flight = set()
+        # UIDs above the watermark seen by searches; the watermark stops at the first unfinished one
+        self.candidates = set()
+        self.state = daemon.state_store
+        self.uidvalidity = None
+        self.last_seen_uid = 0
+        self._load_uid_state()
+
+    def log(self, message, level="INFO"):
+        if self.daemon.multi_account:
+            message = f"[{self.account.name}] {message}"
+        log_to_file(message, level)
+
+    def set_status(self, status):
+        if self.daemon.multi_account:
+            status = f"[{self.account.name}] {status}"
+        self.ui.update_status(status)
+
+    def add_error(self, error_msg):
+        if self.daemon.multi_account:
+            error_msg = f"[{self.account.name}] {error_msg}"
+        self.ui.add_error(error_msg)
+
+    def _printed(self, uids):
+        """The UIDs (ints) from uids already handled under the current UIDVALIDITY."""
+        return self.state.printed_uids(self.account.account_key, self.account.mailbox, self.uidvalidity or 0, uids)
+
+    def _save_printed_uid(self, uid, uidvalidity=None):
+        if uidvalidity is None:
+            uidvalidity = self.uidvalidity or 0
+        self.state.mark_printed(self.account.account_key, self.account.mailbox, uidvalidity, int(uid))
+
+    def _skip_vanished(self, uid):
+        """A UID the server left out of an OK FETCH was expunged or moved; stop waiting for it."""
+        self.log(f"UID {uid} is no longer in {self.account.mailbox}, skipping it", "WARNING")
         self._save_printed_uid(uid)
 
-    def mark_seen(self, uid_bytes):
+    def _load_uid_state(self):
+        state = self.state.load_mailbox_state(self.account.account_key, self.account.mailbox)
+        if state is not None:
+            self.uidvalidity, self.last_seen_uid = state
+            return
+        # First start with the state store: carry over uid_state.json from an older version
+        state = load_legacy_uid_state(self.account.state_key)
+        if state is not None:
+            self.uidvalidity, self.last_seen_uid = state
+            self._save_uid_state()
+
+    def _save_uid_state(self):
+        self.state.save_mailbox_state(self.account.account_key, self.account.mailbox,
+                                      self.uidvalidity, self.last_seen_uid)
+
+    def _check_uidvalidity(self):
+        """Compare the server's UIDVALIDITY with the stored one; a change forces one full resync."""
+        typ, dat = self.conn.response("UIDVALIDITY")
+        if not dat or dat[0] is None:
+            return
+        uidvalidity = int(dat[-1])
+        if self.uidvalidity is not None and uidvalidity != self.uidvalidity:
+            self.log(f"UIDVALIDITY changed ({self.uidvalidity} -> {uidvalidity}), doing a full resync", "WARNING")
+            self.last_seen_uid = 0
+            self.candidates.clear()
+            # Queued flag changes refer to the old UIDs
+            with self.lock:
+                self.pending_seen.clear()
+                self.pending_delete.clear()
+        if uidvalidity != self.uidvalidity:
+            self.uidvalidity = uidvalidity
+            self._save_uid_state()
         try:
-            self.conn.uid("store", uid_bytes, "+FLAGS", "\\Seen")
+            self.state.migrate_printed_file(self.account.printed_uids_file, self.account.account_key,
+                                            self.account.mailbox, uidvalidity)
+        except Exception as e:
+            self.log(f"Could not migrate {self.account.printed_uids_file}: {str(e)}", "ERROR")
+
+    def _advance_uid_watermark(self):
+        """Move the high-water mark past every UID handled, stopping before the first one still printing or needing a retry."""
+        new_mark = self.last_seen_uid
+        printed = self._printed(self.candidates)
+        for uid in sorted(self.candidates):
+            if uid not in printed:
+                break
+            new_mark = uid
+        self.candidates = set(uid for uid in self.candidates if uid > new_mark)
+        if new_mark != self.last_seen_uid:
+            self.last_seen_uid = new_mark
+            self._save_uid_state()
+
+    def connect(self):
+        self.set_status("Connecting to mailbox... 🔌")
+        self.ui.render()
+        
+        account = self.account
+        if account.use_ssl:
+            self.conn = imaplib.IMAP4_SSL(account.host, account.port)
+        else:
+            self.conn = imaplib.IMAP4(account.host, account.port)
+        self.conn.sock.settimeout(IMAP_SOCKET_TIMEOUT_SECONDS)
+        enable_tcp_keepalive(self.conn.sock, IMAP_NOOP_INTERVAL_SECONDS)
+        
+        try:
+            self.conn.login(account.username, account.password)
+            self._refresh_capabilities()
+            typ, dat = self.conn.select(account.mailbox)
+            if typ != "OK":
+                raise imaplib.IMAP4.error(f"Could not select {account.mailbox}: {dat}")
+            self._check_uidvalidity()
         except:
+            self._drop_connection()
+            raise
+        
+        self.last_activity = time.monotonic()
+        if self.connect_count:
+            self.reconnect_count += 1
+            self.ui.increment_reconnects()
+            self.log(f"Reconnected to mailbox (reconnect #{self.reconnect_count})")
+        self.connect_count += 1
+        self.set_status("Connected ✓")
+        self.log("Connected to mailbox successfully")
+
+    def ensure_connected(self):
+        """Reuse the open session, reconnecting only when it is actually broken."""
+        if self.conn is not None:
+            if time.monotonic() - self.last_activity < IMAP_NOOP_INTERVAL_SECONDS:
+                return
+            try:
+                self.conn.noop()
+                self.last_activity = time.monotonic()
+                return
+            except (imaplib.IMAP4.abort, OSError) as e:
+                self.log(f"Keepalive failed, connection is dead: {str(e)}", "WARNING")
+                self._drop_connection()
+        self.connect()
+
+    def _drop_connection(self):
+        """Close a broken session without trying to LOGOUT over it."""
+        self.idle_tag = None
+        self.idle_buffer = b""
+        self.exists = None
+        if self.conn is not None:
+            try:
+                self.conn.shutdown()
+            except:
+                pass
+            self.conn = None
+
+    def _trim_untagged_responses(self):
+        """Drop stale untagged responses so a long-lived session doesn't accumulate them."""
+        if self.conn is not None:
+            for key in list(self.conn.untagged_responses):
+                if key not in ("EXISTS", "RECENT", "EXPUNGE"):
+                    del self.conn.untagged_responses[key]
+
+    def next_backoff(self):
+        """Seconds to wait before the next reconnect attempt (doubles each time)."""
+        delay = self.backoff_seconds
+        self.backoff_seconds = min(self.backoff_seconds * 2, RECONNECT_BACKOFF_MAX_SECONDS)
+        return delay
+
+    def _refresh_capabilities(self):
+        """Re-read CAPABILITY after login; many servers only advertise IDLE once authenticated."""
+        try:
+            typ, dat = self.conn.capability()
+            if typ == "OK" and dat and dat[-1]:
+                self.conn.capabilities = tuple(dat[-1].decode("ascii", errors="ignore").upper().split())
+        except imaplib.IMAP4.error:
             pass
 
-    def run_forever(self):
+    def supports_idle(self):
+        return IMAP_IDLE_ENABLED and self.conn is not None and "IDLE" in self.conn.capabilities
+
+    def _mailbox_grew(self):
+        """Consume pending EXISTS/RECENT/EXPUNGE responses; True if the mailbox has more messages than before.
+
+        Only a rising EXISTS count means new mail: some servers repeat RECENT (or the
+        unchanged EXISTS) with every response.
+        """
+        _, expunged = self.conn.response("EXPUNGE")
+        _, exists = self.conn.response("EXISTS")
+        self.conn.response("RECENT")
+        if self.exists is not None and expunged[0] is not None:
+            self.exists -= len(expunged)
+        if exists[-1] is None:
+            return False
+        count = int(exists[-1])
+        grew = self.exists is not None and count > self.exists
+        self.exists = count
+        return grew
+
+    def start_idle(self):
+        """Enter IDLE. Returns False without idling if new mail is already waiting."""
+        # Mail that arrived while we were busy shows up as untagged EXISTS on later commands
+        if self._mailbox_grew():
+            return False
+
+        tag = self.conn._new_tag()
+        self.conn.tagged_commands.pop(tag, None)  # we read the completion ourselves
+        self.conn.send(tag + b" IDLE\r\n")
+        line = self.conn._get_line()
+        if not line.startswith(b"+"):
+            raise imaplib.IMAP4.error(f"IDLE rejected: {line.decode('utf-8', errors='replace')}")
+        self.idle_tag = tag
+        self.idle_buffer = b""
+        return True
+
+    def read_idle_notifications(self, socket_readable):
+        """Consume whatever the server sent while idling, without blocking.
+
+        Returns True if an EXISTS/RECENT notification arrived. A line that has only
+        partly arrived is kept in idle_buffer until the rest of it does.
+        """
+        sock = self.conn.sock
+        received = b""
+        previous_timeout = sock.gettimeout()
+        sock.setblocking(False)
+        try:
+            while True:
+                try:
+                    # read1() hands back what imaplib already buffered before touching the socket
+                    data = self.conn.file.read1(65536)
+                except (BlockingIOError, ssl.SSLWantReadError):
+                    break
+                if not data:
+                    # Empty means "would block" as well as EOF; it is only a real disconnect
+                    # if the socket was readable and gave us nothing
+                    if socket_readable and not received:
+                        raise imaplib.IMAP4.abort("socket error: EOF")
+                    break
+                received += data
+        finally:
+            sock.settimeout(previous_timeout)
+
+        *lines, self.idle_buffer = (self.idle_buffer + received).split(b"\r\n")
+        new_mail = False
+        for line in lines:
+            if line.startswith(b"* BYE"):
+                raise imaplib.IMAP4.abort(line.decode("utf-8", errors="replace"))
+            if IDLE_NEW_MAIL_RE.match(line):
+                new_mail = True
+        return new_mail
+
+    def stop_idle(self):
+        """Leave IDLE. Returns True if new mail was announced while finishing."""
+        tag, self.idle_tag = self.idle_tag, None
+        new_mail = False
+        self.conn.send(b"DONE\r\n")
+        while True:
+            # Finish the line read_idle_notifications left half-read
+            line = self.idle_buffer + self.conn._get_line()
+            self.idle_buffer = b""
+            if line.startswith(tag):
+                if not line[len(tag):].strip().upper().startswith(b"OK"):
+                    raise imaplib.IMAP4.error(f"IDLE failed: {line.decode('utf-8', errors='replace')}")
+                break
+            if IDLE_NEW_MAIL_RE.match(line):
+                new_mail = True
+        self.last_activity = time.monotonic()
+        return new_mail
+
+    def disconnect(self):
+        if self.conn is not None:
+            try:
+                self.conn.close()
+            except:
+                pass
+            try:
+                self.conn.logout()
+            except:
+                pass
+            self.conn = None
+
+    def close(self):
+        """Leave IDLE, flush queued flags and log out. Used at shutdown."""
+        if self.conn is None:
+            return
+        try:
+            self.conn.sock.settimeout(5)
+            if self.idle_tag is not None:
+                self.stop_idle()
+            self.flush_flag_updates()
+        except:
+            pass
+        self.disconnect()
+
+    def delete_email(self, uid_bytes):
+        """Queue email for deletion after successful print. Only called when DELETE_EMAIL_AFTER_PRINT is True.
+
+        The STORE and EXPUNGE happen together in the next flush_flag_updates().
+        """
+        self.pending_delete.add(uid_bytes)
+        return True
+
+    def flush_flag_updates(self):
+        """Apply queued \\Seen and \\Deleted flags with one UID-set STORE each and a single expunge."""
+        with self.lock:
+            pending_seen, self.pending_seen = self.pending_seen, set()
+            pending_delete, self.pending_delete = self.pending_delete, set()
+        if pending_seen or pending_delete:
+            # finish_job() records the UID before queueing its flags, so this puts every
+            # UID (and its journal records) on disk before its \Seen or \Deleted reaches the server
+            self.state.commit()
+            if self.daemon.journal is not None:
+                self.daemon.journal.sync()
+
+        if pending_delete:
+            uid_set = format_uid_set(pending_delete)
+            try:
+                with metrics.time("imap_store"):
+                    typ, dat = self.conn.uid("store", uid_set, "+FLAGS.SILENT", "(\\Seen \\Deleted)")
+                if typ != "OK":
+                    raise imaplib.IMAP4.error(f"STORE failed: {dat}")
+                with metrics.time("imap_expunge"):
+                    if "UIDPLUS" in self.conn.capabilities:
+                        # Only removes our messages, and doesn't touch anything else flagged \Deleted
+                        typ, dat = self.conn.uid("expunge", uid_set)
+                    else:
+                        typ, dat = self.conn.expunge()
+                if typ != "OK":
+                    raise imaplib.IMAP4.error(f"EXPUNGE failed: {dat}")
+                self.log(f"Email UID(s) {uid_set} deleted from inbox", "SUCCESS")
+                self._journal_flags(pending_delete, "deleted")
+            except imaplib.IMAP4.abort:
+                self._requeue_flags(pending_seen, pending_delete)
+                raise
+            except imaplib.IMAP4.error as e:
+                self.add_error(f"Print succeeded but failed to delete {len(pending_delete)} email(s)")
+                self.log(f"Failed to delete email UID(s) {uid_set}: {str(e)}", "ERROR")
+                self._journal_flags(pending_delete, "flagged")
+            pending_seen -= pending_delete
+
+        if pending_seen:
+            try:
+                with metrics.time("imap_store"):
+                    self.conn.uid("store", format_uid_set(pending_seen), "+FLAGS.SILENT", "(\\Seen)")
+            except imaplib.IMAP4.abort:
+                self._requeue_flags(pending_seen, set())
+                raise
+            except imaplib.IMAP4.error:
+                pass
+            self._journal_flags(pending_seen, "flagged")
+
+    def _journal_flags(self, uid_bytes_set, stage):
+        if self.daemon.journal is not None:
+            job_ids = [journal_job_id(self.account.state_key, self.uidvalidity, uid.decode("ascii", errors="ignore"))
+                       for uid in uid_bytes_set]
+            self.daemon.journal.record(job_ids, stage)
+
+    def _requeue_flags(self, seen, delete):
+        """Put flags back after the connection dropped mid-flush; they go out after the reconnect."""
+        with self.lock:
+            self.pending_seen |= seen
+            self.pending_delete |= delete
+
+    def search_candidate_uids(self):
+        self.set_status("Searching for messages... 🔍")
         self.ui.render()
         
-        while True:
+        # Anything announced before this search is covered by it
+        self._mailbox_grew()
+
+        prefix = self.account.subject_prefix
+        if self.last_seen_uid:
+            criteria = f'(UID {self.last_seen_uid + 1}:* SUBJECT "{prefix}")'
+        else:
+            criteria = f'(SUBJECT "{prefix}")'
+        with metrics.time("imap_search"):
+            status, data = self.conn.uid("search", None, criteria)
+
+        if status != "OK" or not data or not data[0]:
+            return []
+        
+        # "N:*" always matches the highest UID, even when it is below N
+        return [uid for uid in data[0].split() if int(uid) > self.last_seen_uid]
+
+    def fetch_messages_batched(self, uid_list):
+        """Yield (uid_bytes, subject, (html_part, text_part), priority, message_id) for new messages whose subject matches.
+
+        Headers for a whole batch come back in one round-trip; bodies are then pulled
+        only for matching messages, most urgent first, FETCH_BODY_BATCH_SIZE at a time.
+        """
+        header_items = f"BODY.PEEK[HEADER.FIELDS ({' '.join(priority_header_fields())})]"
+        if PARTIAL_FETCH_ENABLED:
+            header_items = "BODYSTRUCTURE " + header_items
+
+        for header_batch in chunked(uid_list, FETCH_HEADER_BATCH_SIZE):
+            self.set_status(f"Fetching headers for {len(header_batch)} message(s)... 📨")
+            self.ui.render()
+            with metrics.time("imap_fetch_headers"):
+                status, data = self.conn.uid("fetch", format_uid_set(header_batch), f"(UID {header_items})")
+            if status != "OK":
+                raise imaplib.IMAP4.error(f"Header fetch failed: {data}")
+            headers = parse_fetch_response(data)
+
+            matching = []
+            priorities = {}
+            message_ids = {}
+            for uid_bytes in header_batch:
+                uid = uid_bytes.decode("ascii", errors="ignore")
+                items = headers.get(uid)
+                if items is None:
+                    self._skip_vanished(uid)
+                    continue
+                header_bytes = find_fetch_item(items, "BODY[HEADER")
+                if header_bytes is None:
+                    self.add_error(f"Failed to fetch UID {uid}")
+                    continue
+                with metrics.time("parse"):
+                    header_msg = email.message_from_bytes(header_bytes)
+                subject = get_subject(header_msg)
+                if subject_matches_prefix(subject, self.account.subject_prefix):
+                    matching.append((uid_bytes, subject, items.get("BODYSTRUCTURE")))
+                    priorities[uid_bytes] = message_priority(header_msg)
+                    message_ids[uid_bytes] = header_msg.get("Message-ID")
+                else:
+                    self._save_printed_uid(uid)
+
+            # Stable sort: UID order within each priority level
+            matching.sort(key=lambda m: priorities[m[0]])
+            fetch_bodies = self._fetch_printable_parts if PARTIAL_FETCH_ENABLED else self._fetch_full_bodies
+            for priority, group in itertools.groupby(matching, key=lambda m: priorities[m[0]]):
+                for uid_bytes, subject, parts in fetch_bodies(list(group)):
+                    yield uid_bytes, subject, parts, priority, message_ids.get(uid_bytes)
+
+    def _fetch_full_bodies(self, matching):
+        for body_batch in chunked(matching, FETCH_BODY_BATCH_SIZE):
+            uids = [uid_bytes for uid_bytes, _, _ in body_batch]
+            with metrics.time("imap_fetch_body"):
+                status, data = self.conn.uid("fetch", format_uid_set(uids), "(UID RFC822)")
+            if status != "OK":
+                raise imaplib.IMAP4.error(f"Body fetch failed: {data}")
+            bodies = parse_fetch_response(data)
+            for uid_bytes, subject, _ in body_batch:
+                uid = uid_bytes.decode("ascii", errors="ignore")
+                if uid not in bodies:
+                    self._skip_vanished(uid)
+                    continue
+                raw = bodies[uid].get("RFC822")
+                if raw is None:
+                    self.add_error(f"Failed to fetch UID {uid}")
+                    continue
+                try:
+                    with metrics.time("parse"):
+                        msg = email.message_from_bytes(raw)
+                    with metrics.time("select_body"):
+                        parts = find_best_parts(msg)
+                except Exception as e:
+                    self.add_error(f"Error processing UID")
+                    self.log(f"Error processing UID {uid}: {str(e)}", "ERROR")
+                    continue
+                yield uid_bytes, subject, parts
+
+    def _fetch_printable_parts(self, matching):
+        """Download only the MIME section get_best_body() would choose, grouped by section number."""
+        by_section = {}
+        fallback = []
+        for uid_bytes, subject, structure in matching:
             try:
-                if self.temp_manager.should_cleanup():
-                    self.ui.update_status("Cleaning up old temp files... 🧹")
-                    self.ui.render()
-                    self.temp_manager.cleanup_old_files()
-                
-                self.disconnect()
-                self.connect()
-
-                uids = self.search_candidate_uids()
-                self.ui.set_messages_found(len(uids))
-                
-                new_uids = [uid for uid in uids if uid.decode("ascii", errors="ignore") not in self.printed_uids]
-                self.ui.set_pending(len(new_uids))
-                
-                if new_uids:
-                    log_to_file(f"Found {len(new_uids)} new message(s) to process")
-                
-                self.ui.update_status("Processing messages... ⚙️")
-                self.ui.render()
+                part = choose_printable_part(structure) if isinstance(structure, list) else False
+            except (ValueError, IndexError, TypeError):
+                part = False
+            if part is False:
+                fallback.append((uid_bytes, subject, structure))
+            elif part is None:
+                yield uid_bytes, subject, (None, None)
+            else:
+                by_section.setdefault(part[0], []).append((uid_bytes, subject, part))
 
-                for uid_bytes in new_uids:
+        for section, group in by_section.items():
+            for part_batch in chunked(group, FETCH_BODY_BATCH_SIZE):
+                uids = [uid_bytes for uid_bytes, _, _ in part_batch]
+                with metrics.time("imap_fetch_body"):
+                    status, data = self.conn.uid("fetch", format_uid_set(uids), f"(UID BODY.PEEK[{section}])")
+                if status != "OK":
+                    raise imaplib.IMAP4.error(f"Body fetch failed: {data}")
+                parts = parse_fetch_response(data)
+                for uid_bytes, subject, (_, ctype, charset, encoding) in part_batch:
+                    uid = uid_bytes.decode("ascii", errors="ignore")
+                    if uid not in parts:
+                        self._skip_vanished(uid)
+                        continue
+                    payload = parts[uid].get(f"BODY[{section}]")
                     try:
-                        self.process_message(uid_bytes)
+                        if isinstance(payload, str):
+                            payload = payload.encode("utf-8")
+                        with metrics.time("select_body"):
+                            body = decode_transfer_encoding(payload or b"", encoding).decode(charset or "utf-8", errors="replace")
                     except Exception as e:
-                        self.ui.add_error(f"Error processing UID")
-                        log_to_file(f"Error processing UID: {str(e)}", "ERROR")
+                        self.log(f"Partial fetch failed for UID {uid}, fetching full message: {str(e)}", "WARNING")
+                        fallback.append((uid_bytes, subject, None))
+                        continue
+                    if ctype == "text/html":
+                        yield uid_bytes, subject, (body, None)
+                    else:
+                        yield uid_bytes, subject, (None, body)
 
-                self.ui.set_pending(0)
-                self.ui.update_status("Idle - Waiting for next check 😴")
-                self.ui.update_check_time()
+        if fallback:
+            yield from self._fetch_full_bodies(fallback)
 
-            except imaplib.IMAP4.error as e:
-                self.ui.add_error(f"IMAP error")
-                self.ui.update_status("IMAP error - Reconnecting... ⚠️")
-                self.ui.render()
-                log_to_file(f"IMAP error: {str(e)}", "ERROR")
-                self.disconnect()
-                time.sleep(10)
+    def queue_message(self, uid_bytes, subject=None, parts=None, priority=DEFAULT_PRIORITY, message_id=None):
+        """Hand a matching message to the render stage (fetching it first if needed)."""
+        uid = uid_bytes.decode("ascii", errors="ignore")
+        if uid in self.in_flight:
+            return
+
+        self.set_status(f"Processing message UID {uid}... ⚙️")
+        self.ui.render()
+        
+        if parts is None:
+            with metrics.time("imap_fetch_body"):
+                status, data = self.conn.uid("fetch", uid_bytes, "(RFC822)")
+            if status == "OK" and (not data or data[0] is None):
+                self._skip_vanished(uid)
+                return
+            if status != "OK" or not data or not data[0]:
+                self.add_error(f"Failed to fetch UID {uid}")
+                return
+
+            raw = data[0][1]
+            with metrics.time("parse"):
+                msg = email.message_from_bytes(raw)
+            subject = get_subject(msg)
+
+            if not subject_matches_prefix(subject, self.account.subject_prefix):
+                self._save_printed_uid(uid)
+                return
+
+            with metrics.time("select_body"):
+                parts = find_best_parts(msg)
+            priority = message_priority(msg)
+            message_id = msg.get("Message-ID")
+
+        self.in_flight.add(uid)
+        try:
+            job = PrintJob(self, uid_bytes, subject, parts, priority, message_id)
+            if self.daemon.journal is not None:
+                self.daemon.journal.fetched(job)
+            self.daemon.enqueue_job(job)
+        except BaseException:
+            self.in_flight.discard(uid)
+            raise
+
+    def finish_job(self, job, print_successful):
+        """Record a job that left the pipeline; its flags go out with the next flush."""
+        self._save_printed_uid(job.uid, job.uidvalidity)
+        with self.lock:
+            # Skip flags for UIDs from before a UIDVALIDITY change
+            if job.uidvalidity != self.uidvalidity and self.daemon.journal is not None:
+                self.daemon.journal.record([job.journal_id], "flagged", skipped=True)
+            if job.uidvalidity == self.uidvalidity:
+                # Only delete email if print was successful AND delete is enabled
+                if print_successful and DELETE_EMAIL_AFTER_PRINT:
+                    self.delete_email(job.uid_bytes)
+                    self.log(f"Email '{job.subject}' printed successfully and queued for deletion", "SUCCESS")
+
+                # Always mark as seen and save UID
+                self.mark_seen(job.uid_bytes)
+        self.in_flight.discard(job.uid)
+
+    def mark_seen(self, uid_bytes):
+        self.pending_seen.add(uid_bytes)
+
+    def run_cycle(self):
+        """Find new messages, queue them for printing and send flags for jobs that have finished."""
+        self.ensure_connected()
+
+        uids = self.search_candidate_uids()
+        self.ui.set_messages_found(len(uids))
+        # The search covers every UID above the watermark, so a candidate it no longer returns
+        # was expunged or moved and must not hold the watermark back
+        found = set(int(uid) for uid in uids)
+        self.candidates = found | set(uid for uid in self.candidates if str(uid) in self.in_flight)
+        
+        printed = self._printed(int(uid) for uid in uids)
+        new_uids = []
+        for uid_bytes in uids:
+            uid = uid_bytes.decode("ascii", errors="ignore")
+            if int(uid) not in printed and uid not in self.in_flight:
+                new_uids.append(uid_bytes)
+        
+        if new_uids:
+            self.log(f"Found {len(new_uids)} new message(s) to process")
+        
+        self.set_status("Processing messages... ⚙️")
+        self.ui.render()
+
+        if BATCHED_FETCH_ENABLED:
+            messages = self.fetch_messages_batched(new_uids)
+        else:
+            messages = ((uid_bytes, None, None, DEFAULT_PRIORITY, None) for uid_bytes in new_uids)
+
+        for uid_bytes, subject, parts, priority, message_id in messages:
+            try:
+                self.queue_message(uid_bytes, subject, parts, priority, message_id)
+            except Exception as e:
+                self.add_error(f"Error processing UID")
+                self.log(f"Error processing UID: {str(e)}", "ERROR")
+
+        self.flush_flag_updates()
+        self._advance_uid_watermark()
+        self._trim_untagged_responses()
+        self.last_activity = time.monotonic()
+        self.backoff_seconds = RECONNECT_BACKOFF_INITIAL_SECONDS
+
+
+class ImapPrintDaemon:
+    """Watches every configured mailbox concurrently on one asyncio event loop."""
+
+    def __init__(self, headless=False):
+        self.headless = headless
+        self.ui = HeadlessUI() if headless else ConsoleUI()
+        self.chrome_printer = create_printer(self.ui)
+        self.temp_manager = TempFileManager(self.ui)
+        self.pdf_cache = None
+        if PDF_CACHE_ENABLED and AUTO_PRINT_ENABLED and self.chrome_printer.renders_pdf:
+            self.pdf_cache = PdfCache(self.ui)
+        self.asset_cache = AssetCache() if ASSET_CACHE_ENABLED else None
+        self.native_text = NATIVE_TEXT_RENDER_ENABLED and AUTO_PRINT_ENABLED and self.chrome_printer.renders_pdf
+        self.state_store = StateStore(STATE_DB_FILE)
+        self.journal = JobJournal(JOURNAL_FILE, JOURNAL_SPOOL_DIR) if JOURNAL_ENABLED else None
+        self.job_log = JobLog(JOB_LOG_DIR) if JOB_LOG_ENABLED else None
+        self.accounts = load_accounts()
+        self.multi_account = len(self.accounts) > 1
+        self.ui.set_accounts(self.accounts)
+        self.watchers = [MailboxWatcher(account, self) for account in self.accounts]
+        self.printer_names = sorted(set(account.printer for account in self.accounts))
+        # Pipeline state; the queues are created on the event loop in _run()
+        self.loop = None
+        self.render_queue = None
+        self.merge_queue = None
+        self.print_queues = {}
+        self.merging = 0
+        self.rendering = 0
+        self.printing = 0
+        self.retrying = 0
+        # Headless: set to make _status_loop look at its deadlines again
+        self.status_wake = None
+        # Set when a finished job may have brought _maintenance_loop an earlier deadline
+        self.maintenance_wake = None
+        self.terminated = False  # set by SIGTERM
+        # Render/print work runs here so it never waits behind IMAP threads blocked on a full queue
+        self.job_executor = ThreadPoolExecutor(max_workers=RENDER_WORKERS + len(self.printer_names))
+        # A watcher runs one IMAP command at a time, so one thread each is enough; idle mailboxes
+        # wait on the event loop and hold no thread
+        self.imap_executor = ThreadPoolExecutor(max_workers=len(self.watchers))
+        # State commits, journal syncs and cleanup get their own threads (one per periodic loop),
+        # so IMAP threads blocked on a full render queue can't starve them
+        self.housekeeping_executor = ThreadPoolExecutor(max_workers=3)
+        metrics.add_collector(self.collect_metrics)
+        self.metrics_server = None
+        if METRICS_ENABLED:
+            try:
+                self.metrics_server = MetricsServer(METRICS_HOST, METRICS_PORT)
+            except OSError as e:
+                log_to_file(f"Could not serve metrics on {METRICS_HOST}:{METRICS_PORT}: {str(e)}", "WARNING")
+        
+        # Log startup
+        log_to_file("=" * 80)
+        log_to_file("AutoPrint Service Started")
+        for account in self.accounts:
+            log_to_file(f"Mailbox: {account.username}")
+            log_to_file(f"Folder: {account.mailbox}")
+        log_to_file(f"Auto-Print: {AUTO_PRINT_ENABLED}")
+        log_to_file(f"Delete After Print: {DELETE_EMAIL_AFTER_PRINT}")
+        if self.metrics_server is not None:
+            log_to_file(f"Metrics: http://{METRICS_HOST}:{METRICS_PORT}/metrics")
+
+    def run_forever(self):
+        if os.name == "nt":
+            # add_reader() needs a selector event loop; the Windows default (Proactor) lacks it
+            asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
+        asyncio.run(self._run())
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        self.loop = loop
+        try:
+            # systemd and container runtimes stop services with SIGTERM: cancel the pipeline
+            # so run_forever() returns and main() shuts down as for Ctrl+C
+            loop.add_signal_handler(signal.SIGTERM, self._terminate, asyncio.current_task())
+        except (NotImplementedError, RuntimeError, ValueError):
+            pass  # Windows loops have no signal handlers; only the main thread may set them
+        self.render_queue = AgingPriorityQueue(maxsize=RENDER_QUEUE_SIZE)
+        for watcher in self.watchers:
+            watcher.flags_ready = asyncio.Event()
+        self.ui.render()
+        tasks = [self._watch(watcher) for watcher in self.watchers]
+        if MERGE_BATCH_SIZE > 1:
+            self.merge_queue = AgingPriorityQueue(maxsize=RENDER_WORKERS)
+            tasks.append(self._merge_worker())
+        tasks += [self._render_worker() for _ in range(RENDER_WORKERS)]
+        for printer_name in self.printer_names:
+            # One submit worker per printer keeps each printer's jobs in order
+            self.print_queues[printer_name] = AgingPriorityQueue(maxsize=PRINT_QUEUE_SIZE)
+            tasks.append(self._print_worker(self.print_queues[printer_name]))
+        if self.headless:
+            self.status_wake = asyncio.Event()
+            tasks.append(self._status_loop())
+        else:
+            tasks.append(self._ui_loop())
+        self.maintenance_wake = asyncio.Event()
+        tasks.append(self._maintenance_loop())
+        if self.journal is not None:
+            tasks.append(self._resume_jobs(self._load_unfinished_jobs()))
+        try:
+            await asyncio.gather(*tasks)
+        except asyncio.CancelledError:
+            if not self.terminated:
+                raise
+
+    def _terminate(self, main_task):
+        log_to_file("SIGTERM received, stopping")
+        self.terminated = True
+        main_task.cancel()
+
+    def _load_unfinished_jobs(self):
+        """Rebuild the jobs a previous run left unfinished. Returns [(next step, job)].
+
+        Jobs that were submitted but never confirmed printed are printed again: a
+        duplicate slip is easier to spot than a missing one.
+        """
+        watchers = {watcher.account.state_key: watcher for watcher in self.watchers}
+        resumed = []
+        merged = {}  # artifact -> members of a merged job
+        for record in self.journal.unfinished():
+            watcher = watchers.get(record.get("mailbox"))
+            artifact = record.get("artifact")
+            body = record.get("body")
+            stage = record["stage"]
+            if watcher is None:
+                self.journal.forget(record["id"])
+                continue
+            parts = (None, None)
+            if stage in ("printed", "flagged"):
+                step = "finish"
+            elif stage == "dead_letter":
+                step = "give_up"
+            elif artifact and os.path.exists(artifact):
+                step = "print"
+            elif body and os.path.exists(body):
+                try:
+                    with open(body, "r", encoding="utf-8") as f:
+                        saved = json.load(f)
+                    parts = (saved.get("html"), saved.get("text"))
+                    step = "render"
+                except Exception as e:
+                    log_to_file(f"Could not read spooled body {body}: {str(e)}", "ERROR")
+                    step = None
+            else:
+                step = None
+            if step is None:
+                # Nothing usable left on disk; the mailbox search will pick the email up again
+                self.journal.forget(record["id"])
                 continue
+
+            job = PrintJob(watcher, record["uid"].encode("ascii"), record.get("subject", ""), parts,
+                           record.get("priority", DEFAULT_PRIORITY), record.get("message_id"))
+            job.uidvalidity = record.get("uidvalidity")
+            job.attempts = record.get("attempts", 0)
+            job.retry_at = record.get("retry_at")
+            watcher.in_flight.add(job.uid)
+            if step == "print":
+                job.artifact_path = artifact
+                merged.setdefault(artifact, []).append(job)
+            else:
+                resumed.append((step, job))
+
+        for artifact, jobs in merged.items():
+            job = jobs[0] if len(jobs) == 1 else MergedJob(jobs)
+            job.artifact_path = artifact
+            job.retry_at = jobs[0].retry_at
+            resumed.append(("print", job))
+        self.journal.compact(force=True)
+        if resumed:
+            log_to_file(f"Resuming {len(resumed)} unfinished job(s) from {JOURNAL_FILE}")
+        return resumed
+
+    async def _resume_jobs(self, resumed):
+        for step, job in resumed:
+            job.log(f"Resuming '{job.subject}' ({step})")
+            if step in ("finish", "give_up"):
+                await self._finish_job(job, step == "finish")
+            elif job.retry_at is not None:
+                self._schedule_retry(job)
+            elif step == "print":
+                await self.print_queues[job.printer_name].put(job)
+            else:
+                await self.render_queue.put(job)
+
+    async def _watch(self, watcher):
+        loop = asyncio.get_running_loop()
+        while True:
+            try:
+                watcher.flags_ready.clear()
+                await loop.run_in_executor(self.imap_executor, watcher.run_cycle)
+                self._wake_status_loop()
+                if watcher.supports_idle():
+                    watcher.set_status("Idle - Listening for new mail (IMAP IDLE) 📡")
+                    self.ui.update_check_time(push=True)
+                    await self._idle(watcher)
+                else:
+                    watcher.set_status("Idle - Waiting for next check 😴")
+                    self.ui.update_check_time()
+                    await self._poll_wait()
+
+            except (imaplib.IMAP4.abort, OSError) as e:
+                # Socket-level failure: the session is gone, reconnect with backoff
+                watcher.add_error(f"Connection lost")
+                watcher.set_status("Connection lost - Reconnecting... ⚠️")
+                watcher.log(f"IMAP connection lost: {str(e)}", "ERROR")
+                watcher._drop_connection()
+                await asyncio.sleep(watcher.next_backoff())
+            except imaplib.IMAP4.error as e:
+                # Protocol-level error: the session itself is still usable
+                watcher.add_error(f"IMAP error")
+                watcher.set_status("IMAP error - Retrying... ⚠️")
+                watcher.log(f"IMAP error: {str(e)}", "ERROR")
+                await asyncio.sleep(watcher.next_backoff())
             except Exception as e:
-                self.ui.add_error(f"Unexpected error")
-                self.ui.update_status("Error - Retrying... ⚠️")
-                self.ui.render()
-                log_to_file(f"Unexpected error: {str(e)}", "ERROR")
-                time.sleep(10)
+                watcher.add_error(f"Unexpected error")
+                watcher.set_status("Error - Retrying... ⚠️")
+                watcher.log(f"Unexpected error: {str(e)}", "ERROR")
+                watcher._drop_connection()
+                await asyncio.sleep(watcher.next_backoff())
+
+    async def _idle(self, watcher):
+        """Wait in IMAP IDLE until new mail arrives or it is time to renew."""
+        loop = asyncio.get_running_loop()
+        if not await loop.run_in_executor(self.imap_executor, watcher.start_idle):
+            return
+
+        # A dead connection surfaces through TCP keepalive as a read error, so IDLE only needs renewing
+        deadline = loop.time() + IMAP_IDLE_RENEW_SECONDS
+        # Anything buffered alongside the "+ idling" continuation won't wake the selector
+        new_mail = watcher.read_idle_notifications(socket_readable=False)
+        while not new_mail:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            if await self._wait_readable(watcher.conn.sock, remaining, wake=watcher.flags_ready):
+                new_mail = watcher.read_idle_notifications(socket_readable=True)
+            elif watcher.flags_ready.is_set():
+                # Printed jobs are waiting for their flags; leave IDLE so the next cycle sends them
+                break
+
+        if await loop.run_in_executor(self.imap_executor, watcher.stop_idle) or new_mail:
+            watcher.log("IDLE: new mail notification received")
+
+    async def _wait_readable(self, sock, timeout, wake=None):
+        """Wait without a thread until the socket has data; False on timeout or when `wake` is set."""
+        # SSL sockets may hold decrypted bytes the selector can't see
+        pending = getattr(sock, "pending", None)
+        if pending and pending():
+            return True
+
+        loop = asyncio.get_running_loop()
+        readable = loop.create_future()
+        waiters = [readable]
+        if wake is not None:
+            waiters.append(asyncio.ensure_future(wake.wait()))
+        fd = sock.fileno()
+        loop.add_reader(fd, lambda: readable.done() or readable.set_result(True))
+        try:
+            await asyncio.wait(waiters, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+            return readable.done()
+        finally:
+            loop.remove_reader(fd)
+            for waiter in waiters[1:]:
+                waiter.cancel()
+
+    async def _poll_wait(self):
+        if self.multi_account or self.headless:
+            await asyncio.sleep(POLL_INTERVAL_SECONDS)
+            return
+        for remaining in range(POLL_INTERVAL_SECONDS, 0, -1):
+            self.ui.set_countdown(remaining, POLL_INTERVAL_SECONDS)
+            await asyncio.sleep(1)
+        self.ui.set_countdown(0, POLL_INTERVAL_SECONDS)
+
+    def enqueue_job(self, job):
+        """Hand a fetched message to the render stage. Called from IMAP threads; blocks while the queue is full."""
+        asyncio.run_coroutine_threadsafe(self.render_queue.put(job), self.loop).result()
+
+    async def _merge_worker(self):
+        """Collect jobs per printer and pass them on as MergedJobs once a batch is full or its window closes."""
+        loop = asyncio.get_running_loop()
+        batches = {}  # printer name -> (deadline, jobs)
+        # One get() outlives timeouts: cancelling it with wait_for() could lose a job it had
+        # just taken off the queue (before Python 3.12)
+        get = None
+        try:
+            while True:
+                timeout = None
+                if batches:
+                    timeout = max(0, min(deadline for deadline, _ in batches.values()) - loop.time())
+                if get is None:
+                    get = asyncio.ensure_future(self.render_queue.get())
+                done, _ = await asyncio.wait([get], timeout=timeout)
+                job = None
+                if done:
+                    job, get = get.result(), None
+                if job is not None and job.priority < DEFAULT_PRIORITY:
+                    # Urgent jobs are never held back waiting for a batch to fill
+                    await self.merge_queue.put(job)
+                elif job is not None:
+                    deadline, jobs = batches.setdefault(job.printer_name, (loop.time() + MERGE_WINDOW_SECONDS, []))
+                    jobs.append(job)
+                    self.merging += 1
+
+                now = loop.time()
+                for printer_name, (deadline, jobs) in list(batches.items()):
+                    if len(jobs) >= MERGE_BATCH_SIZE or deadline <= now:
+                        del batches[printer_name]
+                        await self.merge_queue.put(jobs[0] if len(jobs) == 1 else MergedJob(jobs))
+                        self.merging -= len(jobs)
+        finally:
+            if get is not None:
+                get.cancel()
+
+    async def _render_worker(self):
+        loop = asyncio.get_running_loop()
+        source = self.merge_queue or self.render_queue
+        while True:
+            job = await source.get()
+            self.rendering += 1
+            job.marks["render"] = time.monotonic()
+            try:
+                await loop.run_in_executor(self.job_executor, self._render_job, job)
+            except Exception as e:
+                self.rendering -= 1
+                await self._job_failed(job, e)
                 continue
+            self.rendering -= 1
+            job.marks["rendered"] = time.monotonic()
+            # Waits here while this printer's queue is full, which in turn fills the render queue
+            self.printing += 1
+            try:
+                await self.print_queues[job.printer_name].put(job)
+            finally:
+                self.printing -= 1
+
+    async def _print_worker(self, queue):
+        loop = asyncio.get_running_loop()
+        batching = AUTO_PRINT_ENABLED and self.chrome_printer.supports_batch
+        while True:
+            jobs = [await queue.get()]
+            # During a burst, everything already waiting for this printer goes in one spool call
+            while batching and len(jobs) < SPOOL_BATCH_SIZE and not queue.empty():
+                jobs.append(queue.get_nowait())
+            self.printing += len(jobs)
+            started = time.monotonic()
+            try:
+                error = await loop.run_in_executor(self.job_executor, self._print_jobs, jobs)
+            finally:
+                self.printing -= len(jobs)
+            for job in jobs:
+                job.marks["print"] = started
+                job.marks["printed"] = time.monotonic()
+                if error is None:
+                    await self._finish_job(job, True)
+                else:
+                    await self._job_failed(job, error)
+
+    def _render_job(self, job):
+        self._render_artifact(job)
+        # The body is only kept this long in case rendering has to be retried
+        for member in job.members:
+            member.html_part = member.text_part = None
+        if self.journal is not None:
+            self.journal.rendered(job)
+
+    def _render_artifact(self, job):
+        cache_key = None
+        if isinstance(job, MergedJob):
+            with metrics.time("format_body"):
+                html_body = merge_html_documents([format_best_body(m.html_part, m.text_part) for m in job.members])
+            job.log(f"Merged {len(job.members)} emails into one document")
+        else:
+            if self.native_text and not job.html_part and job.text_part and fits_text_font(job.text_part):
+                # Plain text needs no browser: lay it out straight into a PDF. Anything Courier
+                # can't show (Cyrillic, CJK, emoji, ...) goes through Chrome like HTML does
+                job.artifact_path = os.path.join(tempfile.gettempdir(), f"print_{uuid.uuid4().hex}.pdf")
+                with metrics.time("render_text"), open(job.artifact_path, "wb") as f:
+                    f.write(render_text_pdf(job.text_part))
+                return
+
+            with metrics.time("format_body"):
+                html_body = format_best_body(job.html_part, job.text_part)
+            if self.pdf_cache is not None:
+                cache_key = PdfCache.key_for(html_body)
+                pdf_path = os.path.join(tempfile.gettempdir(), f"print_{uuid.uuid4().hex}.pdf")
+                if self.pdf_cache.get(cache_key, pdf_path):
+                    job.log(f"Using cached PDF for '{job.subject}'")
+                    job.artifact_path = pdf_path
+                    return
+
+        if self.asset_cache is not None:
+            with metrics.time("localize_assets"):
+                html_body = self.asset_cache.localize(html_body)
+        script = self.chrome_printer.print_script(auto_print=AUTO_PRINT_ENABLED)
+        with metrics.time("temp_write"):
+            job.html_path = self.temp_manager.create_temp_file(job.subject, html_body, script)
+        del html_body
+        with metrics.time("render"):
+            job.artifact_path = self.chrome_printer.render(job.html_path, auto_print=AUTO_PRINT_ENABLED)
+        if cache_key is not None:
+            self.pdf_cache.put(cache_key, job.artifact_path)
+
+    def _print_jobs(self, jobs):
+        """Submit jobs for one printer; a batch succeeds or fails as a whole. Returns the error, if any."""
+        job_ids = [member.journal_id for job in jobs for member in job.members]
+        if self.journal is not None:
+            self.journal.record(job_ids, "submitted")
+        try:
+            with metrics.time("submit"):
+                if len(jobs) == 1:
+                    confirmed = self.chrome_printer.submit(jobs[0].artifact_path, auto_print=AUTO_PRINT_ENABLED,
+                                                           printer_name=jobs[0].printer_name)
+                else:
+                    self.chrome_printer.submit_batch([job.artifact_path for job in jobs], jobs[0].printer_name)
+                    confirmed = True
+        except Exception as e:
+            return e
+        if self.journal is not None:
+            self.journal.record(job_ids, "printed")
+        for job in jobs:
+            job.unconfirmed = not confirmed
+            for member in job.members:
+                if job.unconfirmed:
+                    member.log(f"Print of '{member.subject}' was not confirmed; keeping the email", "WARNING")
+                    self.ui.add_job(member.subject, "Sent, unconfirmed ⚠️")
+                elif AUTO_PRINT_ENABLED:
+                    self.ui.add_job(member.subject, "Auto-printed ✓")
+                else:
+                    self.ui.add_job(member.subject, "Print dialog opened 🖨️")
+                self.ui.increment_processed()
+        return None
+
+    def _report_failure(self, job, e):
+        if AUTO_PRINT_ENABLED:
+            job.add_error(f"Print failed: {str(e)[:50]}")
+            job.log(f"Print failed for '{job.subject}': {str(e)}", "ERROR")
+        else:
+            job.add_error(f"Failed to open dialog: {str(e)[:50]}")
+            job.log(f"Failed to open dialog for '{job.subject}': {str(e)}", "ERROR")
+
+    async def _job_failed(self, job, e):
+        """Park a failed job for a retry with backoff, or give up on it after RETRY_MAX_ATTEMPTS."""
+        self._report_failure(job, e)
+        job.last_error = str(e)
+        job.attempts += 1
+        if job.attempts >= RETRY_MAX_ATTEMPTS:
+            await asyncio.get_running_loop().run_in_executor(self.job_executor, self._dead_letter, job)
+            await self._finish_job(job, False)
+            return
+        delay = min(RETRY_BACKOFF_MAX_SECONDS, RETRY_BACKOFF_INITIAL_SECONDS * 2 ** (job.attempts - 1))
+        job.retry_at = time.time() + delay
+        metrics.inc("autoprint_job_retries_total", len(job.members))
+        job.log(f"Retrying '{job.subject}' in {delay}s (attempt {job.attempts + 1} of {RETRY_MAX_ATTEMPTS})", "WARNING")
+        if self.journal is not None:
+            self.journal.record([member.journal_id for member in job.members], "retry",
+                                attempts=job.attempts, retry_at=round(job.retry_at, 3))
+        self._schedule_retry(job)
+
+    def _schedule_retry(self, job):
+        self.retrying += 1
+        asyncio.ensure_future(self._retry_later(job))
 
-            for remaining in range(POLL_INTERVAL_SECONDS, 0, -1):
-                self.ui.set_countdown(remaining, POLL_INTERVAL_SECONDS)
+    async def _retry_later(self, job):
+        """Wait out the backoff on its own task, so waiting retries never hold up new jobs."""
+        try:
+            await asyncio.sleep(max(0, job.retry_at - time.time()))
+        finally:
+            self.retrying -= 1
+        job.retry_at = None
+        if job.artifact_path and os.path.exists(job.artifact_path):
+            # Rendered already: only the print step is repeated
+            await self.print_queues[job.printer_name].put(job)
+        else:
+            await (self.merge_queue or self.render_queue).put(job)
+
+    def _dead_letter(self, job):
+        """Give up on a job, keeping its rendered file in DEAD_LETTER_DIR for a manual reprint."""
+        job.log(f"Giving up on '{job.subject}' after {job.attempts} failed attempts", "ERROR")
+        job.add_error(f"Gave up after {job.attempts} attempts")
+        if job.artifact_path and os.path.exists(job.artifact_path):
+            try:
+                os.makedirs(DEAD_LETTER_DIR, exist_ok=True)
+                dest = os.path.join(DEAD_LETTER_DIR, os.path.basename(job.artifact_path))
+                shutil.move(job.artifact_path, dest)
+                job.log(f"Rendered file for '{job.subject}' kept at {dest}")
+            except OSError as e:
+                job.log(f"Could not keep rendered file {job.artifact_path}: {str(e)}", "ERROR")
+        job.artifact_path = None
+        if self.journal is not None:
+            self.journal.record([member.journal_id for member in job.members], "dead_letter", artifact=None)
+
+    async def _finish_job(self, job, success):
+        """Hand every email in a finished job back to its watcher for flags and UID bookkeeping."""
+        loop = asyncio.get_running_loop()
+        for member in job.members:
+            try:
+                # An unconfirmed print keeps its email, in case it has to be reprinted by hand
+                await loop.run_in_executor(self.job_executor, member.watcher.finish_job, member,
+                                           success and not job.unconfirmed)
+            except Exception as e:
+                member.log(f"Could not record UID {member.uid} as printed: {str(e)}", "ERROR")
+            # Wake an idling watcher once its last outstanding job is done, so one flush covers the batch
+            if not member.watcher.in_flight:
+                member.watcher.flags_ready.set()
+        metrics.inc("autoprint_jobs_total", len(job.members), outcome=job_outcome(success, job.unconfirmed))
+        if self.job_log is not None:
+            try:
+                await loop.run_in_executor(self.job_executor, self.job_log.record, job, success)
+            except Exception as e:
+                log_to_file(f"Could not write job log record for '{job.subject}': {str(e)}", "ERROR")
+        self._wake_status_loop()
+        self.maintenance_wake.set()
+
+    def pending_jobs(self):
+        """(rendering, printing, retrying): jobs queued for or being worked on by each stage, or waiting to be retried."""
+        printing = self.printing + sum(queue.qsize() for queue in self.print_queues.values())
+        rendering = self.render_queue.qsize() + self.merging + self.rendering
+        if self.merge_queue is not None:
+            rendering += self.merge_queue.qsize()
+        return rendering, printing, self.retrying
+
+    def collect_metrics(self):
+        """Queue depths and connection counts for /metrics, read from the live pipeline when scraped."""
+        rendering, printing, retrying = self.pending_jobs() if self.render_queue is not None else (0, 0, 0)
+        queues = []
+        if self.render_queue is not None:
+            queues.append(({"queue": "render"}, self.render_queue.qsize()))
+        if self.merge_queue is not None:
+            queues.append(({"queue": "merge"}, self.merge_queue.qsize() + self.merging))
+        for printer_name, queue in self.print_queues.items():
+            queues.append(({"queue": "print", "printer": printer_name or "default"}, queue.qsize()))
+        accounts = [{"account": watcher.account.name, "mailbox": watcher.account.mailbox} for watcher in self.watchers]
+        return [
+            ("autoprint_queue_depth", "gauge", "Jobs waiting in each pipeline queue.", queues),
+            ("autoprint_jobs_pending", "gauge", "Jobs queued for or in each stage, or waiting to be retried.",
+             [({"stage": "render"}, rendering), ({"stage": "print"}, printing), ({"stage": "retry"}, retrying)]),
+            ("autoprint_jobs_in_flight", "gauge", "Emails fetched but not yet finished, per mailbox.",
+             [(labels, len(watcher.in_flight)) for labels, watcher in zip(accounts, self.watchers)]),
+            ("autoprint_imap_connected", "gauge", "1 while the mailbox has an open IMAP session.",
+             [(labels, int(watcher.conn is not None)) for labels, watcher in zip(accounts, self.watchers)]),
+            ("autoprint_imap_reconnects_total", "counter", "IMAP sessions re-established after the first connect.",
+             [(labels, watcher.reconnect_count) for labels, watcher in zip(accounts, self.watchers)]),
+        ]
+
+    def queued_by_priority(self):
+        counts = {}
+        for queue in [self.render_queue, self.merge_queue] + list(self.print_queues.values()):
+            if queue is not None:
+                queue.count_by_priority(counts)
+        return counts
+
+    async def _housekeeping(self, func, description):
+        """Run one periodic step off the loop. A failure (locked DB, full disk) is logged and
+        the step is tried again next time round, instead of ending the whole daemon."""
+        try:
+            await asyncio.get_running_loop().run_in_executor(self.housekeeping_executor, func)
+        except Exception as e:
+            log_to_file(f"{description} failed: {str(e)}", "ERROR")
+
+    async def _ui_loop(self):
+        while True:
+            self.ui.set_pending(*self.pending_jobs())
+            self.ui.set_queued_by_priority(self.queued_by_priority())
+            try:
                 self.ui.render()
-                time.sleep(1)
-            
-            self.ui.set_countdown(0, POLL_INTERVAL_SECONDS)
+            except Exception as e:
+                log_to_file(f"Dashboard redraw failed: {str(e)}", "ERROR")
+            await self._housekeeping(self.state_store.commit_if_due, "State store commit")
+            if self.journal is not None:
+                await self._housekeeping(self.journal.sync, "Journal sync")
+            await asyncio.sleep(1)
+
+    async def _status_loop(self):
+        """Headless stand-in for _ui_loop that sleeps until something is actually due.
+
+        Prints a status line every HEADLESS_STATUS_INTERVAL_SECONDS, and commits the state
+        store and journal when woken after a mail cycle or finished job, or when a batched
+        commit falls due.
+        """
+        next_report = 0.0
+        while True:
+            self.status_wake.clear()
+            await self._housekeeping(self.state_store.commit_if_due, "State store commit")
+            if self.journal is not None:
+                await self._housekeeping(self.journal.sync, "Journal sync")
+            if time.monotonic() >= next_report:
+                self.ui.set_pending(*self.pending_jobs())
+                self.ui.set_queued_by_priority(self.queued_by_priority())
+                try:
+                    self.ui.report()
+                except Exception as e:
+                    log_to_file(f"Status report failed: {str(e)}", "ERROR")
+                next_report = time.monotonic() + HEADLESS_STATUS_INTERVAL_SECONDS
+            deadline = next_report
+            commit_at = self.state_store.commit_deadline()
+            if commit_at is not None:
+                if commit_at <= time.monotonic():
+                    # Only still overdue if the commit above failed: retry in a second rather than spin
+                    commit_at = time.monotonic() + 1
+                deadline = min(deadline, commit_at)
+            try:
+                await asyncio.wait_for(self.status_wake.wait(), max(0, deadline - time.monotonic()))
+            except asyncio.TimeoutError:
+                pass
+
+    def _wake_status_loop(self):
+        if self.status_wake is not None:
+            self.status_wake.set()
+
+    def _maintenance_steps(self):
+        """(deadline, step, description) for each cleanup the loop runs; deadline is time.monotonic() or None."""
+        steps = [(self.temp_manager.cleanup_deadline(), self._cleanup_temp_files, "Temp file cleanup"),
+                 (self.state_store.compact_deadline(), self.state_store.compact, "State store compaction")]
+        if self.pdf_cache is not None:
+            steps.append((self.pdf_cache.evict_deadline(), self.pdf_cache.evict, "PDF cache eviction"))
+        if self.asset_cache is not None:
+            steps.append((self.asset_cache.evict_deadline(), self.asset_cache.evict, "Asset cache eviction"))
+        if self.journal is not None:
+            steps.append((self.journal.compact_deadline(), self.journal.compact, "Journal compaction"))
+        if self.job_log is not None:
+            steps.append((self.job_log.prune_deadline(), self.job_log.prune, "Job log pruning"))
+        return steps
+
+    def _cleanup_temp_files(self):
+        self.ui.update_status("Cleaning up old temp files... 🧹")
+        self.temp_manager.cleanup_old_files()
+
+    async def _maintenance_loop(self):
+        """Sleep until the earliest cleanup, eviction or compaction deadline, then run what is due.
+
+        Finished jobs wake the loop to look at the deadlines again (a first cache entry or
+        temp file brings one in). Steps run at most once a minute, so a failing one is
+        retried then rather than in a tight loop.
+        """
+        loop = asyncio.get_running_loop()
+        not_before = time.monotonic() + 60
+        while True:
+            self.maintenance_wake.clear()
+            steps = await loop.run_in_executor(self.housekeeping_executor, self._maintenance_steps)
+            now = time.monotonic()
+            if now >= not_before:
+                due = [(step, description) for deadline, step, description in steps
+                       if deadline is not None and deadline <= now]
+                for step, description in due:
+                    await self._housekeeping(step, description)
+                if due:
+                    not_before = time.monotonic() + 60
+                    continue
+            deadlines = [deadline for deadline, _, _ in steps if deadline is not None]
+            timeout = None
+            if deadlines:
+                timeout = max(min(deadlines), not_before) - now
+            try:
+                await asyncio.wait_for(self.maintenance_wake.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    def disconnect(self):
+        metrics.remove_collector(self.collect_metrics)
+        if self.metrics_server is not None:
+            self.metrics_server.close()
+        for watcher in self.watchers:
+            watcher.close()
+        self.job_executor.shutdown(wait=False)
+        self.imap_executor.shutdown(wait=False)
+        self.housekeeping_executor.shutdown(wait=False)
+        self.chrome_printer.close()
+        self.state_store.close()
+        if self.journal is not None:
+            self.journal.close()
+        if self.job_log is not None:
+            self.job_log.close()
 
 
 # ==========================
 # Entry Point
 # ==========================
 
+def parse_when(text):
+    """argparse type for --since/--until: YYYY-MM-DD, "YYYY-MM-DD HH:MM", or 12h / 7d ago. Returns a timestamp."""
+    text = text.strip()
+    match = re.fullmatch(r"(\d+)([hd])", text)
+    if match:
+        return time.time() - int(match.group(1)) * (3600 if match.group(2) == "h" else 86400)
+    for fmt in ("%Y-%m-%d %H:%M", "%Y-%m-%d"):
+        try:
+            return datetime.strptime(text, fmt).timestamp()
+        except ValueError:
+            pass
+    raise argparse.ArgumentTypeError(f"expected YYYY-MM-DD, \"YYYY-MM-DD HH:MM\" or e.g. 12h / 7d, not {text!r}")
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Watch IMAP mailboxes and print matching emails.")
+    parser.add_argument(
+        "--headless", action="store_true",
+        help="run without the dashboard (for systemd/containers) and write a JSON status line "
+             "to stdout every HEADLESS_STATUS_INTERVAL_SECONDS",
+    )
+    commands = parser.add_subparsers(dest="command")
+    jobs = commands.add_parser("jobs", help="query the job log (JOB_LOG_DIR) instead of running the service")
+    jobs_commands = jobs.add_subparsers(dest="jobs_command")
+    jobs_commands.required = True
+
+    find = jobs_commands.add_parser("find", help="look up an email by order number, UID or Message-ID")
+    find.add_argument("term", help='order number ("#1234"), UID or Message-ID')
+    find.add_argument("--subject", action="store_true", help="match TERM anywhere in the subject instead")
+    find.add_argument("--limit", type=int, default=50, help="newest matches to show (default 50)")
+    find.add_argument("--json", action="store_true", help="print the raw JSON records")
+
+    stats = jobs_commands.add_parser("stats", help="jobs printed and failed per hour or day")
+    stats.add_argument("--by", choices=("hour", "day"), default="hour")
+    stats.add_argument("--printer", help="only jobs for this printer")
+
+    for command in (find, stats):
+        command.add_argument("--since", type=parse_when,
+                             help="YYYY-MM-DD, \"YYYY-MM-DD HH:MM\" or e.g. 12h / 7d ago "
+                                  "(stats default: 24h by hour, 30d by day)")
+        command.add_argument("--until", type=parse_when, help="same formats as --since")
+    return parser.parse_args(argv)
+
+def format_job_record(record):
+    timings = record.get("timings") or {}
+    lines = [
+        f"{record.get('time', '')}  {record.get('outcome', '?'):<13}  {record.get('printer', '')}  "
+        f"UID {record.get('uid')}  {record.get('message_id') or '-'}  {record.get('subject', '')}",
+        "    " + ", ".join(f"{name} {seconds:.1f}s" for name, seconds in timings.items())
+        + f"; {record.get('attempts', 0)} attempt(s); {record.get('account', '')}",
+    ]
+    if record.get("error"):
+        lines.append(f"    error: {record['error']}")
+    return "\n".join(lines)
+
+def run_jobs_command(args):
+    """`jobs find` / `jobs stats`: answer questions from the job log. Returns the exit status."""
+    if not os.path.isdir(JOB_LOG_DIR):
+        print(f"No job log at {JOB_LOG_DIR}")
+        return 1
+    index = JobLogIndex(JOB_LOG_DIR)
+    try:
+        index.update()
+        if args.jobs_command == "find":
+            records = index.find(args.term, args.since, args.until, by_subject=args.subject, limit=args.limit)
+            if not records and not args.json:
+                print(f"No jobs found for {args.term!r}")
+            for record in records:
+                print(json.dumps(record, ensure_ascii=False) if args.json else format_job_record(record))
+            return 0 if records else 1
+
+        since = args.since
+        if since is None:
+            since = time.time() - (86400 if args.by == "hour" else 30 * 86400)
+        rows = index.stats(since, args.until, args.by, args.printer)
+        print(f"{args.by.capitalize():<17} {'Jobs':>6} {'Failed':>7} {'Failure':>8} {'Avg time':>9}")
+        total_jobs = total_failed = 0
+        for period, jobs, failed, average in rows:
+            total_jobs += jobs
+            total_failed += failed
+            average_text = f"{average:.1f}s" if average is not None else "-"
+            print(f"{period:<17} {jobs:>6} {failed:>7} {failed / jobs:>8.1%} {average_text:>9}")
+        if total_jobs:
+            print(f"{'Total':<17} {total_jobs:>6} {total_failed:>7} {total_failed / total_jobs:>8.1%}")
+        else:
+            print("No jobs in this period")
+        return 0
+    finally:
+        index.close()
+
 def main():
-    daemon = ImapPrintDaemon()
+    args = parse_args()
+    if args.command == "jobs":
+        sys.exit(run_jobs_command(args))
+    daemon = ImapPrintDaemon(headless=args.headless)
     try:
-        daemon.run_forever()
-    except KeyboardInterrupt:
+        try:
+            # Returns once SIGTERM has stopped the pipeline; Ctrl+C arrives as KeyboardInterrupt
+            daemon.run_forever()
+        except KeyboardInterrupt:
+            pass
+        if args.headless:
+            log_to_file("Service shutting down (signal received)")
+            daemon.temp_manager.cleanup_all_files()
+            daemon.disconnect()
+            daemon.ui.report()
+            log_to_file("Service stopped cleanly")
+            log_to_file("=" * 80)
+            close_log()
+            return
+
         daemon.ui.clear_screen()
         print()
         term_width = daemon.ui.terminal_width
@@ -844,6 +4553,10 @@ def main():
         daemon.disconnect()
         log_to_file("Service stopped cleanly")
         log_to_file("=" * 80)
+        close_log()
+    finally:
+        # Runs before any traceback is printed, so it lands on a usable terminal
+        daemon.ui.restore_terminal()
 
 
 if __name__ == "__main__":
@@ -16,7 +16,7 @@ SUBJECT_PREFIX = "[SHOPIFY ORDER]"
 
 AUTO_PRINT_ENABLED = True
 DELETE_EMAIL_AFTER_PRINT = False  # Keep emails for safety
-CHROME_PRINT_WAIT_SECONDS = 8
+CHROME_PRINT_WAIT_SECONDS = 8  # Upper limit; jobs finish as soon as Chrome is done
 TEMP_FILE_CLEANUP_HOURS = 6
 
 # ============================================================
@@ -35,7 +35,7 @@ SUBJECT_PREFIX = "[PRINT]"
 
 AUTO_PRINT_ENABLED = True
 DELETE_EMAIL_AFTER_PRINT = True  # Auto-delete after successful print
-CHROME_PRINT_WAIT_SECONDS = 5  # Faster for high volume
+CHROME_PRINT_WAIT_SECONDS = 5  # Keep low: a Chrome that never exits holds each job this long
 TEMP_FILE_CLEANUP_HOURS = 2  # More frequent cleanup
 
 # ============================================================
@@ -54,26 +54,35 @@ SUBJECT_PREFIX = "[TEST PRINT]"
 
 AUTO_PRINT_ENABLED = False  # Open print dialog for manual confirmation
 DELETE_EMAIL_AFTER_PRINT = False
-CHROME_PRINT_WAIT_SECONDS = 8
+CHROME_PRINT_WAIT_SECONDS = 8  # Upper limit; jobs finish as soon as Chrome is done
 TEMP_FILE_CLEANUP_HOURS = 12
 
 # ============================================================
-# EXAMPLE 4: Multiple Store Setup (Run multiple instances)
+# EXAMPLE 4: Multiple Store Setup (one process watches every inbox)
 # ============================================================
 
-# Store 1 Configuration (save as autoprint_store1.py)
-IMAP_HOST = "imap.gmail.com"
-IMAP_USERNAME = "store1@business.com"
-SUBJECT_PREFIX = "[STORE1]"
-LOG_FILE = "autoprint_store1.log"
-PRINTED_UIDS_FILE = "printed_uids_store1.txt"
-
-# Store 2 Configuration (save as autoprint_store2.py)
-IMAP_HOST = "imap.gmail.com"
-IMAP_USERNAME = "store2@business.com"
-SUBJECT_PREFIX = "[STORE2]"
-LOG_FILE = "autoprint_store2.log"
-PRINTED_UIDS_FILE = "printed_uids_store2.txt"
+# Settings above act as defaults; each entry overrides what differs.
+# Every mailbox is watched concurrently. Stores share the default printer unless
+# they set "printer" (devtools backend only; kiosk Chrome prints to the default).
+ACCOUNTS = [
+    {
+        "name": "store1",
+        "host": "imap.gmail.com",
+        "username": "store1@business.com",
+        "password": "store1-app-password",
+        "subject_prefix": "[STORE1]",
+    },
+    {
+        "name": "store2",
+        "host": "imap.gmail.com",
+        "username": "store2@business.com",
+        "password": "store2-app-password",
+        "mailbox": "Orders",
+        "subject_prefix": "[STORE2]",
+        "printed_uids_file": "printed_uids_store2.txt",  # only read once to migrate older installs
+        "printer": "Warehouse_Zebra",  # default: PRINTER_NAME
+    },
+]
 
 # ============================================================
 # EXAMPLE 5: Custom Chrome Path
@@ -131,7 +131,7 @@ TEMP_FILE_CLEANUP_HOURS = 6
 
 DEBUG = False
 LOG_FILE = "autoprint.log"
-PRINTED_UIDS_FILE = "printed_uids.txt"
+STATE_DB_FILE = "autoprint_state.db"
 """
         
         # Write to file
@@ -0,0 +1,63 @@
+import imaplib
+import importlib.util
+import os
+import socket
+import threading
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.fixture
+def autoprint(tmp_path, monkeypatch):
+    """A fresh copy of autoprint-service.py (its file name can't be imported), logging into tmp_path."""
+    spec = importlib.util.spec_from_file_location("autoprint_service", os.path.join(ROOT, "autoprint-service.py"))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    monkeypatch.setattr(module, "LOG_FILE", str(tmp_path / "autoprint.log"))
+    yield module
+    module.close_log()
+
+
+class ScriptedServer:
+    """An IMAP server socket the test writes to by hand, after the capability handshake."""
+
+    def __init__(self):
+        self.listener = socket.socket()
+        self.listener.bind(("127.0.0.1", 0))
+        self.listener.listen(1)
+        self.port = self.listener.getsockname()[1]
+        self.sock = None
+        self.file = None
+        self.ready = threading.Thread(target=self._handshake, daemon=True)
+        self.ready.start()
+
+    def _handshake(self):
+        self.sock, _ = self.listener.accept()
+        self.file = self.sock.makefile("rb")
+        self.sock.sendall(b"* OK ready\r\n")
+        tag = self.readline().split()[0]
+        self.sock.sendall(b"* CAPABILITY IMAP4rev1 IDLE\r\n" + tag + b" OK done\r\n")
+
+    def readline(self):
+        return self.file.readline()
+
+    def send(self, data):
+        self.sock.sendall(data)
+
+    def close(self):
+        for closable in (self.file, self.sock, self.listener):
+            if closable is not None:
+                closable.close()
+
+
+@pytest.fixture
+def imap():
+    """(imaplib connection, ScriptedServer) connected to each other and past the greeting."""
+    server = ScriptedServer()
+    conn = imaplib.IMAP4("127.0.0.1", server.port)
+    server.ready.join()
+    yield conn, server
+    conn.shutdown()
+    server.close()
@@ -0,0 +1,104 @@
+import functools
+import http.server
+import os
+import pathlib
+import re
+import tempfile
+import threading
+import urllib.parse
+
+import pytest
+
+
+class RecordingHandler(http.server.SimpleHTTPRequestHandler):
+    def do_GET(self):
+        self.server.requests.append(self.path)
+        super().do_GET()
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def site(tmp_path):
+    """A local web server for tmp_path/site; returns (base URL, site directory, requested paths)."""
+    root = tmp_path / "site"
+    root.mkdir()
+    server = http.server.HTTPServer(("127.0.0.1", 0), functools.partial(RecordingHandler, directory=str(root)))
+    server.requests = []
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_address[1]}", root, server.requests
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def cache(autoprint, tmp_path, monkeypatch):
+    monkeypatch.setattr(tempfile, "tempdir", str(tmp_path / "tmp"))
+    os.makedirs(tempfile.tempdir)
+    cache = autoprint.AssetCache()
+    yield cache
+    cache.executor.shutdown()
+
+
+def local_path(uri):
+    assert uri.startswith("file://"), uri
+    return urllib.parse.unquote(urllib.parse.urlsplit(uri).path)
+
+
+def test_localize_points_images_at_local_copies(cache, site):
+    base, root, requests = site
+    (root / "logo.png").write_bytes(b"\x89PNG logo")
+    page = f'<img src="{base}/logo.png"><img src="{base}/missing.png">'
+
+    localized = cache.localize(page)
+
+    logo_uri = localized.split('"')[1]
+    assert pathlib.Path(local_path(logo_uri)).read_bytes() == b"\x89PNG logo"
+    # What can't be downloaded stays remote
+    assert f'<img src="{base}/missing.png">' in localized
+
+    # Served from the cache the second time
+    assert cache.localize(page) == localized
+    assert sorted(requests) == ["/logo.png", "/missing.png"]
+
+
+def test_stylesheet_references_are_resolved_and_localized(cache, site):
+    base, root, _ = site
+    (root / "css").mkdir()
+    (root / "css" / "img").mkdir()
+    (root / "fonts").mkdir()
+    (root / "css" / "img" / "bg.png").write_bytes(b"background")
+    (root / "fonts" / "shop.woff").write_bytes(b"font")
+    (root / "css" / "print.css").write_text(
+        ".a { background: url(img/bg.png) }\n"
+        "@font-face { src: url('/fonts/shop.woff') }\n"
+        ".b { background: url(data:image/gif;base64,R0lGOD) }\n"
+        ".c { background: url(gone.png) }\n"
+    )
+
+    path = cache.fetch(f"{base}/css/print.css")
+    assert path.endswith(".css")
+    css = pathlib.Path(path).read_text()
+
+    bg, font, _, _ = re.findall(r"url\('?([^')]+)", css)
+    assert pathlib.Path(local_path(bg)).read_bytes() == b"background"
+    assert pathlib.Path(local_path(font)).read_bytes() == b"font"
+    assert "url(data:image/gif;base64,R0lGOD)" in css
+    # A reference that can't be fetched still has to work from a file:// stylesheet
+    assert f"url({base}/css/gone.png)" in css
+
+
+def test_write_failure_keeps_remote_url(autoprint, cache, site, monkeypatch):
+    base, root, _ = site
+    (root / "logo.png").write_bytes(b"\x89PNG logo")
+
+    def disk_full(src, dst):
+        raise OSError(28, "No space left on device")
+
+    monkeypatch.setattr(autoprint.os, "replace", disk_full)
+    page = f'<img src="{base}/logo.png">'
+
+    assert cache.localize(page) == page
+    assert [name for name in os.listdir(cache.cache_dir) if name.endswith(".tmp")] == []
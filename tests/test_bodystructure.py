@@ -0,0 +1,52 @@
+import pytest
+
+PLAIN = b'("text" "plain" ("charset" "utf-8") NIL NIL "7bit" 120 4 NIL NIL NIL NIL)'
+HTML = b'("text" "html" ("charset" "utf-8") NIL NIL "quoted-printable" 900 30 NIL NIL NIL NIL)'
+HTML_ATTACHMENT = (b'("text" "html" ("charset" "utf-8") NIL NIL "base64" 800 12 NIL '
+                   b'("attachment" ("filename" "invoice.html")) NIL NIL)')
+LOGO = b'("image" "png" ("name" "logo.png") "<logo>" NIL "base64" 5000 NIL ("inline" NIL) NIL NIL)'
+PDF = b'("application" "pdf" ("name" "slip.pdf") NIL NIL "base64" 9000 NIL ("attachment" ("filename" "slip.pdf")) NIL NIL)'
+
+
+def multipart(subtype, *parts):
+    return b"(" + b"".join(parts) + b' "' + subtype + b'" ("boundary" "b") NIL NIL)'
+
+
+@pytest.fixture
+def choose(autoprint):
+    """choose_printable_part() for a BODYSTRUCTURE as the server sends it."""
+    def run(raw):
+        [structure] = autoprint._parse_imap_list(iter(autoprint._imap_tokens([raw])))
+        return autoprint.choose_printable_part(structure)
+    return run
+
+
+def test_single_part(choose):
+    assert choose(PLAIN) == ("1", "text/plain", "utf-8", "7bit")
+
+
+def test_alternative_prefers_html(choose):
+    assert choose(multipart(b"alternative", PLAIN, HTML)) == ("2", "text/html", "utf-8", "quoted-printable")
+
+
+def test_mixed_skips_attachments(choose):
+    assert choose(multipart(b"mixed", multipart(b"alternative", PLAIN, HTML), PDF)) == (
+        "1.2", "text/html", "utf-8", "quoted-printable")
+    # An HTML file attached to a plain-text email is not the email's body
+    assert choose(multipart(b"mixed", PLAIN, HTML_ATTACHMENT)) == ("1", "text/plain", "utf-8", "7bit")
+
+
+def test_nested_multiparts(choose):
+    related = multipart(b"related", multipart(b"alternative", PLAIN, HTML), LOGO)
+    assert choose(multipart(b"mixed", related, PDF))[0] == "1.1.2"
+
+
+def test_charset_and_encoding_pass_through(choose):
+    legacy = b'("text" "plain" ("format" "flowed" "charset" "windows-1252") NIL NIL "base64" 60 2 NIL NIL NIL NIL)'
+    assert choose(legacy) == ("1", "text/plain", "windows-1252", "base64")
+    bare = b'("text" "plain" NIL NIL NIL NIL 60 2 NIL NIL NIL NIL)'
+    assert choose(bare) == ("1", "text/plain", None, "7bit")
+
+
+def test_no_text_part(choose):
+    assert choose(multipart(b"mixed", LOGO, PDF)) is None
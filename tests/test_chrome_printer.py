@@ -0,0 +1,46 @@
+import os
+import sys
+import types
+
+import pytest
+
+pytestmark = pytest.mark.skipif(os.name == "nt", reason="stub Chrome is a shebang script")
+
+
+@pytest.fixture
+def kiosk(autoprint, tmp_path, monkeypatch):
+    """A kiosk ChromePrinter whose Chrome is a script that runs for the given number of seconds."""
+    def make(seconds):
+        chrome = tmp_path / "chrome"
+        chrome.write_text(f"#!{sys.executable}\nimport time\ntime.sleep({seconds})\n")
+        chrome.chmod(0o755)
+        monkeypatch.setattr(autoprint, "CHROME_PATH", str(chrome))
+        ui = types.SimpleNamespace(waits=[], record_print_wait=lambda waited, timed_out=False: ui.waits.append(timed_out))
+        return autoprint.ChromePrinter(ui), ui
+    monkeypatch.setattr(autoprint, "CHROME_PRINT_WAIT_SECONDS", 1)
+    return make
+
+
+def test_chrome_exit_confirms_print(kiosk):
+    printer, ui = kiosk(0)
+    assert printer.submit("/tmp/page.html") is True
+    assert ui.waits == [False]
+
+
+def test_timeout_is_unconfirmed_not_printed(kiosk):
+    printer, ui = kiosk(30)
+    assert printer.submit("/tmp/page.html") is False
+    assert ui.waits == [True]
+
+
+def test_timeout_can_be_retried(autoprint, kiosk, monkeypatch):
+    monkeypatch.setattr(autoprint, "CHROME_RETRY_ON_TIMEOUT", True)
+    printer, _ = kiosk(30)
+    with pytest.raises(RuntimeError, match="did not finish"):
+        printer.submit("/tmp/page.html")
+
+
+def test_job_outcome(autoprint):
+    assert autoprint.job_outcome(False) == "failed"
+    assert autoprint.job_outcome(True, unconfirmed=True) == "unconfirmed"
+    assert autoprint.job_outcome(True) == "printed"
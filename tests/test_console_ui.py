@@ -0,0 +1,20 @@
+import time
+
+
+def test_throttled_change_is_drawn_at_the_end_of_the_window(autoprint, monkeypatch, capsys):
+    monkeypatch.setattr(autoprint, "UI_MAX_FPS", 5)
+    ui = autoprint.ConsoleUI()
+    try:
+        ui.render()
+        ui.update_status("First status")
+        ui.render()
+        ui.update_status("Second status")
+        ui.render()
+        assert "Second status" not in capsys.readouterr().out
+
+        time.sleep(0.4)
+        out = capsys.readouterr().out
+        assert "Second status" in out
+        assert ui.redraw_timer is None
+    finally:
+        ui.restore_terminal()
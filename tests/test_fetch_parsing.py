@@ -0,0 +1,116 @@
+import threading
+import types
+
+import pytest
+
+
+def literal(data):
+    return b"{%d}\r\n" % len(data) + data
+
+
+def serve(server, responses):
+    """Answer each command read from the client with the next canned response and a tagged OK."""
+    def run():
+        for response in responses:
+            tag = server.readline().split()[0]
+            server.send(response + tag + b" OK FETCH completed\r\n")
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    return thread
+
+
+@pytest.fixture
+def uid_fetch(imap):
+    """Run one UID FETCH through imaplib against a canned server response; returns imaplib's data."""
+    conn, server = imap
+    conn.state = "SELECTED"
+
+    def fetch(response):
+        thread = serve(server, [response])
+        status, data = conn.uid("fetch", "1:*", "(UID BODY.PEEK[HEADER.FIELDS (SUBJECT)])")
+        thread.join()
+        assert status == "OK"
+        return data
+    return fetch
+
+
+def test_literals_for_several_uids(autoprint, uid_fetch):
+    first = b"Subject: Order #1\r\n\r\n"
+    second = b"Subject: Order (2)\r\n\r\n"
+    data = uid_fetch(
+        b"* 1 FETCH (UID 11 BODY[HEADER.FIELDS (SUBJECT)] " + literal(first) + b")\r\n"
+        b"* 2 FETCH (UID 12 BODY[HEADER.FIELDS (SUBJECT)] " + literal(second) + b")\r\n"
+    )
+    parsed = autoprint.parse_fetch_response(data)
+    assert set(parsed) == {"11", "12"}
+    assert autoprint.find_fetch_item(parsed["11"], "BODY[HEADER") == first
+    assert autoprint.find_fetch_item(parsed["12"], "BODY[HEADER") == second
+
+
+def test_nil_and_items_after_a_literal(autoprint, uid_fetch):
+    body = b"<p>hello</p>"
+    data = uid_fetch(
+        b"* 1 FETCH (UID 11 BODY[1] NIL)\r\n"
+        b"* 2 FETCH (FLAGS (\\Seen) UID 12 BODY[1] " + literal(body) + b" INTERNALDATE \"17-Oct-2026 10:00:00 +0000\")\r\n"
+    )
+    parsed = autoprint.parse_fetch_response(data)
+    assert parsed["11"]["BODY[1]"] is None
+    assert parsed["12"]["BODY[1]"] == body
+    assert parsed["12"]["FLAGS"] == ["\\Seen"]
+    assert parsed["12"]["INTERNALDATE"] == "17-Oct-2026 10:00:00 +0000"
+
+
+def test_nested_bodystructure_and_quoted_strings(autoprint, uid_fetch):
+    data = uid_fetch(
+        b'* 1 FETCH (UID 11 BODYSTRUCTURE (("text" "plain" ("charset" "utf-8") NIL NIL "7bit" 12 1 NIL NIL NIL)'
+        b'("text" "html" ("charset" "utf-8") NIL "a \\"quoted\\" name" "quoted-printable" 40 2 NIL NIL NIL)'
+        b' "alternative" ("boundary" "b1") NIL NIL))\r\n'
+    )
+    structure = autoprint.parse_fetch_response(data)["11"]["BODYSTRUCTURE"]
+    plain, rich = structure[0], structure[1]
+    assert plain[:3] == ["text", "plain", ["charset", "utf-8"]]
+    assert rich[4] == 'a "quoted" name'
+    assert rich[5] == "quoted-printable"
+    assert structure[2:4] == ["alternative", ["boundary", "b1"]]
+
+
+def test_unsolicited_fetch_without_uid_is_ignored(autoprint, uid_fetch):
+    data = uid_fetch(
+        b"* 4 FETCH (FLAGS (\\Seen \\Deleted))\r\n"
+        b"* 1 FETCH (UID 11 BODY[1] " + literal(b"x") + b")\r\n"
+    )
+    assert set(autoprint.parse_fetch_response(data)) == {"11"}
+
+
+def test_vanished_uids_are_skipped_not_waited_for(autoprint, imap, monkeypatch):
+    """UIDs left out of an OK FETCH (expunged meanwhile) are recorded so the watermark can pass them."""
+    conn, server = imap
+    conn.state = "SELECTED"
+    monkeypatch.setattr(autoprint, "PARTIAL_FETCH_ENABLED", True)
+    structure = b'("text" "html" ("charset" "utf-8") NIL NIL "7bit" 20 1 NIL NIL NIL)'
+    headers = serve(server, [
+        # 13 vanished before the header fetch
+        b"* 1 FETCH (UID 11 BODYSTRUCTURE " + structure + b" BODY[HEADER.FIELDS (SUBJECT)] "
+        + literal(b"Subject: [PRINT] one\r\n\r\n") + b")\r\n"
+        b"* 2 FETCH (UID 12 BODYSTRUCTURE " + structure + b" BODY[HEADER.FIELDS (SUBJECT)] "
+        + literal(b"Subject: [PRINT] two\r\n\r\n") + b")\r\n",
+        # 12 vanished before the body fetch
+        b"* 1 FETCH (UID 11 BODY[1] " + literal(b"<p>one</p>") + b")\r\n",
+    ])
+
+    watcher = autoprint.MailboxWatcher.__new__(autoprint.MailboxWatcher)
+    watcher.conn = conn
+    watcher.account = types.SimpleNamespace(subject_prefix="[PRINT]", mailbox="INBOX")
+    watcher.ui = types.SimpleNamespace(render=lambda: None)
+    watcher.set_status = lambda status: None
+    watcher.log = lambda message, level="INFO": None
+    skipped = []
+    watcher._save_printed_uid = skipped.append
+
+    fetched = list(watcher.fetch_messages_batched([b"11", b"12", b"13"]))
+    headers.join()
+
+    assert [(uid, subject, parts) for uid, subject, parts, _, _ in fetched] == [
+        (b"11", "[PRINT] one", ("<p>one</p>", None)),
+    ]
+    assert skipped == ["13", "12"]
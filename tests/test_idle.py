@@ -0,0 +1,100 @@
+import imaplib
+import select
+import socket
+import threading
+
+import pytest
+
+
+@pytest.fixture
+def idling(autoprint, imap):
+    """(watcher, server) with the watcher's connection in IDLE."""
+    conn, server = imap
+    watcher = autoprint.MailboxWatcher.__new__(autoprint.MailboxWatcher)
+    watcher.conn = conn
+    watcher.idle_tag = None
+    watcher.idle_buffer = b""
+    watcher.exists = 3
+    watcher.last_activity = 0.0
+
+    def accept_idle():
+        tag = server.readline().split()[0]
+        server.send(b"+ idling\r\n")
+        return tag
+
+    accepted = []
+    thread = threading.Thread(target=lambda: accepted.append(accept_idle()))
+    thread.start()
+    assert watcher.start_idle()
+    thread.join()
+    watcher.server_tag = accepted[0]
+    return watcher, server
+
+
+def wait_readable(sock):
+    select.select([sock], [], [], 5)
+
+
+def test_partial_line_is_kept_until_complete(idling):
+    watcher, server = idling
+    server.send(b"* 4 EXI")
+    wait_readable(watcher.conn.sock)
+    assert watcher.read_idle_notifications(socket_readable=True) is False
+    assert watcher.idle_buffer == b"* 4 EXI"
+
+    server.send(b"STS\r\n* 1 FETCH (FLAGS ())\r\n")
+    wait_readable(watcher.conn.sock)
+    assert watcher.read_idle_notifications(socket_readable=True) is True
+    assert watcher.idle_buffer == b""
+
+
+def test_stop_idle_finishes_a_half_read_line(idling):
+    watcher, server = idling
+    server.send(b"* 4 EXI")
+    wait_readable(watcher.conn.sock)
+    watcher.read_idle_notifications(socket_readable=True)
+
+    def finish():
+        assert server.readline() == b"DONE\r\n"
+        server.send(b"STS\r\n" + watcher.server_tag + b" OK IDLE terminated\r\n")
+
+    thread = threading.Thread(target=finish)
+    thread.start()
+    assert watcher.stop_idle() is True
+    thread.join()
+
+
+def test_closed_connection_is_an_abort(idling):
+    watcher, server = idling
+    server.sock.shutdown(socket.SHUT_WR)
+    wait_readable(watcher.conn.sock)
+    with pytest.raises(imaplib.IMAP4.abort):
+        watcher.read_idle_notifications(socket_readable=True)
+
+
+def test_only_a_rising_exists_count_skips_idle(autoprint):
+    class Conn:
+        def __init__(self, responses):
+            self.untagged_responses = responses
+
+        def response(self, code):
+            return code, self.untagged_responses.pop(code, [None])
+
+    watcher = autoprint.MailboxWatcher.__new__(autoprint.MailboxWatcher)
+    watcher.exists = 5
+    # Servers that repeat RECENT and the unchanged EXISTS on every response
+    watcher.conn = Conn({"RECENT": [b"1"], "EXISTS": [b"5"]})
+    assert watcher._mailbox_grew() is False
+    assert watcher.conn.untagged_responses == {}
+
+    watcher.conn = Conn({"EXPUNGE": [b"2", b"2"], "EXISTS": [b"4"]})
+    assert watcher._mailbox_grew() is True
+    assert watcher.exists == 4
+
+
+@pytest.mark.skipif(not hasattr(socket, "TCP_KEEPIDLE"), reason="Linux keepalive options")
+def test_keepalive_probes_after_the_noop_interval(autoprint):
+    with socket.socket() as sock:
+        autoprint.enable_tcp_keepalive(sock, 120)
+        assert sock.getsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE)
+        assert sock.getsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPIDLE) == 120
@@ -0,0 +1,104 @@
+import json
+import os
+from types import SimpleNamespace
+
+import pytest
+
+
+@pytest.fixture
+def paths(tmp_path):
+    return str(tmp_path / "journal.jsonl"), str(tmp_path / "spool")
+
+
+@pytest.fixture
+def open_journal(autoprint, paths):
+    journals = []
+
+    def open_():
+        journals.append(autoprint.JobJournal(*paths))
+        return journals[-1]
+    yield open_
+    for journal in journals:
+        if not journal.file.closed:
+            journal.close()
+
+
+def make_job(journal_id, uid):
+    watcher = SimpleNamespace(account=SimpleNamespace(state_key="shop@example.com/INBOX"))
+    return SimpleNamespace(journal_id=journal_id, uid=uid, uidvalidity=7, subject="Order %d" % uid,
+                           message_id="<%d@example.com>" % uid, priority=5, watcher=watcher,
+                           html_part="<p>%d</p>" % uid, text_part=None)
+
+
+def test_reopen_replays_unfinished_jobs_and_skips_a_torn_line(open_journal, paths):
+    journal = open_journal()
+    for uid in (1, 2, 3):
+        journal.fetched(make_job("job-%d" % uid, uid))
+    journal.record(["job-1"], "rendered", artifact="/spool/job-1.pdf")
+    journal.record(["job-2"], "flagged")
+    journal.close()
+    with open(paths[0], "a", encoding="utf-8") as f:
+        f.write('{"id": "job-3", "stage": "fla')  # crash mid-write
+
+    journal = open_journal()
+    records = {record["id"]: record for record in journal.unfinished()}
+    assert sorted(records) == ["job-1", "job-3"]
+    assert records["job-1"]["stage"] == "rendered"
+    assert records["job-1"]["artifact"] == "/spool/job-1.pdf"
+    assert records["job-3"]["stage"] == "fetched"
+    with open(records["job-3"]["body"], encoding="utf-8") as f:
+        assert json.load(f)["html"] == "<p>3</p>"
+
+    # Appends after the torn line still replay
+    journal.record(["job-3"], "deleted")
+    journal.close()
+    assert [record["id"] for record in open_journal().unfinished()] == ["job-1"]
+
+
+def test_unknown_ids_are_not_recorded(open_journal, paths):
+    journal = open_journal()
+    journal.record(["never-fetched"], "rendered", artifact="x.pdf")
+    journal.close()
+    assert os.path.getsize(paths[0]) == 0
+
+
+def test_sync_fsyncs_once_for_everything_written(autoprint, open_journal, monkeypatch):
+    fsyncs = []
+    monkeypatch.setattr(autoprint.os, "fsync", fsyncs.append)
+    journal = open_journal()
+    for uid in (1, 2, 3):
+        journal.fetched(make_job("job-%d" % uid, uid))
+    assert fsyncs == []
+
+    journal.sync()
+    assert len(fsyncs) == 1
+    journal.sync()  # nothing new written
+    assert len(fsyncs) == 1
+
+    journal.record(["job-1", "job-2"], "printed")
+    journal.sync()
+    assert len(fsyncs) == 2
+
+
+def test_compaction_keeps_only_unfinished_jobs(open_journal, paths):
+    journal = open_journal()
+    for uid in (1, 2, 3):
+        journal.fetched(make_job("job-%d" % uid, uid))
+    journal.record(["job-1"], "printed")
+    journal.record(["job-2", "job-3"], "flagged")
+    spooled = set(os.listdir(paths[1]))
+
+    journal.compact()  # under COMPACT_AFTER_RECORDS and within the grace period
+    assert set(os.listdir(paths[1])) == spooled
+
+    journal.compact(force=True)
+    with open(paths[0], encoding="utf-8") as f:
+        lines = [json.loads(line) for line in f]
+    assert [(line["id"], line["stage"]) for line in lines] == [("job-1", "printed")]
+    assert os.listdir(paths[1]) == [os.path.basename(lines[0]["body"])]
+    assert journal.compact_deadline() is None
+
+    # The rewritten journal is still appended to and replays
+    journal.record(["job-1"], "deleted")
+    journal.close()
+    assert open_journal().unfinished() == []
@@ -0,0 +1,82 @@
+import os
+import tempfile
+import time
+import types
+from datetime import datetime, timedelta
+
+import pytest
+
+
+@pytest.fixture
+def ui():
+    return types.SimpleNamespace(update_cleanup_time=lambda when: None)
+
+
+@pytest.fixture
+def tmpdir_as_tempdir(tmp_path, monkeypatch):
+    monkeypatch.setattr(tempfile, "tempdir", str(tmp_path))
+    return tmp_path
+
+
+def test_temp_cleanup_is_due_when_the_oldest_file_expires(autoprint, ui, tmpdir_as_tempdir):
+    manager = autoprint.TempFileManager(ui)
+    max_age = autoprint.TEMP_FILE_CLEANUP_HOURS * 3600
+    assert manager.cleanup_deadline() == pytest.approx(manager.last_run + max_age)
+
+    path = manager.create_temp_file("Order", "<html></html>")
+    manager.tracked_files[path] = datetime.now() - timedelta(seconds=max_age - 30)
+    assert manager.cleanup_deadline() == pytest.approx(time.monotonic() + 30, abs=1)
+
+    manager.tracked_files[path] = datetime.now() - timedelta(seconds=max_age + 1)
+    assert manager.cleanup_deadline() <= time.monotonic()
+    manager.cleanup_old_files()
+    assert not os.path.exists(path)
+    assert manager.cleanup_deadline() == pytest.approx(time.monotonic() + max_age, abs=1)
+
+
+def test_pdf_cache_deadline_follows_least_recently_used(autoprint, ui, tmpdir_as_tempdir):
+    cache = autoprint.PdfCache(ui)
+    assert cache.evict_deadline() is None
+    max_age = autoprint.PDF_CACHE_MAX_AGE_HOURS * 3600
+    cache.entries = {"a": [10, time.time() - max_age + 120], "b": [10, time.time()]}
+    assert cache.evict_deadline() == pytest.approx(time.monotonic() + 120, abs=1)
+
+
+def test_asset_cache_deadline_follows_least_recently_used(autoprint, tmpdir_as_tempdir):
+    cache = autoprint.AssetCache()
+    try:
+        assert cache.evict_deadline() is None
+        ttl = autoprint.ASSET_CACHE_TTL_HOURS * 3600
+        cache.entries = {"a": ["a.png", 10, time.time() - ttl + 300]}
+        assert cache.evict_deadline() == pytest.approx(time.monotonic() + 300, abs=1)
+    finally:
+        cache.executor.shutdown()
+
+
+def test_daily_steps_are_due_once_a_day(autoprint, tmp_path):
+    store = autoprint.StateStore(str(tmp_path / "state.db"))
+    job_log = autoprint.JobLog(str(tmp_path / "jobs"))
+    try:
+        for deadline, run in ((store.compact_deadline, store.compact), (job_log.prune_deadline, job_log.prune)):
+            assert deadline() <= time.monotonic()
+            run()
+            assert deadline() == pytest.approx(time.monotonic() + 24 * 3600, abs=1)
+    finally:
+        store.close()
+        job_log.close()
+
+
+def test_journal_compaction_waits_for_finished_files(autoprint, tmp_path):
+    journal = autoprint.JobJournal(str(tmp_path / "journal.jsonl"), str(tmp_path / "spool"))
+    try:
+        assert journal.compact_deadline() is None
+        journal.record(["a/1/7"], "fetched", body=str(tmp_path / "body.json"))
+        assert journal.compact_deadline() is None
+        journal.record(["a/1/7"], "flagged")
+        assert journal.compact_deadline() == pytest.approx(
+            time.monotonic() + journal.FINISHED_FILE_GRACE_SECONDS, abs=1)
+
+        journal.records_since_compact = journal.COMPACT_AFTER_RECORDS
+        assert journal.compact_deadline() <= time.monotonic()
+    finally:
+        journal.close()
@@ -0,0 +1,61 @@
+import asyncio
+import random
+import time
+import types
+
+
+def make_job(autoprint, n, printer="", priority=None):
+    return types.SimpleNamespace(
+        uid=str(n), subject=f"Order {n}", printer_name=printer, attempts=0, queued_at=time.monotonic(),
+        priority=autoprint.DEFAULT_PRIORITY if priority is None else priority,
+    )
+
+
+def run_merge_worker(autoprint, feed):
+    """Run _merge_worker while `feed(render_queue)` puts jobs; returns what reached the merge queue."""
+    async def main():
+        daemon = types.SimpleNamespace(render_queue=autoprint.AgingPriorityQueue(),
+                                       merge_queue=autoprint.AgingPriorityQueue(), merging=0)
+        worker = asyncio.ensure_future(autoprint.ImapPrintDaemon._merge_worker(daemon))
+        await feed(daemon.render_queue)
+        await asyncio.sleep(autoprint.MERGE_WINDOW_SECONDS * 3)
+        worker.cancel()
+        await asyncio.gather(worker, return_exceptions=True)
+        out = []
+        while not daemon.merge_queue.empty():
+            out.append(daemon.merge_queue.get_nowait())
+        return out, daemon.merging
+    return asyncio.run(main())
+
+
+def test_bursts_are_merged_per_printer(autoprint, monkeypatch):
+    monkeypatch.setattr(autoprint, "MERGE_BATCH_SIZE", 3)
+    monkeypatch.setattr(autoprint, "MERGE_WINDOW_SECONDS", 0.05)
+
+    async def feed(render_queue):
+        for n in range(4):
+            await render_queue.put(make_job(autoprint, n, printer="a"))
+        await render_queue.put(make_job(autoprint, 9, printer="b"))
+        await render_queue.put(make_job(autoprint, 10, printer="a", priority=1))
+
+    out, merging = run_merge_worker(autoprint, feed)
+    batches = [[member.uid for member in getattr(job, "members", [job])] for job in out]
+    # The urgent job skips the batch; the rest go out when full or when the window closes
+    assert sorted(batches) == [["0", "1", "2"], ["10"], ["3"], ["9"]]
+    assert merging == 0
+
+
+def test_no_job_is_lost_when_a_window_closes_as_it_arrives(autoprint, monkeypatch):
+    monkeypatch.setattr(autoprint, "MERGE_BATCH_SIZE", 50)
+    monkeypatch.setattr(autoprint, "MERGE_WINDOW_SECONDS", 0.002)
+    random.seed(7)
+
+    async def feed(render_queue):
+        for n in range(300):
+            await render_queue.put(make_job(autoprint, n))
+            await asyncio.sleep(random.choice([0, 0.001, 0.002, 0.003]))
+
+    out, merging = run_merge_worker(autoprint, feed)
+    uids = [member.uid for job in out for member in getattr(job, "members", [job])]
+    assert sorted(uids, key=int) == [str(n) for n in range(300)]
+    assert merging == 0
@@ -0,0 +1,46 @@
+import asyncio
+import time
+import types
+
+
+def make_job(name, priority, waited=0.0):
+    return types.SimpleNamespace(name=name, priority=priority, queued_at=time.monotonic() - waited)
+
+
+def drain(autoprint, jobs):
+    async def main():
+        queue = autoprint.AgingPriorityQueue()
+        for job in jobs:
+            queue.put_nowait(job)
+        return [queue.get_nowait().name for _ in jobs]
+    return asyncio.run(main())
+
+
+def test_most_urgent_first_then_oldest(autoprint, monkeypatch):
+    monkeypatch.setattr(autoprint, "PRIORITY_AGING_SECONDS", 0)
+    jobs = [make_job("normal-new", 5, 1), make_job("low", 9, 3), make_job("urgent", 1),
+            make_job("normal-old", 5, 2)]
+    assert drain(autoprint, jobs) == ["urgent", "normal-old", "normal-new", "low"]
+
+
+def test_waiting_promotes_a_low_priority_job(autoprint, monkeypatch):
+    monkeypatch.setattr(autoprint, "PRIORITY_AGING_SECONDS", 60)
+    # Waited 5 minutes at priority 9: ranks as priority 4, ahead of fresh normal jobs
+    jobs = [make_job("normal", 5), make_job("starved", 9, 300), make_job("urgent", 1)]
+    assert drain(autoprint, jobs) == ["urgent", "starved", "normal"]
+
+    jobs = [make_job("normal", 5), make_job("low", 9, 60)]
+    assert drain(autoprint, jobs) == ["normal", "low"]
+
+
+def test_count_by_priority_counts_merged_members(autoprint):
+    async def main():
+        queue = autoprint.AgingPriorityQueue()
+        members = [types.SimpleNamespace(priority=p) for p in (5, 5, 1)]
+        queue.put_nowait(types.SimpleNamespace(priority=1, queued_at=0, members=members))
+        queue.put_nowait(types.SimpleNamespace(priority=9, queued_at=0,
+                                               members=[types.SimpleNamespace(priority=9)]))
+        counts = {}
+        queue.count_by_priority(counts)
+        return counts
+    assert asyncio.run(main()) == {5: 2, 1: 1, 9: 1}
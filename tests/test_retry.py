@@ -0,0 +1,82 @@
+import asyncio
+import types
+from concurrent.futures import ThreadPoolExecutor
+
+
+class Job:
+    def __init__(self, artifact_path=None):
+        self.subject = "Order 1"
+        self.attempts = 0
+        self.artifact_path = artifact_path
+        self.retry_at = None
+        self.members = [types.SimpleNamespace(journal_id="job-1")]
+        self.errors = []
+
+    def log(self, message, level="INFO"):
+        pass
+
+    def add_error(self, message):
+        self.errors.append(message)
+
+
+class Journal:
+    def __init__(self):
+        self.records = []
+
+    def record(self, job_ids, stage, **fields):
+        self.records.append((stage, fields))
+
+
+def make_daemon(autoprint):
+    daemon = types.SimpleNamespace(journal=Journal(), job_executor=ThreadPoolExecutor(1),
+                                   scheduled=[], finished=[])
+    daemon._report_failure = lambda job, e: None
+    daemon._schedule_retry = daemon.scheduled.append
+    daemon._dead_letter = lambda job: autoprint.ImapPrintDaemon._dead_letter(daemon, job)
+
+    async def finish_job(job, success):
+        daemon.finished.append(success)
+    daemon._finish_job = finish_job
+    return daemon
+
+
+def fail(autoprint, daemon, job):
+    asyncio.run(autoprint.ImapPrintDaemon._job_failed(daemon, job, RuntimeError("printer offline")))
+
+
+def test_backoff_doubles_up_to_the_cap(autoprint, monkeypatch):
+    monkeypatch.setattr(autoprint, "RETRY_MAX_ATTEMPTS", 10)
+    monkeypatch.setattr(autoprint, "RETRY_BACKOFF_INITIAL_SECONDS", 30)
+    monkeypatch.setattr(autoprint, "RETRY_BACKOFF_MAX_SECONDS", 200)
+    monkeypatch.setattr(autoprint.time, "time", lambda: 1000.0)
+    daemon, job = make_daemon(autoprint), Job()
+
+    delays = []
+    for _ in range(5):
+        fail(autoprint, daemon, job)
+        delays.append(job.retry_at - 1000.0)
+    assert delays == [30, 60, 120, 200, 200]
+    assert len(daemon.scheduled) == 5 and daemon.finished == []
+    assert daemon.journal.records[-1] == ("retry", {"attempts": 5, "retry_at": 1200.0})
+
+
+def test_dead_letter_after_max_attempts_keeps_the_artifact(autoprint, monkeypatch, tmp_path):
+    dead_letter_dir = tmp_path / "dead"
+    monkeypatch.setattr(autoprint, "DEAD_LETTER_DIR", str(dead_letter_dir))
+    monkeypatch.setattr(autoprint, "RETRY_MAX_ATTEMPTS", 3)
+    artifact = tmp_path / "order-1.pdf"
+    artifact.write_bytes(b"%PDF-1.4")
+    daemon, job = make_daemon(autoprint), Job(str(artifact))
+
+    fail(autoprint, daemon, job)
+    fail(autoprint, daemon, job)
+    assert daemon.finished == [] and artifact.exists()
+
+    fail(autoprint, daemon, job)
+    assert daemon.finished == [False]
+    assert len(daemon.scheduled) == 2
+    assert not artifact.exists()
+    assert (dead_letter_dir / "order-1.pdf").read_bytes() == b"%PDF-1.4"
+    assert job.artifact_path is None
+    assert job.errors == ["Gave up after 3 attempts"]
+    assert daemon.journal.records[-1] == ("dead_letter", {"artifact": None})
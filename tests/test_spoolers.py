@@ -0,0 +1,195 @@
+import http.server
+import json
+import os
+import struct
+import sys
+import threading
+
+import pytest
+
+
+# ==========================
+# lp / lpr
+# ==========================
+
+@pytest.fixture
+def stub_lp(tmp_path):
+    """An executable standing in for lp/lpr: records its argv, fails when told to."""
+    calls = tmp_path / "calls.jsonl"
+    script = tmp_path / "lp"
+    script.write_text(
+        f"#!{sys.executable}\n"
+        "import json, os, sys\n"
+        f"with open({str(calls)!r}, 'a') as f:\n"
+        "    f.write(json.dumps(sys.argv[1:]) + '\\n')\n"
+        "if os.environ.get('STUB_LP_FAIL'):\n"
+        "    sys.stderr.write('lp: printer offline\\n')\n"
+        "    sys.exit(1)\n"
+    )
+    script.chmod(0o755)
+
+    def read_calls():
+        if not calls.exists():
+            return []
+        return [json.loads(line) for line in calls.read_text().splitlines()]
+
+    return str(script), read_calls
+
+
+pytestmark_posix = pytest.mark.skipif(os.name == "nt", reason="stub lp is a shebang script")
+
+
+@pytestmark_posix
+def test_lp_sends_batch_as_one_job(autoprint, stub_lp):
+    command, calls = stub_lp
+    autoprint.CommandSpooler("lp", command).submit(["/tmp/a.pdf", "/tmp/b.pdf"], "zebra", "Orders")
+    assert calls() == [["-d", "zebra", "-t", "Orders", "/tmp/a.pdf", "/tmp/b.pdf"]]
+
+
+@pytestmark_posix
+def test_lp_without_printer_uses_default(autoprint, stub_lp):
+    command, calls = stub_lp
+    autoprint.CommandSpooler("lp", command).submit(["/tmp/a.pdf"])
+    assert calls() == [["-t", "AutoPrint", "/tmp/a.pdf"]]
+
+
+@pytestmark_posix
+def test_lpr_arguments(autoprint, stub_lp):
+    command, calls = stub_lp
+    autoprint.CommandSpooler("lpr", command).submit(["/tmp/a.pdf"], "zebra", "Orders")
+    assert calls() == [["-P", "zebra", "-J", "Orders", "/tmp/a.pdf"]]
+
+
+@pytestmark_posix
+def test_lp_failure_raises_with_stderr(autoprint, stub_lp, monkeypatch):
+    command, _ = stub_lp
+    monkeypatch.setenv("STUB_LP_FAIL", "1")
+    with pytest.raises(RuntimeError, match="printer offline"):
+        autoprint.CommandSpooler("lp", command).submit(["/tmp/a.pdf"], "zebra")
+
+
+def test_create_spooler(autoprint, monkeypatch):
+    monkeypatch.setattr(autoprint, "SPOOLER", "lpr")
+    monkeypatch.setattr(autoprint, "SPOOLER_COMMAND", "/opt/bin/lpr")
+    spooler = autoprint.create_spooler()
+    assert (spooler.kind, spooler.command) == ("lpr", "/opt/bin/lpr")
+
+    monkeypatch.setattr(autoprint, "SPOOLER", "ipp")
+    assert isinstance(autoprint.create_spooler(), autoprint.IppSpooler)
+
+    monkeypatch.setattr(autoprint, "SPOOLER", "carrier-pigeon")
+    monkeypatch.setattr(autoprint, "SPOOLER_COMMAND", "")
+    spooler = autoprint.create_spooler()
+    assert (spooler.kind, spooler.command) == ("lp", "lp")
+
+
+# ==========================
+# IPP
+# ==========================
+
+def parse_ipp_request(body):
+    """(operation, request id, {name: value}, document) from an IPP request body."""
+    _, operation, request_id = struct.unpack(">HHI", body[:8])
+    attributes = {}
+    pos = 8
+    while True:
+        tag = body[pos]
+        pos += 1
+        if tag == 0x03:
+            break
+        if tag < 0x10:
+            continue
+        name_len = struct.unpack(">H", body[pos:pos + 2])[0]
+        name = body[pos + 2:pos + 2 + name_len].decode("ascii")
+        pos += 2 + name_len
+        value_len = struct.unpack(">H", body[pos:pos + 2])[0]
+        value = body[pos + 2:pos + 2 + value_len]
+        pos += 2 + value_len
+        if tag in (0x21, 0x23):
+            value = struct.unpack(">i", value)[0]
+        elif tag == 0x22:
+            value = value == b"\x01"
+        else:
+            value = value.decode("utf-8")
+        attributes[name] = value
+    return operation, request_id, attributes, body[pos:]
+
+
+class FakeIppHandler(http.server.BaseHTTPRequestHandler):
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers["Content-Length"]))
+        operation, request_id, attributes, document = parse_ipp_request(body)
+        self.server.requests.append((self.path, operation, attributes, document))
+        name = b"job-id"
+        reply = struct.pack(">BBHI", 2, 0, self.server.status, request_id) + b"\x01"
+        reply += b"\x02" + struct.pack(">BH", 0x21, len(name)) + name + struct.pack(">Hi", 4, 42) + b"\x03"
+        self.send_response(200)
+        self.send_header("Content-Type", "application/ipp")
+        self.send_header("Content-Length", str(len(reply)))
+        self.end_headers()
+        self.wfile.write(reply)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def ipp_server():
+    server = http.server.HTTPServer(("127.0.0.1", 0), FakeIppHandler)
+    server.requests = []
+    server.status = 0x0000
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def pdfs(tmp_path):
+    paths = []
+    for i in range(2):
+        path = tmp_path / f"job{i}.pdf"
+        path.write_bytes(b"%PDF-1.4 job " + str(i).encode())
+        paths.append(str(path))
+    return paths
+
+
+def uri_template(server):
+    return f"ipp://127.0.0.1:{server.server_address[1]}/printers/{{printer}}"
+
+
+def test_ipp_single_file_is_print_job(autoprint, ipp_server, pdfs):
+    autoprint.IppSpooler(uri_template(ipp_server)).submit(pdfs[:1], "zebra", "Order 1")
+
+    [(path, operation, attributes, document)] = ipp_server.requests
+    assert path == "/printers/zebra"
+    assert operation == autoprint.IPP_PRINT_JOB
+    assert attributes["printer-uri"] == uri_template(ipp_server).format(printer="zebra")
+    assert attributes["job-name"] == "Order 1"
+    assert attributes["document-format"] == "application/pdf"
+    assert document == b"%PDF-1.4 job 0"
+
+
+def test_ipp_batch_is_create_job_then_send_documents(autoprint, ipp_server, pdfs):
+    autoprint.IppSpooler(uri_template(ipp_server)).submit(pdfs, "zebra")
+
+    operations = [(operation, attributes.get("job-id"), attributes.get("last-document"), document)
+                  for _, operation, attributes, document in ipp_server.requests]
+    assert operations == [
+        (autoprint.IPP_CREATE_JOB, None, None, b""),
+        (autoprint.IPP_SEND_DOCUMENT, 42, False, b"%PDF-1.4 job 0"),
+        (autoprint.IPP_SEND_DOCUMENT, 42, True, b"%PDF-1.4 job 1"),
+    ]
+
+
+def test_ipp_error_status_raises(autoprint, ipp_server, pdfs):
+    ipp_server.status = 0x0400  # client-error-bad-request
+    with pytest.raises(RuntimeError, match="0x0400"):
+        autoprint.IppSpooler(uri_template(ipp_server)).submit(pdfs[:1], "zebra")
+
+
+def test_ipp_template_needs_printer_name(autoprint, ipp_server, pdfs):
+    with pytest.raises(RuntimeError, match="PRINTER_NAME"):
+        autoprint.IppSpooler(uri_template(ipp_server)).submit(pdfs[:1], "")
+    assert ipp_server.requests == []
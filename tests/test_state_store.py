@@ -0,0 +1,118 @@
+import json
+import sqlite3
+import time
+
+import pytest
+
+ACCOUNT, MAILBOX = "shop@example.com", "INBOX"
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    return str(tmp_path / "state.db")
+
+
+@pytest.fixture
+def open_store(autoprint, db_path):
+    stores = []
+
+    def open_():
+        stores.append(autoprint.StateStore(db_path))
+        return stores[-1]
+    yield open_
+    for store in stores:
+        store.close()
+
+
+def committed_uids(db_path):
+    with sqlite3.connect(db_path) as conn:
+        return {uid for uid, in conn.execute("SELECT uid FROM printed")}
+
+
+def test_watermark_and_printed_set_survive_a_reopen(open_store):
+    store = open_store()
+    store.save_mailbox_state(ACCOUNT, MAILBOX, 7, 120)
+    for uid in (101, 115, 120):
+        store.mark_printed(ACCOUNT, MAILBOX, 7, uid)
+    store.close()
+
+    store = open_store()
+    assert store.load_mailbox_state(ACCOUNT, MAILBOX) == (7, 120)
+    assert store.printed_uids(ACCOUNT, MAILBOX, 7, [100, 101, 115, 120, 121]) == {101, 115, 120}
+    assert store.load_mailbox_state(ACCOUNT, "Orders") is None
+
+
+def test_writes_are_committed_in_batches(autoprint, open_store, db_path, monkeypatch):
+    monkeypatch.setattr(autoprint, "STATE_COMMIT_BATCH_SIZE", 3)
+    monkeypatch.setattr(autoprint, "STATE_COMMIT_INTERVAL_SECONDS", 3600)
+    store = open_store()
+    store.mark_printed(ACCOUNT, MAILBOX, 7, 1)
+    store.mark_printed(ACCOUNT, MAILBOX, 7, 2)
+    assert committed_uids(db_path) == set()
+    assert store.commit_deadline() is not None
+
+    store.commit_if_due()  # not due yet
+    assert committed_uids(db_path) == set()
+
+    store.mark_printed(ACCOUNT, MAILBOX, 7, 3)  # fills the batch
+    assert committed_uids(db_path) == {1, 2, 3}
+    assert store.commit_deadline() is None
+
+    monkeypatch.setattr(autoprint, "STATE_COMMIT_INTERVAL_SECONDS", 0)
+    store.mark_printed(ACCOUNT, MAILBOX, 7, 4)
+    store.commit_if_due()
+    assert committed_uids(db_path) == {1, 2, 3, 4}
+
+
+def test_uidvalidity_change_starts_a_fresh_printed_set(open_store):
+    store = open_store()
+    store.save_mailbox_state(ACCOUNT, MAILBOX, 7, 50)
+    store.mark_printed(ACCOUNT, MAILBOX, 7, 42)
+
+    # The server renumbered the mailbox: UID 42 is now a different message
+    store.save_mailbox_state(ACCOUNT, MAILBOX, 8, 0)
+    assert store.printed_uids(ACCOUNT, MAILBOX, 8, [42]) == set()
+    assert store.printed_uids(ACCOUNT, MAILBOX, 7, [42]) == {42}
+    assert store.load_mailbox_state(ACCOUNT, MAILBOX) == (8, 0)
+
+
+def test_compaction_keeps_what_a_search_can_still_return(autoprint, open_store, db_path):
+    store = open_store()
+    store.save_mailbox_state(ACCOUNT, MAILBOX, 8, 200)
+    for uidvalidity, uid in ((7, 150), (8, 150), (8, 190), (8, 250)):
+        store.mark_printed(ACCOUNT, MAILBOX, uidvalidity, uid)
+    store.commit()
+    old = time.time() - (autoprint.STATE_RETENTION_DAYS + 1) * 86400
+    store.conn.execute("UPDATE printed SET printed_at = ? WHERE uid IN (150, 250)", (old,))
+    store.commit()
+
+    store.compact()
+    store.close()
+
+    store = open_store()
+    # Old and at or below the watermark (or under an old UIDVALIDITY): gone. Recent, or
+    # above the watermark where a search still returns it: kept.
+    assert store.printed_uids(ACCOUNT, MAILBOX, 7, [150]) == set()
+    assert store.printed_uids(ACCOUNT, MAILBOX, 8, [150, 190, 250]) == {190, 250}
+    assert store.load_mailbox_state(ACCOUNT, MAILBOX) == (8, 200)
+
+
+def test_migration_from_the_old_files(autoprint, open_store, tmp_path, monkeypatch):
+    printed_file = tmp_path / "printed_uids.txt"
+    printed_file.write_text("101\n102\n\nnot-a-uid\n102\n")
+    uid_state = tmp_path / "uid_state.json"
+    uid_state.write_text(json.dumps({"state-key": {"uidvalidity": 7, "last_uid": "102"}}))
+    monkeypatch.setattr(autoprint, "UID_STATE_FILE", str(uid_state))
+
+    store = open_store()
+    store.migrate_printed_file(str(printed_file), ACCOUNT, MAILBOX, 7)
+    assert not printed_file.exists()
+    assert (tmp_path / "printed_uids.txt.migrated").exists()
+    # Nothing left to import the second time round
+    store.migrate_printed_file(str(printed_file), ACCOUNT, MAILBOX, 7)
+    store.close()
+
+    store = open_store()
+    assert store.printed_uids(ACCOUNT, MAILBOX, 7, [100, 101, 102]) == {101, 102}
+    assert autoprint.load_legacy_uid_state("state-key") == (7, 102)
+    assert autoprint.load_legacy_uid_state("other") is None
@@ -0,0 +1,79 @@
+import os
+import types
+
+import pytest
+
+
+def test_latin_text_fits_courier(autoprint):
+    assert autoprint.fits_text_font("Order #1001 – Café crème €4.50")
+    pdf = autoprint.render_text_pdf("Order #1001\nCafé crème")
+    assert pdf.startswith(b"%PDF-1.4")
+    assert b"(Caf\xe9 cr\xe8me) Tj" in pdf
+
+
+@pytest.mark.parametrize("text", ["Заказ № 1001", "注文 1001", "Order \U0001F4E6"])
+def test_non_latin_text_does_not_fit_courier(autoprint, text):
+    assert not autoprint.fits_text_font(text)
+    # Never print '?' in place of the characters
+    with pytest.raises(UnicodeEncodeError):
+        autoprint.render_text_pdf(text)
+
+
+class FakeChrome:
+    renders_pdf = True
+
+    def __init__(self, tmp_path):
+        self.tmp_path = tmp_path
+        self.rendered = []
+
+    def print_script(self, auto_print):
+        return ""
+
+    def render(self, html_path, auto_print):
+        with open(html_path, encoding="utf-8") as f:
+            self.rendered.append(f.read())
+        path = str(self.tmp_path / "chrome.pdf")
+        with open(path, "wb") as f:
+            f.write(b"%PDF-chrome")
+        return path
+
+
+class FakeTempManager:
+    def __init__(self, tmp_path):
+        self.tmp_path = tmp_path
+
+    def create_temp_file(self, subject, html_body, script):
+        path = str(self.tmp_path / "job.html")
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(html_body)
+        return path
+
+
+@pytest.fixture
+def render(autoprint, tmp_path):
+    """Run ImapPrintDaemon._render_artifact for a plain-text job; returns (job, chrome)."""
+    def run(text):
+        chrome = FakeChrome(tmp_path)
+        daemon = types.SimpleNamespace(native_text=True, pdf_cache=None, asset_cache=None,
+                                       chrome_printer=chrome, temp_manager=FakeTempManager(tmp_path))
+        watcher = types.SimpleNamespace(uidvalidity=1, account=types.SimpleNamespace(printer=""))
+        job = autoprint.PrintJob(watcher, b"7", "Order", (None, text))
+        autoprint.ImapPrintDaemon._render_artifact(daemon, job)
+        return job, chrome
+    return run
+
+
+def test_latin_body_is_rendered_natively(render):
+    job, chrome = render("Order #1001\nCafé crème")
+    assert chrome.rendered == []
+    with open(job.artifact_path, "rb") as f:
+        assert b"(Caf\xe9 cr\xe8me) Tj" in f.read()
+    os.remove(job.artifact_path)
+
+
+def test_non_latin_body_falls_back_to_chrome(render):
+    job, chrome = render("Заказ № 1001\n注文")
+    assert job.artifact_path.endswith("chrome.pdf")
+    [html] = chrome.rendered
+    assert "Заказ № 1001" in html
+    assert "注文" in html